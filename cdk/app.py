@@ -35,6 +35,10 @@ NagSuppressions.add_stack_suppressions(
             "id": "AwsSolutions-SQS3",
             "reason": "DLQ not used for Glue crawler for sample.",
         },
+        {
+            "id": "AwsSolutions-DDB3",
+            "reason": "DynamoDB tables only hold cache and processing state that can be rebuilt.",
+        },
         {
             "id": "AwsSolutions-ATH1",
             "reason": " Athena workgroup uses SSE_S3 encryption.",
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Benchmark: one application's feedback burst against another's, shared against per-application limits.
+
+A noisy application submits --noisy-events feedback at once and a quiet one
+--quiet-events right after, against a stub Bedrock that throttles above --quota
+requests per second. Each run processes the events with process_feedback:
+
+    shared    --concurrency workers take the events in arrival order, as one queue
+              (or direct invocations) drained by one Lambda does, and every call
+              paces on the shared Bedrock bucket of BEDROCK_REQUESTS_PER_SECOND
+    isolated  each application has its own workers, as its own SQS queue with the
+              max_concurrency of its event source does (--noisy-concurrency for the
+              noisy one, the rest for the quiet one), and the noisy application also
+              paces on its own bucket of APPLICATION_RATE_LIMITS (--noisy-share of
+              the shared rate)
+
+The run reports per application the feedback latency from the burst to its
+report (p50, p95), the failed events and the Bedrock throttles, then checks the
+EMF metrics of the isolated run carry the ApplicationId dimension.
+
+Usage:
+    python benchmarks/bench_application_isolation.py [--noisy-events 100] [--quiet-events 10] [--quota 20] [--concurrency 8]
+"""
+import argparse
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import stubs
+
+APPLICATIONS = ('noisy-application', 'quiet-application')
+
+
+def events(args):
+    """The noisy burst first, then the quiet application's feedback, each on its own conversation."""
+    counts = {'noisy-application': args.noisy_events, 'quiet-application': args.quiet_events}
+    return [stubs.feedback_event('msg-1', conversation_id=f'{application}-{n}', application_id=application)
+            for application in APPLICATIONS for n in range(counts[application])]
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))] if values else 0.0
+
+
+def run(mode, args, conversations, feedback_events):
+    import metrics
+
+    environment = {'RATE_LIMITING': 'memory', 'BEDROCK_REQUESTS_PER_SECOND': args.quota,
+                   'SES_EMAILS_PER_SECOND': 0, 'QBUSINESS_REQUESTS_PER_SECOND': 0,
+                   'RATE_LIMIT_BURST_SECONDS': 0.5, 'RATE_LIMIT_MAX_WAIT_SECONDS': 120,
+                   'APPLICATION_RATE_LIMITS': ''}
+    if mode == 'isolated':
+        environment['APPLICATION_RATE_LIMITS'] = json.dumps(
+            {'noisy-application': {'bedrock-runtime': args.quota * args.noisy_share}})
+    handler = stubs.load_handler(**environment)
+    bedrock = stubs.StubBedrockRuntime(args.model_ms / 1000).configure(max_rate=args.quota)
+    stubs.install_clients(qbusiness=stubs.StubQBusiness(conversations), s3=stubs.StubS3(),
+                          bedrock_runtime=bedrock, ses=stubs.StubSES())
+
+    lines = []
+    lock = threading.Lock()
+    latencies = {application: [] for application in APPLICATIONS}
+    failures = {application: 0 for application in APPLICATIONS}
+    started = time.perf_counter()
+
+    def process(event):
+        application = event['detail']['requestParameters']['applicationId']
+        try:
+            handler.process_feedback(event)
+        except Exception:
+            with lock:
+                failures[application] += 1
+            return
+        with lock:
+            latencies[application].append(time.perf_counter() - started)
+
+    metrics.METRICS_MODE = 'emf'
+    metrics.set_writer(lines.append)
+    try:
+        if mode == 'shared':
+            with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                list(pool.map(process, feedback_events))
+        else:
+            workers = {'noisy-application': args.noisy_concurrency,
+                       'quiet-application': args.concurrency - args.noisy_concurrency}
+            pools = {application: ThreadPoolExecutor(max_workers=workers[application]) for application in APPLICATIONS}
+            for event in feedback_events:
+                pools[event['detail']['requestParameters']['applicationId']].submit(process, event)
+            for pool in pools.values():
+                pool.shutdown(wait=True)
+    finally:
+        metrics.METRICS_MODE = 'off'
+        metrics.set_writer(None)
+
+    return latencies, failures, bedrock.throttles, [json.loads(line) for line in lines]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--noisy-events', type=int, default=100)
+    parser.add_argument('--quiet-events', type=int, default=10)
+    parser.add_argument('--quota', type=float, default=20, help='Bedrock requests per second before it throttles')
+    parser.add_argument('--model-ms', type=float, default=50, help='latency of each Bedrock call')
+    parser.add_argument('--concurrency', type=int, default=8, help='Lambda instances across both applications')
+    parser.add_argument('--noisy-concurrency', type=int, default=6, help='max_concurrency of the noisy application')
+    parser.add_argument('--noisy-share', type=float, default=0.6, help='share of the Bedrock rate the noisy application gets')
+    args = parser.parse_args()
+
+    stubs.load_handler()
+    feedback_events = events(args)
+    conversations = {event['detail']['requestParameters']['conversationId']: stubs.synthetic_conversation(2)
+                     for event in feedback_events}
+
+    print(f'{args.noisy_events} noisy and {args.quiet_events} quiet feedback events, Bedrock quota {args.quota:g}/s, '
+          f'{args.concurrency} instances')
+    print(f"{'mode':>9} {'application':>18} {'p50 s':>7} {'p95 s':>7} {'failed':>6} {'throttles':>9}")
+    for mode in ('shared', 'isolated'):
+        latencies, failures, throttles, documents = run(mode, args, conversations, feedback_events)
+        for application in APPLICATIONS:
+            print(f"{mode:>9} {application:>18} {statistics.median(latencies[application] or [0]):7.2f} "
+                  f"{percentile(latencies[application], 0.95):7.2f} {failures[application]:6d} {throttles:9d}")
+
+    model_documents = [document for document in documents if 'ModelOutputTokens' in document]
+    per_application = {application: sum(document.get('ApplicationId') == application for document in model_documents)
+                       for application in APPLICATIONS}
+    dimension_sets = {json.dumps(document['_aws']['CloudWatchMetrics'][0]['Dimensions']) for document in model_documents}
+    print(f'isolated run model metrics per ApplicationId: {per_application}, dimension sets: {", ".join(dimension_sets)}')
+
+
+if __name__ == '__main__':
+    main()
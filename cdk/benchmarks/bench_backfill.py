@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Benchmark: CloudTrail backfill throughput at different concurrencies.
+
+Writes synthetic gzipped CloudTrail log files (PutFeedback among other Q Business
+calls) to a temporary folder and replays them in persist-only mode with stub
+clients that inject ListMessages and S3 latency. A second run with the same
+checkpoint shows a resumed backfill skipping the finished files. With --moto the
+log files are served from a moto-mocked trail bucket instead of the folder.
+
+Usage:
+    python benchmarks/bench_backfill.py [--files 20] [--events-per-file 10] [--workers 1,4,16] [--moto]
+"""
+import argparse
+import gzip
+import json
+import os
+import tempfile
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import stubs
+
+ACCOUNT = '123456789012'
+REGION = 'us-east-1'
+PREFIX = f'AWSLogs/{ACCOUNT}/CloudTrail/{REGION}'
+
+
+def cloudtrail_record(event_name, event_time, request_parameters=None):
+    return {
+        'eventVersion': '1.09', 'eventTime': event_time.strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'eventSource': 'qbusiness.amazonaws.com', 'eventName': event_name, 'awsRegion': REGION,
+        'eventID': str(uuid.uuid4()), 'requestParameters': request_parameters, 'eventType': 'AwsApiCall',
+    }
+
+
+def write_log_files(folder, start, files, events_per_file):
+    """One log file per 5 minutes, each with events_per_file PutFeedback calls and as many other calls."""
+    for number in range(files):
+        delivered = start + timedelta(minutes=5 * number)
+        records = []
+        for event in range(events_per_file):
+            event_time = delivered - timedelta(seconds=event)
+            submitted_at = event_time.strftime('%Y-%m-%dT%H:%M:%SZ')
+            event_detail = stubs.feedback_event('msg-1', submitted_at=submitted_at)['detail']['requestParameters']
+            records.append(cloudtrail_record('PutFeedback', event_time, event_detail))
+            records.append(cloudtrail_record('ListMessages', event_time, {'applicationId': 'application-1'}))
+        key = f'{PREFIX}/{delivered:%Y/%m/%d}/{ACCOUNT}_CloudTrail_{REGION}_{delivered:%Y%m%dT%H%MZ}_{uuid.uuid4().hex[:16]}.json.gz'
+        path = os.path.join(folder, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with gzip.open(path, 'wt') as f:
+            json.dump({'Records': records}, f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=20)
+    parser.add_argument('--events-per-file', type=int, default=10)
+    parser.add_argument('--workers', default='1,4,16')
+    parser.add_argument('--list-ms', type=float, default=40)
+    parser.add_argument('--s3-ms', type=float, default=30)
+    parser.add_argument('--moto', action='store_true', help='read the log files from a moto-mocked S3 bucket')
+    args = parser.parse_args()
+
+    handler = stubs.load_handler()
+    import backfill
+
+    start = datetime(2024, 2, 2, tzinfo=timezone.utc)
+    end = start + timedelta(minutes=5 * args.files)
+
+    with tempfile.TemporaryDirectory() as folder:
+        write_log_files(folder, start + timedelta(minutes=5), args.files, args.events_per_file)
+
+        if args.moto:
+            from moto import mock_aws
+            mock = mock_aws()
+            mock.start()
+            import boto3
+            trail_s3 = boto3.client('s3', region_name=REGION)
+            trail_s3.create_bucket(Bucket='trail-bucket')
+            for root, _, names in os.walk(folder):
+                for name in names:
+                    path = os.path.join(root, name)
+                    trail_s3.upload_file(path, 'trail-bucket', os.path.relpath(path, folder))
+
+            def source():
+                return (backfill.list_s3_log_files(trail_s3, 'trail-bucket', PREFIX, start, end),
+                        lambda key: trail_s3.get_object(Bucket='trail-bucket', Key=key)['Body'])
+        else:
+            def source():
+                return backfill.list_local_log_files(folder, start, end), lambda path: open(path, 'rb')
+
+        print(f"{'workers':>7} {'files':>5} {'events':>6} {'failed':>6} {'seconds':>8} {'events/s':>9}")
+        for workers in (int(w) for w in args.workers.split(',')):
+            stubs.install_clients(
+                qbusiness=stubs.StubQBusiness({'conversation-1': stubs.synthetic_conversation(10)}, args.list_ms / 1000),
+                s3=stubs.StubS3(args.s3_ms / 1000))
+            log_files, open_log_file = source()
+            result = backfill.run_backfill(log_files, open_log_file,
+                                           process=lambda event: handler.process_feedback(event, persist_only=True),
+                                           start=start, end=end, workers=workers)
+            print(f"{workers:7d} {result['log_files']:5d} {result['feedback_events']:6d} {result['failed']:6d} "
+                  f"{result['seconds']:8.2f} {result['events_per_second']:9.1f}")
+
+        checkpoint_path = os.path.join(folder, 'checkpoint.json')
+        for label in ('first run', 'resumed'):
+            log_files, open_log_file = source()
+            result = backfill.run_backfill(log_files, open_log_file,
+                                           process=lambda event: handler.process_feedback(event, persist_only=True),
+                                           start=start, end=end, workers=16,
+                                           checkpoint=backfill.Checkpoint(checkpoint_path))
+            print(f"checkpoint {label}: {result['log_files']} files read, {result['log_files_skipped']} skipped")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Benchmark: semantic clustering of near-duplicate feedback.
+
+Index lookups: fills a ClusterIndex with --sizes random unit vectors of
+--dimensions and times nearest-cluster lookups, the single matrix-vector
+product each feedback pays, against a per-cluster Python loop at the smallest size.
+
+Reports: runs --events synthetic NOT_USEFUL feedbacks on --topics issues through
+process_feedback, first with clustering off and then with the deterministic
+hashing embedder. Each feedback rewords its topic's question and comment. The
+run counts Bedrock report calls and emails, and checks the clusters against the
+topics: merged clusters mix topics and split topics have several clusters.
+
+Usage:
+    python benchmarks/bench_clustering.py [--sizes 10000,100000,1000000] [--events 500] [--threshold 0.8]
+"""
+import argparse
+import random
+import statistics
+import time
+from collections import defaultdict
+
+import numpy as np
+
+import stubs
+
+TOPICS = [
+    ('How do I trigger a Lambda function from S3 uploads', 'I want to see more examples'),
+    ('What is the maximum batch size for SQS event sources', 'The answer is out of date'),
+    ('How do I configure DynamoDB streams with filtering', 'Missing the filter syntax'),
+    ('Can Step Functions call Bedrock directly', 'It did not mention the SDK integration'),
+    ('How do I connect API Gateway to EventBridge', 'Need a CDK sample'),
+    ('What permissions does a Glue crawler need', 'Too generic, list the IAM actions'),
+    ('How do I deploy a container image to Lambda', 'Steps are incomplete'),
+    ('How do I set up cross account SNS subscriptions', 'Wrong answer for my region'),
+    ('Why is my Athena query scanning so much data', 'Should mention partitions'),
+    ('How do I stream responses from a Lambda function URL', 'No code was shown'),
+]
+REWORDINGS = [
+    lambda text: text + '?',
+    lambda text: text.lower(),
+    lambda text: text.replace('How do I', 'How can I'),
+    lambda text: text + ' please',
+    lambda text: 'Question: ' + text,
+    lambda text: text.replace(' a ', ' the '),
+]
+
+
+def reword(text, rng):
+    for rewording in rng.sample(REWORDINGS, 2):
+        text = rewording(text)
+    return text
+
+
+def feedback_stream(events, topics, seed):
+    """(event, topic) pairs, each event rating its own conversation with a reworded question."""
+    rng = random.Random(seed)
+    conversations, stream = {}, []
+    for n in range(events):
+        topic = min(int(rng.paretovariate(1.2)) - 1, topics - 1)
+        query, comment = TOPICS[topic % len(TOPICS)]
+        conversation = stubs.synthetic_conversation(2, attributions=2)
+        conversation[1]['body'] = reword(query, rng)
+        conversations[f'conversation-{n}'] = conversation
+        stream.append((stubs.feedback_event('msg-1', conversation_id=f'conversation-{n}', comment=reword(comment, rng),
+                                            submitted_at=f'2024-02-02T10:{n // 60 % 60:02d}:{n % 60:02d}Z'), topic))
+    return conversations, stream
+
+
+def bench_lookups(sizes, dimensions, queries, seed):
+    import clustering
+
+    rng = np.random.default_rng(seed)
+    print(f"{'clusters':>9} {'dims':>5} {'p50 ms':>8} {'p95 ms':>8} {'loop ms':>8}")
+    for size in sizes:
+        # lookups only read the centroids and last_seen, so the other arrays stay small
+        index = clustering.ClusterIndex(dimensions, capacity=1, max_clusters=size)
+        index.centroids = rng.standard_normal((size, dimensions), dtype=np.float32)
+        index.centroids /= np.linalg.norm(index.centroids, axis=1, keepdims=True)
+        index.last_seen = np.full(size, index.clock())
+        index.size = size
+        vectors = clustering.normalize_rows(rng.standard_normal((queries, dimensions), dtype=np.float32))
+
+        timings = []
+        for vector in vectors:
+            started = time.perf_counter()
+            index.nearest(vector)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+
+        loop = ''
+        if size == sizes[0]:
+            rows = [list(row) for row in index.centroids[:size]]
+            query = list(vectors[0])
+            started = time.perf_counter()
+            max(range(size), key=lambda row: sum(a * b for a, b in zip(rows[row], query)))
+            loop = f'{(time.perf_counter() - started) * 1000:8.1f}'
+        print(f'{size:9d} {dimensions:5d} {statistics.median(timings):8.2f} '
+              f'{timings[int(0.95 * (len(timings) - 1))]:8.2f} {loop:>8}')
+        del index
+
+
+def bench_reports(args):
+    outcomes = {}
+    for mode in ('off', 'memory'):
+        handler = stubs.load_handler(CLUSTERING=mode, CLUSTER_SIMILARITY_THRESHOLD=args.threshold)
+        conversations, stream = feedback_stream(args.events, args.topics, args.seed)
+        bedrock, ses = stubs.StubBedrockRuntime(), stubs.StubSES()
+        stubs.install_clients(qbusiness=stubs.StubQBusiness(conversations), s3=stubs.StubS3(),
+                              bedrock_runtime=bedrock, ses=ses)
+        started = time.perf_counter()
+        for event, _ in stream:
+            handler.process_feedback(event)
+        seconds = time.perf_counter() - started
+        outcomes[mode] = (sum(bedrock.calls.values()), sum(ses.calls.values()))
+        print(f'clustering {mode:>6}: {args.events} feedbacks -> {outcomes[mode][0]} model calls, '
+              f'{outcomes[mode][1]} emails in {seconds:.2f}s')
+
+    # cluster quality against the topics the feedback was generated from
+    import clustering
+    records = [{'applicationId': 'application-1', 'usefulness': 'NOT_USEFUL',
+                'usefulness_comment': event['detail']['requestParameters']['messageUsefulness']['comment'],
+                'query': conversations[event['detail']['requestParameters']['conversationId']][1]['body']}
+               for event, _ in stream]
+    clusterer = clustering.FeedbackClusterer(clustering.HashingEmbedder(), threshold=float(args.threshold))
+    topics_of_cluster, clusters_of_topic = defaultdict(set), defaultdict(set)
+    for (_, topic), assignment in zip(stream, clusterer.assign_all(records)):
+        topics_of_cluster[assignment.cluster_id].add(topic)
+        clusters_of_topic[topic].add(assignment.cluster_id)
+    print(f'{len(topics_of_cluster)} clusters for {len(clusters_of_topic)} topics: '
+          f'{sum(len(t) > 1 for t in topics_of_cluster.values())} merge topics, '
+          f'{sum(len(c) > 1 for c in clusters_of_topic.values())} topics split')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    parser.add_argument('--dimensions', type=int, default=256)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--events', type=int, default=500)
+    parser.add_argument('--topics', type=int, default=len(TOPICS))
+    parser.add_argument('--threshold', default='0.8')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    stubs.load_handler()
+    bench_lookups([int(size) for size in args.sizes.split(',')], args.dimensions, args.queries, args.seed)
+    bench_reports(args)
+
+
+if __name__ == '__main__':
+    main()
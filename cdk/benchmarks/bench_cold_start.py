@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Benchmark: cold start of the feedback processor, measured in fresh interpreters.
+
+Each sample runs in its own Python process and records three timings:
+  * import - executing lambda-handler.py (the Lambda init phase)
+  * first  - the first lambda_handler invocation, including any client construction
+  * warm   - a second invocation in the same process, for comparison
+
+Real boto3 clients are used, so client construction and request signing are
+measured, but a botocore "before-send" hook answers every request with a canned
+response instead of calling AWS. The "eager" mode reproduces the original
+module, which imported boto3 and built the qbusiness, s3, bedrock,
+bedrock-runtime and ses clients at import time; the "lazy" mode is the current
+handler, which creates the clients it needs on first use.
+
+Usage:
+    python benchmarks/bench_cold_start.py [--samples 10] [--modes eager,lazy] [--report-mode digest]
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import stubs
+
+EAGER_CLIENTS = ('qbusiness', 's3', 'bedrock', 'bedrock-runtime', 'ses')
+
+# real clients validate parameters, and Q Business ids are UUIDs
+APPLICATION_ID = '00000000-0000-4000-8000-000000000001'
+CONVERSATION_ID = '00000000-0000-4000-8000-000000000002'
+
+
+class CannedBody(io.BytesIO):
+    """Raw HTTP body for botocore.awsrequest.AWSResponse."""
+
+    def stream(self, **kwargs):
+        yield self.getvalue()
+
+
+def canned_response(request, event_name, **kwargs):
+    """before-send hook: short-circuits the HTTP call with a canned reply for each operation."""
+    from botocore.awsrequest import AWSResponse
+
+    operation = event_name.rsplit('.', 1)[-1]
+    headers = {'Content-Type': 'application/json'}
+    if operation == 'ListMessages':
+        body = json.dumps({'messages': stubs.synthetic_conversation(10)})
+    elif operation == 'InvokeModel':
+        body = json.dumps({'content': [{'type': 'text', 'text': 'Key Suggestion: add examples.'}]})
+    elif operation == 'SendEmail':
+        headers = {'Content-Type': 'text/xml'}
+        body = ('<SendEmailResponse xmlns="http://ses.amazonaws.com/doc/2010-12-01/">'
+                '<SendEmailResult><MessageId>benchmark</MessageId></SendEmailResult></SendEmailResponse>')
+    else:
+        headers = {'ETag': '"benchmark"'}
+        body = ''
+    return AWSResponse(request.url, 200, headers, CannedBody(body.encode('utf-8')))
+
+
+def install_canned_responses():
+    # registered on the default session before any client exists, since clients
+    # copy the session's event hooks when they are created
+    import boto3
+    boto3.setup_default_session()
+    boto3.DEFAULT_SESSION.events.register('before-send', canned_response)
+
+
+def child(mode):
+    """Runs one cold start and prints its timings as JSON."""
+    os.environ.update(stubs.BENCHMARK_ENVIRONMENT)
+    # the canned replies are plain responses, not event streams
+    os.environ['MODEL_STREAMING'] = 'false'
+    started = time.perf_counter()
+    if mode == 'eager':
+        import boto3
+        install_canned_responses()
+        eager_clients = {name: boto3.client(name) for name in EAGER_CLIENTS}
+    handler = stubs.load_handler()
+    import_ms = (time.perf_counter() - started) * 1000
+
+    if mode == 'eager':
+        import clients
+        for name, client in eager_clients.items():
+            clients.set_client(name, client)
+
+    timings = {'mode': mode, 'import_ms': import_ms}
+    for label, submitted_at in (('first_ms', '2024-02-02T14:54:33Z'), ('warm_ms', '2024-02-02T14:55:33Z')):
+        started = time.perf_counter()
+        if mode == 'lazy' and label == 'first_ms':
+            # boto3 is first imported here in the lazy handler; the hook itself is negligible
+            install_canned_responses()
+        event = stubs.feedback_event('msg-1', conversation_id=CONVERSATION_ID, application_id=APPLICATION_ID,
+                                     submitted_at=submitted_at)
+        handler.lambda_handler(event, None)
+        timings[label] = (time.perf_counter() - started) * 1000
+    print(json.dumps(timings))
+
+
+def sample(mode, report_mode):
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', mode],
+                            env=dict(os.environ, REPORT_MODE=report_mode),
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--samples', type=int, default=10)
+    parser.add_argument('--modes', default='eager,lazy')
+    parser.add_argument('--report-mode', default='per_feedback', choices=('per_feedback', 'digest'),
+                        help='digest invocations only need the qbusiness and s3 clients')
+    parser.add_argument('--child', choices=('eager', 'lazy'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child)
+        return
+
+    print(f"{'mode':>6} {'import ms':>10} {'first ms':>10} {'cold total':>11} {'warm ms':>9}   (median of {args.samples})")
+    for mode in args.modes.split(','):
+        samples = [sample(mode, args.report_mode) for _ in range(args.samples)]
+        import_ms, first_ms, warm_ms = (statistics.median(s[field] for s in samples)
+                                        for field in ('import_ms', 'first_ms', 'warm_ms'))
+        print(f'{mode:>6} {import_ms:10.1f} {first_ms:10.1f} {import_ms + first_ms:11.1f} {warm_ms:9.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Benchmark: per-feedback JSON objects versus compacted Parquet day partitions.
+
+Writes synthetic feedback records in the layout the feedback processor uses
+(application_id=/year=/month=/day=/hour=/{messageId}.json), compacts them with the compaction job and
+compares the bytes an Athena-style query on one column has to scan, and the row
+throughput of reading that column back, before and after. Pass --source-dir to
+run against a local copy of real feedback objects instead.
+
+Usage:
+    python benchmarks/bench_compaction.py [--records 20000] [--days 2] [--source-dir DIR]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambdas', 'businessq_feedback_processor'))
+
+import pyarrow.parquet as pq  # noqa: E402
+
+from compaction import compact_directory  # noqa: E402
+
+
+def write_synthetic_records(root, records, days):
+    for i in range(records):
+        day = 1 + i % days
+        folder = os.path.join(root, f'application_id=app-{i % 3}', 'year=2024', 'month=02', f'day={day:02d}',
+                              f'hour={i % 24:02d}')
+        os.makedirs(folder, exist_ok=True)
+        attributions = [{'title': f'Page {n}', 'snippet': 'lorem ipsum ' * random.randint(20, 80),
+                         'url': f'https://example.com/docs/{random.randint(0, 500)}', 'citationNumber': n + 1}
+                        for n in range(random.randint(0, 5))]
+        record = {
+            'messageId': f'msg-{i}',
+            'query': f'How do I configure feature {i % 300}?',
+            'message': 'answer text ' * random.randint(20, 120),
+            'source_attribution_urls': [item['url'] for item in attributions],
+            'sourceAttribution': attributions,
+            'applicationId': f'app-{i % 3}',
+            'usefulness': random.choice(['USEFUL', 'NOT_USEFUL']),
+            'usefulness_comment': random.choice(['', 'I want to see more examples.', 'Out of date']),
+            'userId': f'user-{i % 200}',
+            'submittedAt': f'2024-02-{day:02d}T{i % 24:02d}:15:00Z',
+        }
+        with open(os.path.join(folder, f'msg-{i}.json'), 'w') as f:
+            json.dump(record, f)
+
+
+def scan_json(root, column):
+    started = time.perf_counter()
+    rows, scanned = 0, 0
+    for folder, _, files in os.walk(root):
+        for name in files:
+            path = os.path.join(folder, name)
+            scanned += os.path.getsize(path)
+            with open(path) as f:
+                json.load(f)[column]
+            rows += 1
+    return rows, scanned, time.perf_counter() - started
+
+
+def scan_parquet(root, column):
+    started = time.perf_counter()
+    rows, scanned = 0, 0
+    for folder, _, files in os.walk(root):
+        for name in files:
+            parquet_file = pq.ParquetFile(os.path.join(folder, name))
+            for group in range(parquet_file.num_row_groups):
+                scanned += parquet_file.metadata.row_group(group).column(
+                    parquet_file.schema_arrow.get_field_index(column)).total_compressed_size
+            rows += parquet_file.read(columns=[column]).num_rows
+    return rows, scanned, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=20000)
+    parser.add_argument('--days', type=int, default=2)
+    parser.add_argument('--source-dir', help='existing folder of feedback JSON partitions')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        source_dir = args.source_dir or os.path.join(workdir, 'feedback')
+        if not args.source_dir:
+            write_synthetic_records(source_dir, args.records, args.days)
+        output_dir = os.path.join(workdir, 'feedback_parquet')
+
+        started = time.perf_counter()
+        results = compact_directory(source_dir, output_dir)
+        compact_seconds = time.perf_counter() - started
+        rows = sum(result['rows'] for result in results)
+        print(f"compacted {rows} rows from {sum(r['source_objects'] for r in results)} objects "
+              f"into {sum(r['parquet_files'] for r in results)} files in {compact_seconds:.2f}s")
+        print(f"total bytes: json {sum(r['source_bytes'] for r in results):,} "
+              f"-> parquet {sum(r['parquet_bytes'] for r in results):,}")
+
+        for label, scan in (('json', lambda: scan_json(source_dir, 'usefulness')),
+                            ('parquet', lambda: scan_parquet(output_dir, 'usefulness'))):
+            scanned_rows, scanned_bytes, seconds = scan()
+            print(f"{label:>8}: scan usefulness -> {scanned_rows} rows, {scanned_bytes:,} bytes scanned, "
+                  f"{scanned_rows / seconds:,.0f} rows/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Benchmark: the warm-container conversation cache against ListMessages calls.
+
+Each of --conversations users rates --ratings answers of one conversation in a
+burst, the bursts interleaved as concurrent users would be. Rated answers are
+spread over the conversation, so some sit past the first ListMessages page.
+With --growth, each rating after the first follows a new question and answer
+with that chance, which puts the rated message ahead of any cached window.
+
+The events run through process_feedback with CONVERSATION_CACHE off and memory.
+The run reports ListMessages calls per feedback and the cache outcomes, and
+checks that both runs build identical feedback records.
+
+Usage:
+    python benchmarks/bench_conversation_cache.py [--conversations 50] [--length 30] [--ratings 4] [--growth 0.3]
+"""
+import argparse
+import copy
+import random
+import time
+from collections import Counter
+
+import stubs
+
+
+def rating_bursts(args):
+    """The conversations before any rating, and (conversation id, message id, new turn) ratings in order."""
+    rng = random.Random(args.seed)
+    conversations, bursts = {}, []
+    for c in range(args.conversations):
+        conversation_id = f'conversation-{c}'
+        conversations[conversation_id] = stubs.synthetic_conversation(args.length, attributions=2)
+        # USER turns have odd positions; the answer rated is the turn listed before them
+        questions = [f'msg-{i}' for i in range(1, args.length, 2)]
+        burst = []
+        for n, message_id in enumerate(rng.sample(questions, min(args.ratings, len(questions)))):
+            if n and rng.random() < args.growth:
+                burst.append((conversation_id, f'new-{c}-{n}', True))
+            else:
+                burst.append((conversation_id, message_id, False))
+        bursts.append(burst)
+
+    ratings = []
+    for n in range(max(len(burst) for burst in bursts)):
+        ratings += [burst[n] for burst in bursts if n < len(burst)]
+    return conversations, ratings
+
+
+def new_turn(message_id):
+    """A question and its answer posted since the conversation was last read, newest first."""
+    return [{'messageId': f'{message_id}-answer', 'type': 'SYSTEM', 'body': 'A newer answer. ' + 'detail ' * 60,
+             'sourceAttribution': [{'title': 'Document 9', 'snippet': 'snippet 9 ' * 40,
+                                    'url': 'https://example.com/doc/9', 'citationNumber': 1}]},
+            {'messageId': message_id, 'type': 'USER', 'body': 'A newer question?'}]
+
+
+def run(mode, initial, ratings):
+    handler = stubs.load_handler(CONVERSATION_CACHE=mode)
+    conversations = copy.deepcopy(initial)
+    qbusiness = stubs.StubQBusiness(conversations)
+    stubs.install_clients(qbusiness=qbusiness, s3=stubs.StubS3(), bedrock_runtime=stubs.StubBedrockRuntime(), ses=stubs.StubSES())
+
+    outcomes, records = Counter(), []
+    lookup = handler.find_feedback_messages
+
+    def counted_lookup(*args):
+        index, stats = lookup(*args)
+        outcomes[stats['cache']] += 1
+        return index, stats
+
+    handler.find_feedback_messages = counted_lookup
+    started = time.perf_counter()
+    for n, (conversation_id, message_id, is_new) in enumerate(ratings):
+        if is_new:
+            conversations[conversation_id][:0] = new_turn(message_id)
+        records.append(handler.process_feedback(stubs.feedback_event(message_id, conversation_id=conversation_id,
+                                                      submitted_at=f'2024-02-02T14:{n // 60 % 60:02d}:{n % 60:02d}Z')))
+    seconds = time.perf_counter() - started
+    return qbusiness.calls['list_messages'], outcomes, records, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--conversations', type=int, default=50)
+    parser.add_argument('--length', type=int, default=30, help='messages in each conversation')
+    parser.add_argument('--ratings', type=int, default=4, help='answers rated in each conversation')
+    parser.add_argument('--growth', type=float, default=0.3, help='chance a rating follows a new turn')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    stubs.load_handler()
+    initial, ratings = rating_bursts(args)
+    print(f'{len(ratings)} ratings of {args.conversations} conversations of {args.length} messages, '
+          f'{sum(is_new for _, _, is_new in ratings)} after a new turn')
+    print(f"{'cache':>7} {'calls':>6} {'calls/feedback':>14} {'hit':>5} {'extended':>8} {'miss':>5} {'seconds':>8}")
+    records = {}
+    for mode in ('off', 'memory'):
+        calls, outcomes, records[mode], seconds = run(mode, initial, ratings)
+        print(f'{mode:>7} {calls:6d} {calls / len(ratings):14.2f} {outcomes["hit"]:5d} '
+              f'{outcomes["extended"]:8d} {outcomes["miss"]:5d} {seconds:8.2f}')
+    found = sum(bool(record) for record in records['memory'])
+    print(f"identical records: {records['off'] == records['memory']} ({found} of {len(ratings)} messages found)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: locating the rated message and its preceding AI turn.
+
+Compares the original handler loop (match scan plus one rescan each for the
+previous body and source attribution) against a single-pass ConversationIndex
+on synthetic 10/100/1000-message conversations. The handler builds the index
+while paging through ListMessages, so the "lookup" column (queries against an
+already built index) is the per-feedback cost that replaces the rescans.
+
+Usage:
+    python benchmarks/bench_conversation_index.py [--repeat 200]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambdas', 'businessq_feedback_processor'))
+
+from conversation import ConversationIndex  # noqa: E402
+
+
+def synthetic_conversation(length):
+    messages = []
+    for i in range(length):
+        message = {'messageId': f'msg-{i}', 'body': f'body {i}', 'type': 'USER' if i % 2 else 'SYSTEM'}
+        if not i % 2:
+            message['sourceAttribution'] = [{'title': f'title {i}', 'url': f'https://example.com/{i}'}]
+        messages.append(message)
+    return messages
+
+
+def legacy_lookup(messages, target_message_id):
+    # the handler loop and helpers as originally written: three scans of the list
+    for message in messages:
+        if message['messageId'] == target_message_id:
+            previous_body = None
+            for item in messages:
+                if item.get('messageId') == target_message_id:
+                    break
+                previous_body = item.get('body')
+            previous_source_attribution = None
+            for item in messages:
+                if item.get('messageId') == target_message_id:
+                    break
+                previous_source_attribution = item.get('sourceAttribution')
+            return message, previous_body, previous_source_attribution
+    return None, None, None
+
+
+def indexed_lookup(messages, target_message_id):
+    return query_index(ConversationIndex(messages), target_message_id)
+
+
+def query_index(index, target_message_id):
+    return (index.get(target_message_id),
+            index.previous_body(target_message_id),
+            index.previous_source_attribution(target_message_id))
+
+
+def measure(function, number):
+    """Best-of-five time per call in microseconds."""
+    return min(timeit.repeat(function, number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'messages':>8} {'legacy us':>10} {'build+lookup us':>16} {'lookup us':>10} {'speedup':>8}")
+    for length in (10, 100, 1000):
+        messages = synthetic_conversation(length)
+        # worst case for the scans: the rated message is the oldest one in the window
+        target = messages[-1]['messageId']
+        assert legacy_lookup(messages, target) == indexed_lookup(messages, target)
+
+        index = ConversationIndex(messages)
+
+        legacy_us = measure(lambda: legacy_lookup(messages, target), args.repeat)
+        indexed_us = measure(lambda: indexed_lookup(messages, target), args.repeat)
+        lookup_us = measure(lambda: query_index(index, target), args.repeat)
+        print(f"{length:>8} {legacy_us:>10.1f} {indexed_us:>16.1f} {lookup_us:>10.2f} {legacy_us / lookup_us:>7.0f}x")
+
+
+if __name__ == '__main__':
+    main()
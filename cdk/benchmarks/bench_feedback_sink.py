@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Benchmark: the per-feedback S3 object write path against the buffered and Firehose sinks.
+
+--events feedback events, submitted over --hours hours, on answers with
+--attributions citations, run through batch_handler in SQS batches of
+--batch-size, once per FEEDBACK_SINK:
+
+    s3        one uncompressed JSON object per record, as the handler writes now
+    buffered  one gzipped JSON lines object per partition hour and batch
+    firehose  one PutRecordBatch per batch to a stub delivery stream
+
+The s3 and buffered sinks write to the local file stand-in (FEEDBACK_SINK_DIRECTORY)
+and each object write waits --put-ms, standing in for an S3 PUT. The run reports
+the write requests per record, the bytes written per record (for firehose, the
+JSON lines sent, before the stream gzips them) and the time the batches spend
+writing, then reads every file back and checks the records match the s3 run.
+
+Usage:
+    python benchmarks/bench_feedback_sink.py [--events 1000] [--batch-size 10] [--hours 3] [--attributions 5] [--put-ms 20]
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import stubs
+
+
+WORDS = ['lambda', 'bucket', 'policy', 'event', 'pattern', 'retry', 'queue', 'timeout', 'layer', 'stream',
+         'function', 'invoke', 'trigger', 'role', 'table', 'index', 'partition', 'schema', 'batch', 'window']
+
+
+def conversations(args):
+    """A rated question and answer per event, with varied text so compression is not flattered."""
+    rng = random.Random(1)
+
+    def text(words):
+        return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+    return {f'conversation-{n}': [
+        {'messageId': f'msg-{n}-0', 'type': 'SYSTEM', 'body': text(120),
+         'sourceAttribution': [{'title': f'Serverless pattern {rng.randrange(40)}', 'snippet': text(60),
+                                'url': f'https://serverlessland.com/patterns/pattern-{rng.randrange(40)}',
+                                'citationNumber': c + 1} for c in range(args.attributions)]},
+        {'messageId': f'msg-{n}-1', 'type': 'USER', 'body': text(12) + '?'},
+    ] for n in range(args.events)}
+
+
+def batches(args):
+    """SQS event batches of feedback events, spread evenly over args.hours submission hours."""
+    events = [stubs.feedback_event(f'msg-{n}-1', conversation_id=f'conversation-{n}', user_id=f'user-{n}',
+                                   submitted_at=f'2024-02-02T{10 + n * args.hours // args.events:02d}:{n % 60:02d}:00Z')
+              for n in range(args.events)]
+    records = [{'messageId': f'sqs-{n}', 'body': json.dumps(event)} for n, event in enumerate(events)]
+    return [{'Records': records[n:n + args.batch_size]} for n in range(0, len(records), args.batch_size)]
+
+
+class TimedWriter:
+    """Wraps the sink's object writer, adding put latency and counting requests and bytes."""
+
+    def __init__(self, writer, put_seconds):
+        self.writer = writer
+        self.put_seconds = put_seconds
+        self.requests = 0
+        self.bytes = 0
+
+    def write(self, key, body):
+        time.sleep(self.put_seconds)
+        self.writer.write(key, body)
+        self.requests += 1
+        self.bytes += len(body)
+
+
+def run(sink, args, conversation_messages, sqs_batches):
+    directory = tempfile.mkdtemp(prefix=f'sink-{sink}-')
+    handler = stubs.load_handler(FEEDBACK_SINK=sink, FEEDBACK_SINK_DIRECTORY=directory)
+    firehose = stubs.StubFirehose(args.put_ms / 1000)
+    stubs.install_clients(qbusiness=stubs.StubQBusiness(conversation_messages), bedrock_runtime=stubs.StubBedrockRuntime(),
+                          ses=stubs.StubSES(), firehose=firehose)
+    writer = None
+    if hasattr(handler.feedback_sink, 'writer'):
+        writer = handler.feedback_sink.writer = TimedWriter(handler.feedback_sink.writer, args.put_ms / 1000)
+
+    batch_ms, flush_ms, failures = [], [], 0
+    flush_feedback = handler.flush_feedback
+
+    def timed_flush(*flush_args):
+        started = time.perf_counter()
+        try:
+            return flush_feedback(*flush_args)
+        finally:
+            flush_ms.append((time.perf_counter() - started) * 1000)
+
+    handler.flush_feedback = timed_flush
+    for batch in sqs_batches:
+        started = time.perf_counter()
+        failures += len(handler.batch_handler(batch, None)['batchItemFailures'])
+        batch_ms.append((time.perf_counter() - started) * 1000)
+
+    if writer is not None:
+        requests, written_bytes = writer.requests, writer.bytes
+    else:
+        requests, written_bytes = firehose.calls.get('put_record_batch', 0), sum(map(len, firehose.records))
+    return {
+        'requests': requests,
+        'bytes': written_bytes,
+        'batch_ms': statistics.median(batch_ms),
+        'flush_ms': statistics.median(flush_ms) if sink != 's3' else 0.0,
+        'failures': failures,
+        'records': read_back(handler, directory, firehose),
+    }
+
+
+def read_back(handler, directory, firehose):
+    """Every record the sink wrote, restored by feedback_sink.read_records and keyed by messageId."""
+    from feedback_sink import read_records
+
+    records = []
+    if firehose.records:
+        records += read_records('stream.gz', gzip.compress(b''.join(firehose.records)))
+    for folder, _, files in os.walk(directory):
+        for name in files:
+            with open(os.path.join(folder, name), 'rb') as f:
+                records += read_records(name, f.read())
+    return {record['messageId']: record for record in records}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=1000)
+    parser.add_argument('--batch-size', type=int, default=10, help='SQS events per batch_handler invocation')
+    parser.add_argument('--hours', type=int, default=3, help='submission hours the events are spread over')
+    parser.add_argument('--attributions', type=int, default=5, help='citations of each rated answer')
+    parser.add_argument('--put-ms', type=float, default=20, help='latency of each object write or PutRecordBatch')
+    args = parser.parse_args()
+
+    stubs.load_handler()
+    conversation_messages = conversations(args)
+    sqs_batches = batches(args)
+
+    print(f'{args.events} feedback records in batches of {args.batch_size} over {args.hours} hours, '
+          f'{args.attributions} citations each, {args.put_ms:g} ms per write request')
+    print(f"{'sink':>9} {'requests':>8} {'req/record':>10} {'bytes':>10} {'bytes/record':>12} "
+          f"{'batch ms p50':>12} {'flush ms p50':>12} {'failures':>8}")
+    results = {}
+    for sink in ('s3', 'buffered', 'firehose'):
+        result = results[sink] = run(sink, args, conversation_messages, sqs_batches)
+        print(f"{sink:>9} {result['requests']:8d} {result['requests'] / args.events:10.3f} {result['bytes']:10d} "
+              f"{result['bytes'] / args.events:12.0f} {result['batch_ms']:12.1f} {result['flush_ms']:12.1f} "
+              f"{result['failures']:8d}")
+    for sink in ('buffered', 'firehose'):
+        print(f"{sink} records identical to s3: {results[sink]['records'] == results['s3']['records']} "
+              f"({len(results[sink]['records'])} records)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Load test: drive lambda_handler with synthetic PutFeedback events under concurrency.
+
+Each event rates a message in its own synthetic Q Business conversation, of
+--conversation-length messages with --attributions citations of --snippet-chars
+per answer. The rated message sits --feedback-depth turns back from the newest.
+Events go through lambda_handler from --concurrency threads, standing in for
+concurrent Lambda containers. Stub clients answer ListMessages, the S3 PUT,
+the Bedrock stream and the SES send with log-normal latencies around the
+configured medians. A --throttle-rate share of their attempts is throttled and
+retried with backoff, as botocore does, until max attempts.
+
+The run reports throughput, p50/p95/p99 latency, failures, outbound API calls and
+throttles per feedback. --output stores the run as JSON. --compare checks it
+against a stored run and exits with status 1 when p95 latency or calls per
+feedback regress beyond --tolerance, or more feedback fails.
+
+Usage:
+    python benchmarks/bench_load.py [--events 200] [--concurrency 10] [--output run.json] [--compare baseline.json]
+    python benchmarks/bench_load.py --env REPORT_MODE=digest --env RECOMMENDATION_CACHE=memory
+"""
+import argparse
+import json
+import logging
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import stubs
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_clients(args):
+    scale = args.time_scale / 1000
+    conversations = {f'conversation-{n}': stubs.synthetic_conversation(args.conversation_length, args.attributions,
+                                                                       args.snippet_chars)
+                     for n in range(args.conversations)}
+    clients = {
+        'qbusiness': stubs.StubQBusiness(conversations, args.list_ms * scale),
+        's3': stubs.StubS3(args.s3_ms * scale),
+        'bedrock_runtime': stubs.StubBedrockRuntime(args.bedrock_ms * scale, first_token_latency=args.first_token_ms * scale),
+        'ses': stubs.StubSES(args.ses_ms * scale),
+    }
+    for seed, client in enumerate(clients.values()):
+        client.configure(jitter=args.jitter, throttle_rate=args.throttle_rate, backoff=0.05 * args.time_scale,
+                         seed=args.seed + seed)
+    return clients
+
+
+def run_load(handler, args):
+    clients = build_clients(args)
+    stubs.install_clients(**clients)
+    target = f'msg-{2 * args.feedback_depth + 1}'
+    events = [stubs.feedback_event(target, conversation_id=f'conversation-{n % args.conversations}',
+                                   submitted_at=f'2024-02-02T{n // 3600 % 24:02d}:{n // 60 % 60:02d}:{n % 60:02d}Z')
+              for n in range(args.events)]
+
+    def invoke(event):
+        started = time.perf_counter()
+        try:
+            handler.lambda_handler(event, None)
+            failed = False
+        except Exception:
+            failed = True
+        return (time.perf_counter() - started) * 1000, failed
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        outcomes = list(pool.map(invoke, events))
+    seconds = time.perf_counter() - started
+
+    latencies = [latency for latency, _ in outcomes]
+    calls = {}
+    for client in clients.values():
+        for operation, count in client.calls.items():
+            calls[operation] = calls.get(operation, 0) + count
+    return {
+        'events': len(events),
+        'failed': sum(failed for _, failed in outcomes),
+        'failure_rate': round(sum(failed for _, failed in outcomes) / len(events), 4),
+        'seconds': round(seconds, 3),
+        'throughput_per_second': round(len(events) / seconds, 2),
+        'latency_ms': {
+            'mean': round(statistics.mean(latencies), 1),
+            'p50': round(percentile(latencies, 0.50), 1),
+            'p95': round(percentile(latencies, 0.95), 1),
+            'p99': round(percentile(latencies, 0.99), 1),
+            'max': round(max(latencies), 1),
+        },
+        'calls_per_feedback': {operation: round(count / len(events), 3) for operation, count in sorted(calls.items())},
+        'throttles_per_feedback': round(sum(client.throttles for client in clients.values()) / len(events), 3),
+    }
+
+
+def compare(run, baseline, tolerance):
+    """Regressions of run against baseline: p95 latency and calls per feedback beyond tolerance, or more failures."""
+    regressions = []
+    old_failures, new_failures = baseline['results']['failure_rate'], run['results']['failure_rate']
+    print(f"failure rate: {old_failures:.2%} -> {new_failures:.2%}")
+    if new_failures > old_failures:
+        regressions.append(f'failure rate {old_failures:.2%} -> {new_failures:.2%}')
+    old_p95, new_p95 = baseline['results']['latency_ms']['p95'], run['results']['latency_ms']['p95']
+    print(f"p95 latency: {old_p95:.1f} -> {new_p95:.1f} ms")
+    if new_p95 > old_p95 * (1 + tolerance):
+        regressions.append(f'p95 latency {old_p95:.1f} -> {new_p95:.1f} ms')
+    old_calls, new_calls = baseline['results']['calls_per_feedback'], run['results']['calls_per_feedback']
+    for operation in sorted(set(old_calls) | set(new_calls)):
+        old, new = old_calls.get(operation, 0), new_calls.get(operation, 0)
+        print(f"{operation} per feedback: {old} -> {new}")
+        if new > old * (1 + tolerance) + 1e-9:
+            regressions.append(f'{operation} per feedback {old} -> {new}')
+    if baseline['config'] != run['config']:
+        print('warning: the runs used different configurations')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--conversations', type=int, default=20, help='distinct conversations the events rate')
+    parser.add_argument('--conversation-length', type=int, default=20)
+    parser.add_argument('--feedback-depth', type=int, default=2, help='turns between the rated message and the newest')
+    parser.add_argument('--attributions', type=int, default=5)
+    parser.add_argument('--snippet-chars', type=int, default=800)
+    parser.add_argument('--list-ms', type=float, default=120, help='median ListMessages latency')
+    parser.add_argument('--s3-ms', type=float, default=40)
+    parser.add_argument('--first-token-ms', type=float, default=700, help='median Bedrock time to first token')
+    parser.add_argument('--bedrock-ms', type=float, default=2500, help='median Bedrock streaming time after the first token')
+    parser.add_argument('--ses-ms', type=float, default=90)
+    parser.add_argument('--jitter', type=float, default=0.3, help='sigma of the log-normal latency jitter')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='share of attempts throttled')
+    parser.add_argument('--time-scale', type=float, default=0.1, help='multiplier on every latency, to shorten runs')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--env', action='append', default=[], metavar='NAME=VALUE',
+                        help='handler environment override, e.g. RECOMMENDATION_CACHE=memory')
+    parser.add_argument('--output', help='write the run as JSON')
+    parser.add_argument('--compare', help='JSON of an earlier run to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    args = parser.parse_args()
+
+    environment = dict(item.split('=', 1) for item in args.env)
+    handler = stubs.load_handler(**environment)
+    import pipeline
+
+    # each Lambda container has its own stage pool; one process standing in for
+    # --concurrency containers needs as many workers, or the pool becomes the bottleneck
+    pipeline.executor = ThreadPoolExecutor(max_workers=args.concurrency * 4)
+    # failures are counted in the results rather than logged per event
+    logging.disable(logging.CRITICAL)
+    results = run_load(handler, args)
+
+    config = {name: value for name, value in vars(args).items() if name not in ('output', 'compare', 'tolerance')}
+    run = {
+        'benchmark': 'bench_load',
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'config': config,
+        'results': results,
+    }
+    print(json.dumps(results, indent=2))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(run, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(run, json.load(f), args.tolerance)
+        if regressions:
+            print('REGRESSIONS: ' + '; '.join(regressions))
+            sys.exit(1)
+        print('no regressions')
+
+
+if __name__ == '__main__':
+    main()
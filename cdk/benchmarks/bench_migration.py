@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Benchmark: migrating feedback records to the application and hour partition layout.
+
+Fills a stub S3 bucket with feedback records in the legacy layout
+(year=/month=/day=/{messageId}.json, by processing day), across several
+applications. Some records were processed after midnight for feedback given the
+day before, and submittedAt comes in the ISO and CloudTrail console formats.
+Each --workers run migrates a fresh copy of the bucket and checks that every
+record sits at the key the feedback processor now writes. Finally it compares
+the objects a one-hour, one-application query has to read before and after.
+
+Usage:
+    python benchmarks/bench_migration.py [--records 1000] [--applications 4] [--workers 1,4,16]
+"""
+import argparse
+import json
+import random
+from datetime import datetime, timedelta, timezone
+
+import stubs
+
+ROOT = 'business_q_feedback/feedback'
+
+
+def legacy_objects(records, applications, seed):
+    rng = random.Random(seed)
+    objects, expected = {}, {}
+    start = datetime(2024, 2, 1, tzinfo=timezone.utc)
+    for n in range(records):
+        submitted = start + timedelta(seconds=rng.randrange(7 * 86400))
+        # a late retry writes the record in the next processing day
+        processed = submitted + timedelta(minutes=rng.choice([0, 0, 0, 5, 90]))
+        submitted_at = (submitted.strftime('%b %d, %Y, %I:%M:%S %p') if n % 3 == 0
+                        else submitted.strftime('%Y-%m-%dT%H:%M:%SZ'))
+        record = {'messageId': f'msg-{n}', 'applicationId': f'application-{n % applications}',
+                  'usefulness': rng.choice(['USEFUL', 'NOT_USEFUL']), 'userId': f'user-{n % 50}',
+                  'submittedAt': submitted_at, 'source_attribution_urls': []}
+        key = f'{ROOT}/year={processed.year}/month={processed:%m}/day={processed:%d}/msg-{n}.json'
+        objects[key] = json.dumps(record)
+        expected[record['messageId']] = submitted
+    return objects, expected
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=1000)
+    parser.add_argument('--applications', type=int, default=4)
+    parser.add_argument('--workers', default='1,4,16')
+    parser.add_argument('--s3-ms', type=float, default=10, help='median latency of each S3 call')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    stubs.load_handler()
+    import migrate_partitions
+    import partitioning
+
+    objects, expected = legacy_objects(args.records, args.applications, args.seed)
+    moved_day = sum(1 for key, body in objects.items()
+                    if migrate_partitions.legacy_day(key).date() != expected[json.loads(body)['messageId']].date())
+    print(f'{len(objects)} legacy objects, {moved_day} in a different day partition than their submission')
+
+    print(f"{'workers':>7} {'objects':>7} {'failed':>6} {'seconds':>8} {'objects/s':>10} {'misplaced':>9}")
+    for workers in (int(w) for w in args.workers.split(',')):
+        s3 = stubs.StubS3(args.s3_ms / 1000)
+        s3.objects = dict(objects)
+        keys = migrate_partitions.list_keys(s3, 'bucket', f'{ROOT}/year=', migrate_partitions.LEGACY_KEY)
+        result = migrate_partitions.run_migration(
+            keys, lambda key: migrate_partitions.migrate_object(s3, 'bucket', 'business_q_feedback', key), workers=workers)
+
+        misplaced = [key for key, body in s3.objects.items()
+                     if key != partitioning.feedback_key('business_q_feedback', json.loads(body))]
+        print(f"{workers:7d} {result['objects']:7d} {result['failed']:6d} {result['seconds']:8.2f} "
+              f"{result['objects_per_second']:10.1f} {len(misplaced):9d}")
+
+    # one application's feedback submitted in one hour
+    hour = datetime(2024, 2, 3, 14, tzinfo=timezone.utc)
+    wanted = sum(1 for key in s3.objects if key.startswith(partitioning.hour_prefix(ROOT, 'application-0', hour)))
+    legacy_scan = sum(1 for key in objects if key.startswith(f'{ROOT}/year=2024/month=02/day=03/'))
+    new_scan = sum(1 for prefix in partitioning.window_prefixes(ROOT, 'application-0', hour, hour + timedelta(hours=1))
+                   for key in s3.objects if key.startswith(prefix))
+    print(f'one application, one hour ({wanted} records): {legacy_scan} objects read with the legacy day '
+          f'partitions, {new_scan} with application and hour partitions')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Benchmark: sequential versus concurrent post-lookup stages of lambda_handler.
+
+Drives the handler with stub clients that inject latency into ListMessages, the
+S3 PUT, the Bedrock call and the SES send. The sequential run gives the stage
+pool a single worker, which reproduces the original put -> invoke -> send order.
+
+Usage:
+    python benchmarks/bench_pipeline_fanout.py [--events 20] [--s3-ms 80] [--bedrock-ms 600] [--ses-ms 120]
+"""
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import stubs
+
+
+def run(handler, events):
+    latencies = []
+    for event in events:
+        started = time.perf_counter()
+        handler.lambda_handler(event, None)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=20)
+    parser.add_argument('--list-ms', type=float, default=40)
+    parser.add_argument('--s3-ms', type=float, default=80)
+    parser.add_argument('--bedrock-ms', type=float, default=600)
+    parser.add_argument('--ses-ms', type=float, default=120)
+    args = parser.parse_args()
+
+    handler = stubs.load_handler()
+    import pipeline
+
+    stubs.install_clients(
+        qbusiness=stubs.StubQBusiness({'conversation-1': stubs.synthetic_conversation(10)}, args.list_ms / 1000),
+        s3=stubs.StubS3(args.s3_ms / 1000),
+        bedrock_runtime=stubs.StubBedrockRuntime(args.bedrock_ms / 1000),
+        ses=stubs.StubSES(args.ses_ms / 1000))
+    events = [stubs.feedback_event('msg-1', submitted_at=f'2024-02-02T14:{i % 60:02d}:00Z') for i in range(args.events)]
+
+    for label, pool in (('sequential', ThreadPoolExecutor(max_workers=1)), ('concurrent', pipeline.executor)):
+        pipeline.executor = pool
+        latencies = run(handler, events)
+        print(f"{label:>10}: mean {statistics.mean(latencies):7.1f} ms, "
+              f"p95 {sorted(latencies)[int(len(latencies) * 0.95) - 1]:7.1f} ms over {len(latencies)} events")
+
+
+if __name__ == '__main__':
+    main()
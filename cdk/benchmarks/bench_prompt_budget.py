@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Benchmark: model input size of the feedback record before and after the prompt builder.
+
+Builds a corpus of feedback records with large sourceAttribution payloads: many
+citations, the same source cited repeatedly, long snippets and Q Business
+textMessageSegments. For each record it compares the estimated tokens of the
+original json.dumps(record) input with the PromptBuilder output.
+
+Usage:
+    python benchmarks/bench_prompt_budget.py [--budget 3000] [--snippet-chars 600]
+"""
+import argparse
+import json
+import random
+import time
+
+import stubs
+
+# (citations, distinct sources, snippet characters, AI message characters)
+CORPUS = [
+    (3, 3, 400, 1500),
+    (10, 6, 1500, 3000),
+    (25, 8, 2500, 5000),
+    (50, 12, 4000, 8000),
+    (100, 20, 4000, 12000),
+]
+
+
+def attribution_record(citations, sources, snippet_chars, message_chars, rng):
+    words = ['lambda', 'bucket', 'policy', 'event', 'pattern', 'retry', 'queue', 'timeout', 'layer', 'stream']
+    attributions = []
+    for citation in range(citations):
+        source = rng.randrange(sources)
+        snippet = ' '.join(rng.choice(words) for _ in range(snippet_chars // 7))
+        attributions.append({
+            'title': f'Serverless pattern {source}',
+            'url': f'https://serverlessland.com/patterns/pattern-{source}',
+            'snippet': snippet,
+            'citationNumber': citation + 1,
+            'updatedAt': '2024-02-01T10:00:00Z',
+            'textMessageSegments': [{'beginOffset': citation * 40, 'endOffset': citation * 40 + 38,
+                                     'snippetExcerpt': {'text': snippet[:300]}}],
+        })
+    return {
+        'messageId': 'msg-1',
+        'query': 'How do I add a retry policy to an event pattern?',
+        'message': ('The answer cites several patterns. ' * (message_chars // 35))[:message_chars],
+        'source_attribution_urls': [attribution['url'] for attribution in attributions],
+        'sourceAttribution': attributions,
+        'applicationId': 'application-1',
+        'usefulness': 'NOT_USEFUL',
+        'usefulness_comment': 'Needs an example with a dead-letter queue and retries.',
+        'userId': 'user-1',
+        'submittedAt': '2024-02-02T14:54:33Z',
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--budget', type=int, default=3000)
+    parser.add_argument('--snippet-chars', type=int, default=600)
+    args = parser.parse_args()
+
+    handler = stubs.load_handler()
+    from prompt_builder import PromptBuilder
+    builder = PromptBuilder(budget_tokens=args.budget, snippet_chars=args.snippet_chars)
+    rng = random.Random(7)
+
+    print(f"{'citations':>9} {'sources':>7} {'original tok':>12} {'built tok':>9} {'reduction':>9} {'build ms':>8}")
+    for citations, sources, snippet_chars, message_chars in CORPUS:
+        record = attribution_record(citations, sources, snippet_chars, message_chars, rng)
+        original = json.dumps({field: value for field, value in record.items()
+                               if field not in handler.FEEDBACK_USER_FIELDS})
+        started = time.perf_counter()
+        built = builder.build(record, exclude_fields=handler.FEEDBACK_USER_FIELDS)
+        build_ms = (time.perf_counter() - started) * 1000
+        original_tokens, built_tokens = len(original) // 4, len(built) // 4
+        print(f'{citations:9d} {sources:7d} {original_tokens:12d} {built_tokens:9d} '
+              f'{1 - built_tokens / original_tokens:9.0%} {build_ms:8.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Benchmark: shared token-bucket rate limiting of SES, Bedrock and Q Business calls.
+
+Instances: --instances threads, each standing in for a Lambda instance with its
+own RateLimiter, send --calls emails each to a stub SES that throttles above
+--quota sends per second across all of them (after botocore-style retries). It
+compares no limiter, per-instance buckets and buckets shared through one sqlite
+file (and, with --moto, a moto-mocked DynamoDB table), counting throttles, failed
+sends and the send rate reached.
+
+Burst: --events feedback events are processed by --instances concurrent threads
+against the same SES quota, first without rate limiting and deferral, then with
+both. Emails that stay throttled fail their invocation in the first run and are
+deferred in the second; the deferred ones are then sent by deferral.lambda_handler.
+
+Usage:
+    python benchmarks/bench_rate_limiting.py [--instances 8] [--calls 20] [--quota 20] [--events 200] [--moto]
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import stubs
+
+
+def run_instances(make_limiter, args):
+    ses = stubs.StubSES(args.ses_ms / 1000).configure(max_rate=args.quota)
+    stats = {'failed': 0}
+    lock = threading.Lock()
+
+    def instance(number):
+        limiter = make_limiter(number)
+        for _ in range(args.calls):
+            try:
+                if limiter is None:
+                    ses.send_email(Source='from@example.com')
+                else:
+                    limiter.call('ses', ses.send_email, Source='from@example.com')
+            except Exception:
+                with lock:
+                    stats['failed'] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.instances) as pool:
+        list(pool.map(instance, range(args.instances)))
+    seconds = time.perf_counter() - started
+    return ses.sent, stats['failed'], ses.throttles, seconds
+
+
+def bench_instances(args):
+    import throttling
+
+    limits = {'ses': (args.quota, args.quota * args.burst_seconds)}
+    path = os.path.join(tempfile.mkdtemp(), 'buckets.sqlite')
+    modes = [
+        ('no limiter', lambda number: None),
+        ('per-instance buckets', lambda number: throttling.RateLimiter(throttling.SQLiteTokenBucketStore(), limits)),
+        ('shared sqlite buckets', lambda number: throttling.RateLimiter(throttling.SQLiteTokenBucketStore(path), limits)),
+    ]
+    if args.moto:
+        modes.append(('shared dynamodb buckets', dynamodb_limiter(limits)))
+
+    print(f'{args.instances} instances x {args.calls} emails, SES quota {args.quota}/s')
+    print(f"{'mode':>24} {'sent':>5} {'failed':>6} {'throttles':>9} {'seconds':>8} {'sends/s':>8}")
+    for name, make_limiter in modes:
+        sent, failed, throttles, seconds = run_instances(make_limiter, args)
+        print(f'{name:>24} {sent:5d} {failed:6d} {throttles:9d} {seconds:8.2f} {sent / seconds:8.1f}')
+
+
+def dynamodb_limiter(limits):
+    from moto import mock_aws
+    import boto3
+    import throttling
+
+    mock = mock_aws()
+    mock.start()
+    client = boto3.client('dynamodb', region_name='us-east-1')
+    client.create_table(TableName='rate-limits', BillingMode='PAY_PER_REQUEST',
+                        AttributeDefinitions=[{'AttributeName': 'bucket', 'AttributeType': 'S'}],
+                        KeySchema=[{'AttributeName': 'bucket', 'KeyType': 'HASH'}])
+    # moto evaluates a conditional put and stores the item in separate steps, so the
+    # table is shared by the instances through one lock, as DynamoDB does per item
+    lock = threading.Lock()
+
+    class SerializedClient:
+        def __getattr__(self, name):
+            operation = getattr(client, name)
+
+            def call(**kwargs):
+                with lock:
+                    return operation(**kwargs)
+            return call
+
+    return lambda number: throttling.RateLimiter(
+        throttling.DynamoDBTokenBucketStore('rate-limits', client=SerializedClient()), limits)
+
+
+def bench_burst(args):
+    conversations = {f'conversation-{n}': stubs.synthetic_conversation(2) for n in range(args.events)}
+    events = [stubs.feedback_event('msg-1', conversation_id=f'conversation-{n}') for n in range(args.events)]
+    print(f'{args.events} feedback events from {args.instances} concurrent instances, SES quota {args.quota}/s')
+    for mode in ('off', 'memory'):
+        handler = stubs.load_handler(RATE_LIMITING=mode, DEFERRAL=mode, DEFERRAL_DELAY_SECONDS=0,
+                                     SES_EMAILS_PER_SECOND=args.quota, RATE_LIMIT_BURST_SECONDS=args.burst_seconds,
+                                     BEDROCK_REQUESTS_PER_SECOND=0, QBUSINESS_REQUESTS_PER_SECOND=0,
+                                     EMAIL_MAX_WAIT_SECONDS=args.email_wait)
+        ses = stubs.StubSES(args.ses_ms / 1000).configure(max_rate=args.quota)
+        stubs.install_clients(qbusiness=stubs.StubQBusiness(conversations), s3=stubs.StubS3(),
+                              bedrock_runtime=stubs.StubBedrockRuntime(), ses=ses)
+
+        def process(event):
+            try:
+                handler.process_feedback(event)
+                return True
+            except Exception:
+                return False
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.instances) as pool:
+            failed = sum(not ok for ok in pool.map(process, events))
+        seconds = time.perf_counter() - started
+        line = (f'rate limiting {mode:>6}: {ses.sent} emails sent, '
+                f'{failed} invocations failed, {ses.throttles} throttles in {seconds:.2f}s')
+
+        if handler.email_deferral is not None:
+            import deferral
+            tasks = handler.email_deferral.queue.due()
+            sent_before = ses.sent
+            started = time.perf_counter()
+            result = deferral.lambda_handler({'Records': [{'messageId': str(n), 'body': json.dumps(task)}
+                                                          for n, task in enumerate(tasks)]}, None)
+            line += (f'; {len(tasks)} deferred, {ses.sent - sent_before} sent later '
+                     f'({len(result["batchItemFailures"])} failed) in {time.perf_counter() - started:.2f}s')
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--instances', type=int, default=8)
+    parser.add_argument('--calls', type=int, default=20, help='emails sent by each instance')
+    parser.add_argument('--quota', type=float, default=20, help='SES sends per second before it throttles')
+    parser.add_argument('--burst-seconds', type=float, default=1)
+    parser.add_argument('--ses-ms', type=float, default=20, help='latency of each SES call')
+    parser.add_argument('--events', type=int, default=200)
+    parser.add_argument('--email-wait', type=float, default=0.5, help='EMAIL_MAX_WAIT_SECONDS of the burst run')
+    parser.add_argument('--moto', action='store_true', help='also share the buckets through a moto-mocked DynamoDB table')
+    args = parser.parse_args()
+
+    stubs.load_handler()
+    bench_instances(args)
+    bench_burst(args)
+
+
+if __name__ == '__main__':
+    main()
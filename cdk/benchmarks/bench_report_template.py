@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Benchmark: model output tokens of the report email, model-written against templated.
+
+--events feedback events on answers with --attributions citations run through
+process_feedback with REPORT_FORMAT=model, where the model writes the whole report
+(user details, query, message and sources, then the suggestions), and
+REPORT_FORMAT=template, where those details are rendered from the record and the
+model only writes the key suggestion and recommendations, capped at
+REPORT_MAX_TOKENS. The stub model copies the record back the way the example
+report in the README does and spends --token-ms per generated token.
+
+The run reports the ModelOutputTokens metric, the model time and feedback latency,
+the email body sizes and the time to render the templates.
+
+Usage:
+    python benchmarks/bench_report_template.py [--events 10] [--attributions 3] [--token-ms 5] [--max-tokens 400]
+"""
+import argparse
+import json
+import statistics
+import time
+
+import stubs
+
+SUGGESTIONS = '''Key Suggestion:
+Based on the usefulness comment "I want to see more examples", the key suggestion for improving the source content is to provide more concrete examples of how the service is used in real-world scenarios.
+
+Recommendations:
+1. Provide a case study of a company that adopted the pattern and the benefits they saw, with the events they produced and the consumers they created.
+2. Include code snippets demonstrating publishing events, creating event handlers, and processing events asynchronously.
+3. Show a step-by-step tutorial for building a simple application with the pattern, explaining each component.
+'''
+
+
+def stub_completion(prompt):
+    """The suggestions, after the feedback details when the prompt asks for the whole report."""
+    if 'Do NOT repeat' in prompt:
+        return SUGGESTIONS
+    record = json.loads(prompt[len('<context>'):prompt.index('</context>')])
+    sources = record.get('sources', [])
+    lines = ['Here is the content report for the given user feedback:', '', 'User Details:',
+             f"- usefulness: {record.get('usefulness')}", f"- usefulness_comment: {record.get('usefulness_comment')}",
+             '', 'Query:', str(record.get('query')), '', 'Message:', str(record.get('message')), '',
+             'Source Attribution Titles:']
+    lines += [f"{n}. {source.get('title')}" for n, source in enumerate(sources, 1)]
+    lines += ['', 'Source Attribution Snippets:']
+    lines += [f"{n}. {' ... '.join(source.get('snippets', []))}" for n, source in enumerate(sources, 1)]
+    lines += ['', 'Source Attribution URLs:']
+    lines += [f"{n}. {source.get('url')}" for n, source in enumerate(sources, 1)]
+    return '\n'.join(lines) + '\n\n' + SUGGESTIONS
+
+
+def run(report_format, args, conversations, events):
+    import metrics
+
+    handler = stubs.load_handler(REPORT_FORMAT=report_format, REPORT_MAX_TOKENS=args.max_tokens)
+    ses = stubs.StubSES()
+    emails = []
+    send_email = ses.send_email
+
+    def recorded_send_email(**kwargs):
+        emails.append(kwargs['Message']['Body'])
+        return send_email(**kwargs)
+
+    ses.send_email = recorded_send_email
+    stubs.install_clients(qbusiness=stubs.StubQBusiness(conversations), s3=stubs.StubS3(), ses=ses,
+                          bedrock_runtime=stubs.StubBedrockRuntime(completion=stub_completion,
+                                                                   token_latency=args.token_ms / 1000))
+
+    lines = []
+    metrics.METRICS_MODE = 'emf'
+    metrics.set_writer(lines.append)
+    latencies, records = [], []
+    try:
+        for event in events:
+            started = time.perf_counter()
+            records.append(json.loads(handler.process_feedback(event)))
+            latencies.append((time.perf_counter() - started) * 1000)
+    finally:
+        metrics.METRICS_MODE = 'off'
+        metrics.set_writer(None)
+
+    model_calls = [document for document in map(json.loads, lines) if 'ModelOutputTokens' in document]
+    return {
+        'output_tokens': statistics.mean(document['ModelOutputTokens'] for document in model_calls),
+        'model_ms': statistics.mean(document['ModelTotalMs'] for document in model_calls),
+        'latency_ms': statistics.mean(latencies),
+        'text_chars': statistics.mean(len(body['Text']['Data']) for body in emails),
+        'html_chars': statistics.mean(len(body['Html']['Data']) if 'Html' in body else 0 for body in emails),
+        'record': records[0],
+    }
+
+
+def render_ms(args, record):
+    from report_templates import render_report
+
+    render_report(record, SUGGESTIONS)
+    started = time.perf_counter()
+    for _ in range(args.renders):
+        render_report(record, SUGGESTIONS)
+    return (time.perf_counter() - started) * 1000 / args.renders
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=10)
+    parser.add_argument('--attributions', type=int, default=3, help='citations of each rated answer')
+    parser.add_argument('--token-ms', type=float, default=5, help='model time per generated token')
+    parser.add_argument('--max-tokens', type=int, default=400, help='REPORT_MAX_TOKENS of the templated run')
+    parser.add_argument('--renders', type=int, default=1000)
+    args = parser.parse_args()
+
+    stubs.load_handler()
+    conversations = {f'conversation-{n}': stubs.synthetic_conversation(2, attributions=args.attributions)
+                     for n in range(args.events)}
+    events = [stubs.feedback_event('msg-1', conversation_id=f'conversation-{n}') for n in range(args.events)]
+
+    print(f'{args.events} feedback reports, {args.attributions} citations each, {args.token_ms:g} ms per output token')
+    print(f"{'format':>9} {'output tokens':>13} {'model ms':>9} {'feedback ms':>11} {'text chars':>10} {'html chars':>10}")
+    results = {}
+    for report_format in ('model', 'template'):
+        result = results[report_format] = run(report_format, args, conversations, events)
+        print(f"{report_format:>9} {result['output_tokens']:13.0f} {result['model_ms']:9.1f} "
+              f"{result['latency_ms']:11.1f} {result['text_chars']:10.0f} {result['html_chars']:10.0f}")
+    saved = 1 - results['template']['output_tokens'] / results['model']['output_tokens']
+    print(f'output tokens saved: {saved:.0%}')
+    print(f"template render (text and html): {render_ms(args, results['template']['record']):.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,354 @@
+"""
+Stubbed AWS clients and synthetic feedback data for driving the feedback
+processor locally. Each stub sleeps for a configurable latency and counts its
+calls, so benchmarks can reproduce the shape of a real invocation without AWS.
+"""
+import importlib.util
+import io
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+PROCESSOR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambdas', 'businessq_feedback_processor')
+
+BENCHMARK_ENVIRONMENT = {
+    'S3_DATA_BUCKET': 'benchmark-bucket',
+    'GLUE_DATABASE_NAME': 'business_q_feedback',
+    'MODELID': 'anthropic.claude-v2',
+    'FROM_ADDRESS': 'from@example.com',
+    'TO_ADDRESS': 'to@example.com',
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'AWS_ACCESS_KEY_ID': 'benchmark',
+    'AWS_SECRET_ACCESS_KEY': 'benchmark',
+    'RECOMMENDATION_CACHE': 'off',
+    'CONVERSATION_CACHE': 'off',
+    'IDEMPOTENCY': 'off',
+    'METRICS': 'off',
+    'CLUSTERING': 'off',
+    'CLUSTER_EMBEDDER': 'hashing',
+    'RATE_LIMITING': 'off',
+}
+
+
+def load_handler(**environment):
+    """Imports lambda-handler.py as a fresh module with the benchmark environment."""
+    os.environ.update(BENCHMARK_ENVIRONMENT)
+    os.environ.update({name: str(value) for name, value in environment.items()})
+    if PROCESSOR_DIR not in sys.path:
+        sys.path.insert(0, PROCESSOR_DIR)
+    spec = importlib.util.spec_from_file_location('lambda_handler_benchmark', os.path.join(PROCESSOR_DIR, 'lambda-handler.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    # the limiter is shared by the processor modules, so it follows each new environment
+    import throttling
+    throttling.reset_limiter()
+    return module
+
+
+def install_clients(qbusiness=None, s3=None, bedrock_runtime=None, ses=None, dynamodb=None, sqs=None, firehose=None):
+    """Registers stub clients with the processor's client registry (clients.set_client)."""
+    import clients
+    for service_name, client in (('qbusiness', qbusiness), ('s3', s3), ('bedrock-runtime', bedrock_runtime),
+                                 ('ses', ses), ('dynamodb', dynamodb), ('sqs', sqs), ('firehose', firehose)):
+        if client is not None:
+            clients.set_client(service_name, client)
+
+
+def synthetic_conversation(length, attributions=3, snippet_chars=400):
+    """Q Business messages newest first: SYSTEM answers with citations and the USER turns before them."""
+    messages = []
+    for i in range(length):
+        if i % 2 == 0:
+            messages.append({
+                'messageId': f'msg-{i}', 'type': 'SYSTEM', 'body': f'Answer {i}. ' + 'detail ' * 60,
+                'sourceAttribution': [{'title': f'Document {n}', 'snippet': ('snippet %d ' % n) * (snippet_chars // 10),
+                                       'url': f'https://example.com/doc/{n}', 'citationNumber': n + 1}
+                                      for n in range(attributions)],
+            })
+        else:
+            messages.append({'messageId': f'msg-{i}', 'type': 'USER', 'body': f'Question {i}?'})
+    return messages
+
+
+def feedback_event(message_id, conversation_id='conversation-1', application_id='application-1', user_id='user-1',
+                   usefulness='NOT_USEFUL', comment='I want to see more examples.', submitted_at='2024-02-02T14:54:33Z'):
+    """An EventBridge "AWS API Call via CloudTrail" event for PutFeedback."""
+    usefulness_detail = {'usefulness': usefulness, 'submittedAt': submitted_at}
+    if comment:
+        usefulness_detail['comment'] = comment
+    return {
+        'source': 'aws.qbusiness',
+        'detail-type': 'AWS API Call via CloudTrail',
+        'detail': {
+            'eventSource': 'qbusiness.amazonaws.com',
+            'eventName': 'PutFeedback',
+            'requestParameters': {
+                'applicationId': application_id, 'conversationId': conversation_id, 'userId': user_id,
+                'messageId': message_id, 'messageUsefulness': usefulness_detail,
+            },
+        },
+    }
+
+
+class StubClient:
+    """
+    Base stub: sleeps latency seconds per call and counts calls per operation.
+
+    configure() adds log-normal jitter around the latency and throttling, either at
+    random (throttle_rate) or above a service quota of max_rate calls per second
+    across all callers: a throttled attempt is retried with exponential backoff, as
+    botocore's standard retry mode does, and raises ThrottlingException after
+    max_attempts.
+    """
+
+    throttle_code = 'ThrottlingException'
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = {}
+        self.throttles = 0
+        self.jitter = 0.0
+        self.throttle_rate = 0.0
+        self.max_rate = 0
+        self.window = []
+        self.max_attempts = 3
+        self.backoff = 0.05
+        self.rng = random.Random(0)
+        self._lock = threading.Lock()
+
+    def configure(self, jitter=0.0, throttle_rate=0.0, max_attempts=3, backoff=0.05, seed=0, max_rate=0):
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.max_rate = max_rate
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.rng = random.Random(seed)
+        return self
+
+    def delay(self, seconds):
+        if seconds and self.jitter:
+            with self._lock:
+                seconds *= self.rng.lognormvariate(0, self.jitter)
+        if seconds:
+            time.sleep(seconds)
+
+    def record(self, operation, sleep=True):
+        with self._lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+        for attempt in range(self.max_attempts):
+            with self._lock:
+                throttled = (self.throttle_rate and self.rng.random() < self.throttle_rate) or self.over_quota()
+                if throttled:
+                    self.throttles += 1
+            if not throttled:
+                break
+            if attempt == self.max_attempts - 1:
+                from botocore.exceptions import ClientError
+                raise ClientError({'Error': {'Code': self.throttle_code, 'Message': 'Rate exceeded'}}, operation)
+            # a throttled attempt still costs a round trip before the backoff
+            self.delay(self.latency / 4)
+            time.sleep(self.backoff * 2 ** attempt * self.rng.random())
+        if sleep:
+            self.delay(self.latency)
+
+    def over_quota(self):
+        """Counts an attempt against max_rate per sliding second; call with the lock held."""
+        if not self.max_rate:
+            return False
+        now = time.monotonic()
+        self.window = [at for at in self.window if at > now - 1]
+        if len(self.window) >= self.max_rate:
+            return True
+        self.window.append(now)
+        return False
+
+
+class StubQBusiness(StubClient):
+
+    def __init__(self, conversations, latency=0.0):
+        super().__init__(latency)
+        self.conversations = conversations
+
+    def list_messages(self, conversationId, maxResults=10, nextToken=None, **kwargs):
+        self.record('list_messages')
+        messages = self.conversations[conversationId]
+        start = int(nextToken or 0)
+        response = {'messages': messages[start:start + maxResults]}
+        if start + maxResults < len(messages):
+            response['nextToken'] = str(start + maxResults)
+        return response
+
+
+class StubS3(StubClient):
+
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.record('put_object')
+        self.objects[Key] = Body
+        return {}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        self.record('get_object')
+        body = self.objects[Key]
+        return {'Body': io.BytesIO(body if isinstance(body, bytes) else body.encode('utf-8'))}
+
+    def copy_object(self, Bucket, Key, CopySource, **kwargs):
+        self.record('copy_object')
+        self.objects[Key] = self.objects[CopySource['Key']]
+        return {}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self.record('delete_object')
+        self.objects.pop(Key, None)
+        return {}
+
+    def get_paginator(self, operation_name):
+        return StubPaginator(self)
+
+    def list_objects_v2(self, Prefix='', Delimiter=None):
+        """One unpaged listing, with CommonPrefixes when a Delimiter is given."""
+        self.record('list_objects_v2')
+        with self._lock:
+            keys = sorted(key for key in list(self.objects) if key.startswith(Prefix))
+        if not Delimiter:
+            return {'Contents': [{'Key': key, 'Size': len(self.objects.get(key) or '')} for key in keys]}
+        prefixes = sorted({Prefix + key[len(Prefix):].split(Delimiter)[0] + Delimiter
+                           for key in keys if Delimiter in key[len(Prefix):]})
+        return {'Contents': [{'Key': key, 'Size': len(self.objects.get(key) or '')}
+                             for key in keys if Delimiter not in key[len(Prefix):]],
+                'CommonPrefixes': [{'Prefix': prefix} for prefix in prefixes]}
+
+
+class StubPaginator:
+
+    def __init__(self, client):
+        self.client = client
+
+    def paginate(self, Bucket, Prefix='', Delimiter=None, **kwargs):
+        yield self.client.list_objects_v2(Prefix=Prefix, Delimiter=Delimiter)
+
+
+class StubBedrockRuntime(StubClient):
+    """
+    Answers InvokeModel and InvokeModelWithResponseStream in the Messages or legacy
+    completion format of the request, with the token counts Bedrock reports (4
+    characters per token). Streams split the completion into chunks and spend
+    first_token_latency before the first one and latency across the rest.
+
+    completion may be a function of the prompt; the text is cut to the request's max
+    tokens at 4 characters per token, and token_latency is spent per token generated.
+    """
+
+    def __init__(self, latency=0.0, completion='Key Suggestion: add examples.', first_token_latency=0.0, chunks=8,
+                 token_latency=0.0):
+        super().__init__(latency)
+        self.completion = completion
+        self.first_token_latency = first_token_latency
+        self.chunks = chunks
+        self.token_latency = token_latency
+        self.model_ids = []
+
+    def generate(self, body):
+        """The prompt and the completion of a request body."""
+        request = json.loads(body)
+        prompt = request['messages'][0]['content'][0]['text'] if 'messages' in request else request['prompt']
+        completion = self.completion(prompt) if callable(self.completion) else self.completion
+        max_tokens = request.get('max_tokens') or request.get('max_tokens_to_sample')
+        return prompt, completion[:max_tokens * 4] if max_tokens else completion
+
+    @staticmethod
+    def tokens(prompt, completion):
+        return len(prompt) // 4, max(1, len(completion) // 4)
+
+    def invoke_model(self, modelId, body, **kwargs):
+        self.record('invoke_model')
+        self.model_ids.append(modelId)
+        prompt, completion = self.generate(body)
+        self.delay(self.token_latency * len(completion) / 4)
+        input_tokens, output_tokens = self.tokens(prompt, completion)
+        if 'messages' in json.loads(body):
+            response = {'content': [{'type': 'text', 'text': completion}], 'stop_reason': 'end_turn',
+                        'usage': {'input_tokens': input_tokens, 'output_tokens': output_tokens}}
+        else:
+            response = {'completion': completion}
+        headers = {'x-amzn-bedrock-input-token-count': str(input_tokens),
+                   'x-amzn-bedrock-output-token-count': str(output_tokens)}
+        return {'body': io.BytesIO(json.dumps(response).encode('utf-8')), 'ResponseMetadata': {'HTTPHeaders': headers}}
+
+    def invoke_model_with_response_stream(self, modelId, body, **kwargs):
+        self.record('invoke_model_with_response_stream', sleep=False)
+        self.model_ids.append(modelId)
+        return {'body': self.stream_events('messages' in json.loads(body), *self.generate(body))}
+
+    def stream_events(self, messages, prompt, completion):
+        input_tokens, output_tokens = self.tokens(prompt, completion)
+        size = max(1, -(-len(completion) // self.chunks))
+        parts = [completion[i:i + size] for i in range(0, len(completion), size)]
+        if messages:
+            yield self.event({'type': 'message_start',
+                              'message': {'role': 'assistant', 'usage': {'input_tokens': input_tokens, 'output_tokens': 1}}})
+        self.delay(self.first_token_latency)
+        for part in parts:
+            yield self.event({'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': part}}
+                             if messages else {'completion': part})
+            self.delay(self.latency / len(parts) + self.token_latency * len(part) / 4)
+        invocation_metrics = {'inputTokenCount': input_tokens, 'outputTokenCount': output_tokens}
+        if messages:
+            yield self.event({'type': 'message_delta', 'delta': {'stop_reason': 'end_turn'},
+                              'usage': {'output_tokens': output_tokens}})
+            yield self.event({'type': 'message_stop', 'amazon-bedrock-invocationMetrics': invocation_metrics})
+        else:
+            yield self.event({'completion': '', 'stop_reason': 'stop_sequence',
+                              'amazon-bedrock-invocationMetrics': invocation_metrics})
+
+    @staticmethod
+    def event(chunk):
+        return {'chunk': {'bytes': json.dumps(chunk).encode()}}
+
+
+class StubSES(StubClient):
+
+    # SES reports its maximum send rate as Throttling, "Maximum sending rate exceeded."
+    throttle_code = 'Throttling'
+
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        self.sent = 0
+
+    def send_email(self, **kwargs):
+        self.record('send_email')
+        with self._lock:
+            self.sent += 1
+        return {'MessageId': 'stub-message-id'}
+
+
+class StubSQS(StubClient):
+
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        self.messages = []
+
+    def send_message(self, QueueUrl, MessageBody, DelaySeconds=0, **kwargs):
+        self.record('send_message')
+        self.messages.append({'messageId': f'sqs-{len(self.messages)}', 'body': MessageBody, 'delaySeconds': DelaySeconds})
+        return {'MessageId': self.messages[-1]['messageId']}
+
+
+class StubFirehose(StubClient):
+    """Accepts PutRecordBatch calls and keeps the data of every record, as the delivery stream would buffer it."""
+
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        self.records = []
+
+    def put_record_batch(self, DeliveryStreamName, Records, **kwargs):
+        self.record('put_record_batch')
+        with self._lock:
+            self.records.extend(record['Data'] for record in Records)
+        return {'FailedPutCount': 0, 'RequestResponses': [{'RecordId': f'record-{n}'} for n in range(len(Records))]}
@@ -1,3 +1,4 @@
+import json
 from time import strftime
 from constructs import Construct
 from aws_cdk import Stack, Duration, CfnOutput, Tags,Aws
@@ -7,9 +8,14 @@ from aws_cdk import (
     aws_s3 as s3,
     RemovalPolicy,
     aws_cloudtrail as cloudtrail,
+    aws_events as events,
     aws_events_targets as targets,
+    aws_lambda_event_sources as event_sources,
+    aws_sqs as sqs,
     aws_glue as glue,
     aws_athena as athena,
+    aws_dynamodb as dynamodb,
+    aws_kinesisfirehose as firehose,
     aws_s3_notifications as s3n
 )
 from aws_cdk.custom_resources import (
@@ -32,10 +38,710 @@ class QLambdaStack(Stack):
         self.application_id  = self.node.try_get_context("application_id")
         self.classification = self.node.try_get_context("classification")
         self.glue_database_name = self.node.try_get_context("glue_database")
+
+        # Q Business applications whose feedback is processed, each with its own event rule
+        # and, in "sqs" ingestion mode, its own queue drained by at most max_concurrency
+        # batches at a time; application_id alone still configures a single application
+        self.application_max_concurrency = int(self.node.try_get_context("application_max_concurrency") or 5)
+        self.reserved_concurrency = int(self.node.try_get_context("reserved_concurrency") or 0)
+
+        # "direct" invokes the Lambda per PutFeedback event, "sqs" buffers events in a queue
+        self.ingestion_mode = self.node.try_get_context("ingestion_mode") or "direct"
+        self.sqs_batch_size = int(self.node.try_get_context("sqs_batch_size") or 10)
+        self.sqs_max_batching_window_seconds = int(self.node.try_get_context("sqs_max_batching_window_seconds") or 30)
+
+        self.applications = self.application_settings()
+
+        # Feedback events that keep failing in "sqs" mode are parked here after three attempts, for every application
+        self.feedback_queues = {}
+        if self.ingestion_mode == "sqs":
+            self.feedback_dlq = sqs.Queue(self, "BusinessQFeedbackDLQ",
+                encryption=sqs.QueueEncryption.SQS_MANAGED,
+                enforce_ssl=True,
+                retention_period=Duration.days(14))
+
+        # Parquet compaction of the per-feedback JSON objects
+        self.compaction_lookback_days = int(self.node.try_get_context("compaction_lookback_days") or 3)
+        self.sdk_pandas_layer_version = self.node.try_get_context("sdk_pandas_layer_version") or "12"
+
+        # "crawler" discovers the feedback tables hourly, "projection" declares them with partition projection
+        self.glue_table_mode = self.node.try_get_context("glue_table_mode") or "crawler"
+        self.projection_start_year = int(self.node.try_get_context("projection_start_year") or 2024)
+
+        # "per_feedback" emails a report per feedback, "digest" emails one scheduled digest
+        self.report_mode = self.node.try_get_context("report_mode") or "per_feedback"
+        self.digest_period = self.node.try_get_context("digest_period") or "daily"
+        # "reason", "source_url" or "query" group the digest by that field, "cluster" by embedding similarity
+        self.digest_group_by = self.node.try_get_context("digest_group_by") or "reason"
+
+        # "template" renders the report details locally and asks the model only for recommendations,
+        # capped at report_max_tokens; "model" has the model write the whole report
+        self.report_format = self.node.try_get_context("report_format") or "template"
+        self.report_max_tokens = int(self.node.try_get_context("report_max_tokens") or 400)
+
+        # "memory" caches recommendations per Lambda container, "dynamodb" also shares them, "off" disables
+        self.recommendation_cache = self.node.try_get_context("recommendation_cache") or "memory"
+        self.recommendation_cache_ttl_seconds = int(self.node.try_get_context("recommendation_cache_ttl_seconds") or 86400)
+
+        # "memory" keeps recently read conversations in each warm container, "off" reads every lookup from Q Business
+        self.conversation_cache = self.node.try_get_context("conversation_cache") or "memory"
+        self.conversation_cache_ttl_seconds = int(self.node.try_get_context("conversation_cache_ttl_seconds") or 60)
+
+        # "s3" writes an object per feedback, "buffered" one gzipped JSON lines object per partition
+        # hour and invocation, "firehose" sends records to a Firehose stream that partitions them
+        self.feedback_sink = self.node.try_get_context("feedback_sink") or "s3"
+        self.firehose_buffer_seconds = int(self.node.try_get_context("firehose_buffer_seconds") or 60)
+
+        # "memory" records processed feedback per container, "dynamodb" in a shared table, "off" disables
+        self.idempotency = self.node.try_get_context("idempotency") or "memory"
+
+        # Optional fast model for small report payloads; modelid handles the large ones
+        self.fast_modelid = self.node.try_get_context("fast_modelid") or ""
+        self.routing_token_threshold = int(self.node.try_get_context("routing_token_threshold") or 2000)
+        self.model_latency_budget_ms = int(self.node.try_get_context("model_latency_budget_ms") or 0)
+        self.model_streaming = str(self.node.try_get_context("model_streaming")).lower() != "false"
+
+        # Token budget of the feedback record sent to the model
+        self.prompt_token_budget = int(self.node.try_get_context("prompt_token_budget") or 3000)
+        self.prompt_snippet_chars = int(self.node.try_get_context("prompt_snippet_chars") or 600)
+
+        # "off" disables the dashboard counters, "dynamodb" keeps them in a shared table
+        self.rollups = self.node.try_get_context("rollups") or "off"
+
+        # "memory" reports near-duplicate feedback once per cluster per container, "off" reports every feedback
+        self.clustering = self.node.try_get_context("clustering") or "off"
+        self.embedding_modelid = self.node.try_get_context("embedding_modelid") or "amazon.titan-embed-text-v2:0"
+        self.cluster_similarity_threshold = float(self.node.try_get_context("cluster_similarity_threshold") or 0.85)
+        self.cluster_window_seconds = int(self.node.try_get_context("cluster_window_seconds") or 86400)
+        # the digest embeds its feedback when grouped by cluster, even with clustering off
+        self.uses_embeddings = self.clustering != "off" or (
+            self.report_mode == "digest" and self.digest_group_by == "cluster")
+
+        # "memory" paces Bedrock, SES and Q Business calls per container and defers throttled report
+        # emails to a queue, "dynamodb" shares the token buckets of all instances through a table
+        self.rate_limiting = self.node.try_get_context("rate_limiting") or "memory"
+        self.bedrock_requests_per_second = float(self.node.try_get_context("bedrock_requests_per_second") or 2)
+        self.ses_emails_per_second = float(self.node.try_get_context("ses_emails_per_second") or 1)
+        self.qbusiness_requests_per_second = float(self.node.try_get_context("qbusiness_requests_per_second") or 5)
         
         # Adding consumer lambda with necessary policies and roles
         self.add_consumer_lambda()    
 
+        # Adding the feedback record sink and, in "firehose" mode, its delivery stream
+        self.add_feedback_sink()
+
+        # Adding the recommendation cache settings and shared cache table
+        self.add_recommendation_cache()
+
+        # Adding the store that absorbs duplicate PutFeedback deliveries
+        self.add_idempotency_store()
+
+        # Adding the dashboard rollup table and its rebuild Lambda
+        self.add_rollups()
+
+        # Adding the shared rate limits and the queue for deferred report emails
+        self.add_rate_limiting()
+
+        # Adding the scheduled job that compacts finished days into Parquet
+        self.add_compaction_job()
+
+        # Adding the scheduled digest report job
+        if self.report_mode == "digest":
+            self.add_digest_job()
+
+
+    ##############################################################################
+    # Method to read the per-application settings from the context
+    ##############################################################################
+
+    def application_settings(self):
+
+        # A list of application ids, or of objects with an application_id and optional
+        # max_concurrency and *_per_second overrides; a string may be a comma-separated list
+        applications = self.node.try_get_context("applications") or self.application_id or []
+        if isinstance(applications, str):
+            applications = json.loads(applications) if applications.lstrip().startswith("[") else applications.split(",")
+
+        applications = [{"application_id": application} if isinstance(application, str) else application
+                        for application in applications]
+        applications = [application for application in applications if application["application_id"].strip()]
+        if not applications:
+            raise ValueError("Set applications, or application_id, to the Q Business applications whose feedback is processed: "
+                             "edit cdk.context.json or pass -c application_id=<applicationId> "
+                             "(see Update the CDK Context Parameters in the README)")
+
+        # Only the event source of an application's queue can cap its concurrency; in "direct"
+        # mode the rules invoke the Lambda directly and nothing would enforce max_concurrency
+        if self.ingestion_mode != "sqs":
+            capped = [application["application_id"] for application in applications if application.get("max_concurrency")]
+            if capped:
+                raise ValueError(f"max_concurrency of {', '.join(capped)} needs ingestion_mode sqs; "
+                                 "use reserved_concurrency to cap the Lambda in direct mode")
+
+        settings = []
+        for application in applications:
+            settings.append({
+                "application_id": application["application_id"].strip(),
+                "max_concurrency": int(application.get("max_concurrency") or self.application_max_concurrency),
+                "rate_limits": {service: float(application[name]) for name, service in (
+                    ("bedrock_requests_per_second", "bedrock-runtime"),
+                    ("ses_emails_per_second", "ses"),
+                    ("qbusiness_requests_per_second", "qbusiness")) if application.get(name)}
+            })
+        return settings
+
+
+    ##############################################################################
+    # Method to build the Bedrock model settings shared by the report Lambdas
+    ##############################################################################
+
+    def model_environment(self):
+
+        return {
+            'FAST_MODELID': self.fast_modelid,
+            'ROUTING_TOKEN_THRESHOLD': str(self.routing_token_threshold),
+            'MODEL_LATENCY_BUDGET_MS': str(self.model_latency_budget_ms),
+            'MODEL_STREAMING': 'true' if self.model_streaming else 'false'
+        }
+
+
+    ##############################################################################
+    # Method to build the feedback clustering settings shared by the report Lambdas
+    ##############################################################################
+
+    def clustering_environment(self):
+
+        return {
+            'CLUSTERING': self.clustering,
+            'EMBEDDING_MODELID': self.embedding_modelid,
+            'CLUSTER_SIMILARITY_THRESHOLD': str(self.cluster_similarity_threshold),
+            'CLUSTER_WINDOW_SECONDS': str(self.cluster_window_seconds)
+        }
+
+
+    ##############################################################################
+    # Method to build the rate limit settings shared by the report Lambdas
+    ##############################################################################
+
+    def rate_limit_environment(self):
+
+        environment = {
+            'RATE_LIMITING': self.rate_limiting,
+            'BEDROCK_REQUESTS_PER_SECOND': str(self.bedrock_requests_per_second),
+            'SES_EMAILS_PER_SECOND': str(self.ses_emails_per_second),
+            'QBUSINESS_REQUESTS_PER_SECOND': str(self.qbusiness_requests_per_second)
+        }
+        if self.rate_limiting == "dynamodb":
+            environment['RATE_LIMIT_TABLE'] = self.rate_limit_table.table_name
+        application_rate_limits = {application["application_id"]: application["rate_limits"]
+                                   for application in self.applications if application["rate_limits"]}
+        if application_rate_limits:
+            environment['APPLICATION_RATE_LIMITS'] = json.dumps(application_rate_limits)
+        return environment
+
+
+    ##############################################################################
+    # Method to add an application's SQS buffer used by the "sqs" ingestion mode
+    ##############################################################################
+
+    def add_feedback_queue(self, application):
+
+        application_id = application["application_id"]
+
+        # Visibility timeout is six times the Lambda timeout, as recommended for SQS event sources
+        feedback_queue = self.feedback_queues[application_id] = sqs.Queue(self, f"BusinessQFeedbackQueue-{application_id}",
+            encryption=sqs.QueueEncryption.SQS_MANAGED,
+            enforce_ssl=True,
+            visibility_timeout=Duration.seconds(6 * 240),
+            dead_letter_queue=sqs.DeadLetterQueue(max_receive_count=3, queue=self.feedback_dlq))
+
+        # A burst of one application's feedback waits in its own queue rather than
+        # taking the Lambda concurrency of the others
+        self.consumer_lambda.add_event_source(event_sources.SqsEventSource(feedback_queue,
+            batch_size=self.sqs_batch_size,
+            max_batching_window=Duration.seconds(self.sqs_max_batching_window_seconds),
+            max_concurrency=application["max_concurrency"],
+            report_batch_item_failures=True))
+
+        CfnOutput(self, f"businessq-feedback-queue-url-{application_id}", value=feedback_queue.queue_url)
+
+        return feedback_queue
+
+
+    ##############################################################################
+    # Method to configure how feedback records are written to the data bucket
+    ##############################################################################
+
+    def add_feedback_sink(self):
+
+        self.consumer_lambda.add_environment('FEEDBACK_SINK', self.feedback_sink)
+
+        if self.feedback_sink != "firehose":
+            return
+
+        firehose_role = iam.Role(self, "BusinessQFeedbackFirehoseRole",
+            assumed_by=iam.ServicePrincipal("firehose.amazonaws.com"))
+        self.data_bucket.grant_read_write(firehose_role)
+
+        # Partition keys are read from each JSON line, so records land in the same
+        # application_id=/year=/month=/day=/hour= partitions as the per-feedback objects
+        partition_query = ("{application_id: .applicationId, year: .submitted_hour[0:4], month: .submitted_hour[5:7], "
+                           "day: .submitted_hour[8:10], hour: .submitted_hour[11:13]}")
+        partitions = "/".join(f"{name}=!{{partitionKeyFromQuery:{name}}}"
+                              for name in ("application_id", "year", "month", "day", "hour"))
+
+        # Dynamic partitioning needs a buffer of at least 64 MB; the interval bounds the delay
+        self.feedback_delivery_stream = firehose.CfnDeliveryStream(self, "BusinessQFeedbackDeliveryStream",
+            delivery_stream_type="DirectPut",
+            delivery_stream_encryption_configuration_input=firehose.CfnDeliveryStream.DeliveryStreamEncryptionConfigurationInputProperty(
+                key_type="AWS_OWNED_CMK"),
+            extended_s3_destination_configuration=firehose.CfnDeliveryStream.ExtendedS3DestinationConfigurationProperty(
+                bucket_arn=self.data_bucket.bucket_arn,
+                role_arn=firehose_role.role_arn,
+                prefix=f"{self.glue_database_name}/feedback/{partitions}/",
+                error_output_prefix=f"{self.glue_database_name}/feedback_errors/!{{firehose:error-output-type}}/",
+                compression_format="GZIP",
+                file_extension=".json.gz",
+                buffering_hints=firehose.CfnDeliveryStream.BufferingHintsProperty(
+                    size_in_m_bs=64,
+                    interval_in_seconds=self.firehose_buffer_seconds),
+                dynamic_partitioning_configuration=firehose.CfnDeliveryStream.DynamicPartitioningConfigurationProperty(
+                    enabled=True),
+                processing_configuration=firehose.CfnDeliveryStream.ProcessingConfigurationProperty(
+                    enabled=True,
+                    processors=[firehose.CfnDeliveryStream.ProcessorProperty(
+                        type="MetadataExtraction",
+                        parameters=[
+                            firehose.CfnDeliveryStream.ProcessorParameterProperty(
+                                parameter_name="MetadataExtractionQuery", parameter_value=partition_query),
+                            firehose.CfnDeliveryStream.ProcessorParameterProperty(
+                                parameter_name="JsonParsingEngine", parameter_value="JQ-1.6"),
+                        ])])))
+        self.feedback_delivery_stream.node.add_dependency(firehose_role)
+
+        self.consumer_lambda.add_to_role_policy(iam.PolicyStatement(
+            effect=iam.Effect.ALLOW,
+            actions=["firehose:PutRecordBatch"],
+            resources=[self.feedback_delivery_stream.attr_arn]))
+        self.consumer_lambda.add_environment('FEEDBACK_DELIVERY_STREAM', self.feedback_delivery_stream.ref)
+
+
+    ##############################################################################
+    # Method to configure the Bedrock recommendation cache
+    ##############################################################################
+
+    def add_recommendation_cache(self):
+
+        self.consumer_lambda.add_environment('RECOMMENDATION_CACHE', self.recommendation_cache)
+        self.consumer_lambda.add_environment('RECOMMENDATION_CACHE_TTL_SECONDS', str(self.recommendation_cache_ttl_seconds))
+
+        if self.recommendation_cache != "dynamodb":
+            return
+
+        # Entries expire through DynamoDB TTL on the expiresAt attribute
+        self.recommendation_cache_table = dynamodb.Table(self, "BusinessQRecommendationCache",
+            partition_key=dynamodb.Attribute(name="cacheKey", type=dynamodb.AttributeType.STRING),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expiresAt",
+            encryption=dynamodb.TableEncryption.AWS_MANAGED,
+            removal_policy=RemovalPolicy.DESTROY)
+
+        self.recommendation_cache_table.grant_read_write_data(self.consumer_lambda)
+        self.consumer_lambda.add_environment('RECOMMENDATION_CACHE_TABLE', self.recommendation_cache_table.table_name)
+
+
+    ##############################################################################
+    # Method to configure duplicate PutFeedback detection
+    ##############################################################################
+
+    def add_idempotency_store(self):
+
+        self.consumer_lambda.add_environment('IDEMPOTENCY', self.idempotency)
+
+        if self.idempotency != "dynamodb":
+            return
+
+        # Processed (applicationId, conversationId, messageId, submittedAt) tuples,
+        # kept for a week through DynamoDB TTL on the expiresAt attribute
+        self.idempotency_table = dynamodb.Table(self, "BusinessQFeedbackIdempotency",
+            partition_key=dynamodb.Attribute(name="idempotencyKey", type=dynamodb.AttributeType.STRING),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expiresAt",
+            encryption=dynamodb.TableEncryption.AWS_MANAGED,
+            removal_policy=RemovalPolicy.DESTROY)
+
+        self.idempotency_table.grant_read_write_data(self.consumer_lambda)
+        self.consumer_lambda.add_environment('IDEMPOTENCY_TABLE', self.idempotency_table.table_name)
+
+
+    ##############################################################################
+    # Method to add the dashboard rollups and the Lambda that rebuilds them
+    ##############################################################################
+
+    def add_rollups(self):
+
+        self.consumer_lambda.add_environment('ROLLUPS', self.rollups)
+
+        if self.rollups != "dynamodb":
+            return
+
+        # Feedback counts per (rollup, key), e.g. ("day#<applicationId>", "2024-02-02"),
+        # ("source", <url>) or ("user", <userId>); rebuilt from S3 rather than expired
+        self.rollup_table = dynamodb.Table(self, "BusinessQFeedbackRollups",
+            partition_key=dynamodb.Attribute(name="rollup", type=dynamodb.AttributeType.STRING),
+            sort_key=dynamodb.Attribute(name="key", type=dynamodb.AttributeType.STRING),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            encryption=dynamodb.TableEncryption.AWS_MANAGED,
+            removal_policy=RemovalPolicy.DESTROY)
+
+        self.rollup_table.grant_read_write_data(self.consumer_lambda)
+        self.consumer_lambda.add_environment('ROLLUP_TABLE', self.rollup_table.table_name)
+
+        # Invoked by hand to recompute the rollups from every persisted feedback record
+        self.rollup_rebuild_lambda = _lambda.Function(self, 'businessq-feedback-rollup-rebuild',
+            function_name='businessq_feedback_rollup_rebuild',
+            handler='rollups.lambda_handler',
+            runtime=_lambda.Runtime.PYTHON_3_11,
+            code=_lambda.Code.from_asset(
+                'lambdas/businessq_feedback_processor'),
+            timeout=Duration.minutes(15),
+            memory_size=1024,
+            environment={
+            'S3_DATA_BUCKET': self.data_bucket.bucket_name,
+            'GLUE_DATABASE_NAME': self.glue_database_name,
+            'ROLLUP_TABLE': self.rollup_table.table_name
+            },
+            layers=[self.boto_layer]
+            )
+
+        self.data_bucket.grant_read(self.rollup_rebuild_lambda, f"{self.glue_database_name}/feedback/*")
+        self.rollup_table.grant_read_write_data(self.rollup_rebuild_lambda)
+
+
+    ##############################################################################
+    # Method to add the shared token buckets and the deferred email queue and Lambda
+    ##############################################################################
+
+    def add_rate_limiting(self):
+
+        if self.rate_limiting == "dynamodb":
+            # One item per token bucket, e.g. "ses" or "bedrock-runtime#<modelId>", updated
+            # with conditional writes by every instance
+            self.rate_limit_table = dynamodb.Table(self, "BusinessQFeedbackRateLimits",
+                partition_key=dynamodb.Attribute(name="bucket", type=dynamodb.AttributeType.STRING),
+                billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+                encryption=dynamodb.TableEncryption.AWS_MANAGED,
+                removal_policy=RemovalPolicy.DESTROY)
+
+            # The shared role also covers the digest and deferred email Lambdas
+            self.rate_limit_table.grant_read_write_data(self.consumer_role)
+
+        for name, value in self.rate_limit_environment().items():
+            self.consumer_lambda.add_environment(name, value)
+
+        if self.rate_limiting == "off":
+            return
+
+        # Report emails SES throttled are sent again after DEFERRAL_DELAY_SECONDS and
+        # parked in the dead-letter queue after five attempts
+        self.deferral_dlq = sqs.Queue(self, "BusinessQDeferredEmailDLQ",
+            encryption=sqs.QueueEncryption.SQS_MANAGED,
+            enforce_ssl=True,
+            retention_period=Duration.days(14))
+
+        self.deferral_queue = sqs.Queue(self, "BusinessQDeferredEmailQueue",
+            encryption=sqs.QueueEncryption.SQS_MANAGED,
+            enforce_ssl=True,
+            visibility_timeout=Duration.seconds(6 * 60),
+            dead_letter_queue=sqs.DeadLetterQueue(max_receive_count=5, queue=self.deferral_dlq))
+
+        self.deferral_queue.grant_send_messages(self.consumer_lambda)
+        self.consumer_lambda.add_environment('DEFERRAL', 'sqs')
+        self.consumer_lambda.add_environment('DEFERRAL_QUEUE_URL', self.deferral_queue.queue_url)
+
+        # Same code asset and role as the feedback processor, which carry the SES permissions
+        self.deferred_email_lambda = _lambda.Function(self, 'businessq-feedback-deferred-email',
+            function_name='businessq_feedback_deferred_email',
+            handler='deferral.lambda_handler',
+            runtime=_lambda.Runtime.PYTHON_3_11,
+            code=_lambda.Code.from_asset(
+                'lambdas/businessq_feedback_processor'),
+            timeout=Duration.seconds(60),
+            memory_size=256,
+            role=self.consumer_role,
+            environment={
+            'FROM_ADDRESS': self.from_email,
+            'TO_ADDRESS': self.to_email,
+            **self.rate_limit_environment()
+            },
+            layers=[self.boto_layer]
+            )
+
+        # Two concurrent batches at most, so a backlog drains at the SES rate rather than all at once
+        self.deferred_email_lambda.add_event_source(event_sources.SqsEventSource(self.deferral_queue,
+            batch_size=10,
+            max_concurrency=2,
+            report_batch_item_failures=True))
+
+
+    ##############################################################################
+    # Method to add the scheduled Parquet compaction job
+    ##############################################################################
+
+    def add_compaction_job(self):
+
+        # pyarrow comes from the AWS managed AWS SDK for pandas layer
+        sdk_pandas_layer = _lambda.LayerVersion.from_layer_version_arn(self, "sdk_pandas_python3_11_layer",
+            f"arn:aws:lambda:{Aws.REGION}:336392948345:layer:AWSSDKPandas-Python311:{self.sdk_pandas_layer_version}")
+
+        # Same code asset as the feedback processor, whose partitioning and record reading it shares
+        self.compaction_lambda = _lambda.Function(self, 'businessq-feedback-compaction',
+            function_name='businessq_feedback_compaction',
+            handler='compaction.lambda_handler',
+            runtime=_lambda.Runtime.PYTHON_3_11,
+            code=_lambda.Code.from_asset(
+                'lambdas/businessq_feedback_processor'),
+            timeout=Duration.minutes(15),
+            memory_size=1024,
+            environment={
+            'S3_DATA_BUCKET': self.data_bucket.bucket_name,
+            'GLUE_DATABASE_NAME': self.glue_database_name,
+            'COMPACTION_LOOKBACK_DAYS': str(self.compaction_lookback_days)
+            },
+            layers=[sdk_pandas_layer]
+            )
+
+        # reads the JSON day partitions, writes and replaces the Parquet parts
+        self.data_bucket.grant_read(self.compaction_lambda, f"{self.glue_database_name}/feedback/*")
+        self.data_bucket.grant_read_write(self.compaction_lambda, f"{self.glue_database_name}/feedback_parquet/*")
+        self.data_bucket.grant_delete(self.compaction_lambda, f"{self.glue_database_name}/feedback_parquet/*")
+
+        # Compact the finished days shortly after midnight UTC
+        compaction_rule = events.Rule(self, "BusinessQFeedbackCompactionSchedule",
+            schedule=events.Schedule.cron(minute="15", hour="0"))
+        compaction_rule.add_target(targets.LambdaFunction(self.compaction_lambda))
+
+
+    ##############################################################################
+    # Method to add the scheduled digest report job
+    ##############################################################################
+
+    def add_digest_job(self):
+
+        # Same code asset and role as the feedback processor, which already carry
+        # the Bedrock and SES permissions the digest needs
+        self.digest_lambda = _lambda.Function(self, 'businessq-feedback-digest',
+            function_name='businessq_feedback_digest',
+            handler='digest.lambda_handler',
+            runtime=_lambda.Runtime.PYTHON_3_11,
+            code=_lambda.Code.from_asset(
+                'lambdas/businessq_feedback_processor'),
+            timeout=Duration.minutes(10),
+            memory_size=512,
+            role=self.consumer_role,
+            environment={
+            'S3_DATA_BUCKET': self.data_bucket.bucket_name,
+            'FROM_ADDRESS': self.from_email,
+            'TO_ADDRESS': self.to_email,
+            'MODELID': self.modelid,
+            'GLUE_DATABASE_NAME': self.glue_database_name,
+            'DIGEST_PERIOD': self.digest_period,
+            'DIGEST_GROUP_BY': self.digest_group_by,
+            **self.model_environment(),
+            **self.clustering_environment(),
+            **self.rate_limit_environment()
+            },
+            layers=[self.boto_layer]
+            )
+
+        self.data_bucket.grant_read(self.digest_lambda, f"{self.glue_database_name}/feedback/*")
+
+        # Report on the previous full hour or UTC day
+        if self.digest_period == "hourly":
+            digest_schedule = events.Schedule.cron(minute="5")
+        else:
+            digest_schedule = events.Schedule.cron(minute="30", hour="0")
+
+        digest_rule = events.Rule(self, "BusinessQFeedbackDigestSchedule", schedule=digest_schedule)
+        digest_rule.add_target(targets.LambdaFunction(self.digest_lambda))
+
+
+    ##############################################################################
+    # Method to add the hourly Glue crawler that discovers the feedback tables
+    ##############################################################################
+
+    def add_glue_crawler(self):
+
+        # Create Glue crawler's IAM role   
+        self.glue_crawler_role = iam.Role(
+            self, 'GlueCrawlerRole',
+            assumed_by=iam.ServicePrincipal(
+                'glue.amazonaws.com'),
+        )
+        self.glue_crawler_role.attach_inline_policy(
+            iam.Policy(
+                self,
+                "glue_crawler_role_policy",
+                statements=[
+                    iam.PolicyStatement(
+                        actions=[
+                            "s3:GetBucketLocation",
+                            "s3:ListBucket",
+                            "s3:GetBucketAcl",
+                            "s3:GetObject",
+                        ],
+                        resources=[f"{self.data_bucket.bucket_arn}/*"]
+                    )
+                ]
+            )
+        )
+
+        # Add managed policies to Glue crawler role
+        self.glue_crawler_role.add_managed_policy(
+            iam.ManagedPolicy.from_aws_managed_policy_name('service-role/AWSGlueServiceRole'))
+
+        self.audit_policy = glue.CfnCrawler.SchemaChangePolicyProperty(update_behavior='UPDATE_IN_DATABASE', delete_behavior='LOG')
+        
+        self.glue_crawler = glue.CfnCrawler(self,f"{self.glue_database_name}-crawler",
+            name= f"{self.glue_database_name}-crawler",
+            role=self.glue_crawler_role.role_arn,
+            database_name=self.glue_database_name,
+            schedule=glue.CfnCrawler.ScheduleProperty(
+                schedule_expression="cron(0 * * * ? *)"
+                ),
+            targets=glue.CfnCrawler.TargetsProperty(
+                s3_targets= [glue.CfnCrawler.S3TargetProperty(
+                    path=f"s3://{self.data_bucket.bucket_name}/{self.glue_database_name}/feedback/",
+                    exclusions= ["Unsaved","athena_query_result/**"],
+                    sample_size=100
+                ),
+                glue.CfnCrawler.S3TargetProperty(
+                    path=f"s3://{self.data_bucket.bucket_name}/{self.glue_database_name}/feedback_parquet/",
+                    exclusions= ["Unsaved","athena_query_result/**","**/_manifest.json"],
+                    sample_size=100
+                )]
+            )
+        )
+
+
+    ##############################################################################
+    # Method to declare the feedback tables with Athena partition projection
+    ##############################################################################
+
+    def add_feedback_tables(self, glue_database):
+
+        feedback_location = f"s3://{self.data_bucket.bucket_name}/{self.glue_database_name}/feedback/"
+        parquet_location = f"s3://{self.data_bucket.bucket_name}/{self.glue_database_name}/feedback_parquet/"
+
+        # application_id/year/month/day(/hour) values are computed by Athena from these
+        # ranges instead of being registered by a crawler, so new hours are queryable as
+        # soon as they land and a filter on any of them prunes the S3 listing
+        day_partition_keys = [
+            glue.CfnTable.ColumnProperty(name="application_id", type="string"),
+            glue.CfnTable.ColumnProperty(name="year", type="string"),
+            glue.CfnTable.ColumnProperty(name="month", type="string"),
+            glue.CfnTable.ColumnProperty(name="day", type="string"),
+        ]
+        hour_partition_keys = day_partition_keys + [glue.CfnTable.ColumnProperty(name="hour", type="string")]
+
+        def projection_parameters(location, classification, hourly):
+            parameters = {
+                "classification": classification,
+                "projection.enabled": "true",
+                "projection.application_id.type": "enum",
+                "projection.application_id.values": ",".join(application["application_id"] for application in self.applications),
+                "projection.year.type": "integer",
+                "projection.year.range": f"{self.projection_start_year},2099",
+                "projection.month.type": "integer",
+                "projection.month.range": "1,12",
+                "projection.month.digits": "2",
+                "projection.day.type": "integer",
+                "projection.day.range": "1,31",
+                "projection.day.digits": "2",
+                "storage.location.template": location + "application_id=${application_id}/year=${year}/month=${month}/day=${day}/",
+            }
+            if hourly:
+                parameters.update({
+                    "projection.hour.type": "integer",
+                    "projection.hour.range": "0,23",
+                    "projection.hour.digits": "2",
+                    "storage.location.template": parameters["storage.location.template"] + "hour=${hour}/",
+                })
+            return parameters
+
+        # One JSON document per feedback, as written by the feedback processor
+        self.feedback_table = glue.CfnTable(self, "BusinessQFeedbackTable",
+            catalog_id=Aws.ACCOUNT_ID,
+            database_name=self.glue_database_name,
+            table_input=glue.CfnTable.TableInputProperty(
+                name=self.glue_database_name,
+                table_type="EXTERNAL_TABLE",
+                parameters=projection_parameters(feedback_location, "json", hourly=True),
+                partition_keys=hour_partition_keys,
+                storage_descriptor=glue.CfnTable.StorageDescriptorProperty(
+                    location=feedback_location,
+                    input_format="org.apache.hadoop.mapred.TextInputFormat",
+                    output_format="org.apache.hadoop.hive.ql.io.HiveIgnoreKeyTextOutputFormat",
+                    serde_info=glue.CfnTable.SerdeInfoProperty(
+                        serialization_library="org.openx.data.jsonserde.JsonSerDe",
+                        parameters={"ignore.malformed.json": "true"}
+                    ),
+                    columns=[
+                        glue.CfnTable.ColumnProperty(name="messageid", type="string"),
+                        glue.CfnTable.ColumnProperty(name="query", type="string"),
+                        glue.CfnTable.ColumnProperty(name="message", type="string"),
+                        glue.CfnTable.ColumnProperty(name="source_attribution_urls", type="array<string>"),
+                        glue.CfnTable.ColumnProperty(name="sourceattribution",
+                            type="array<struct<title:string,snippet:string,url:string,citationnumber:int,updatedat:string>>"),
+                        glue.CfnTable.ColumnProperty(name="applicationid", type="string"),
+                        glue.CfnTable.ColumnProperty(name="usefulness", type="string"),
+                        glue.CfnTable.ColumnProperty(name="usefulness_comment", type="string"),
+                        glue.CfnTable.ColumnProperty(name="userid", type="string"),
+                        glue.CfnTable.ColumnProperty(name="submittedat", type="string"),
+                    ]
+                )
+            )
+        )
+
+        # Application days compacted by the Parquet compaction job
+        self.feedback_parquet_table = glue.CfnTable(self, "BusinessQFeedbackParquetTable",
+            catalog_id=Aws.ACCOUNT_ID,
+            database_name=self.glue_database_name,
+            table_input=glue.CfnTable.TableInputProperty(
+                name=f"{self.glue_database_name}_parquet",
+                table_type="EXTERNAL_TABLE",
+                parameters=projection_parameters(parquet_location, "parquet", hourly=False),
+                partition_keys=day_partition_keys,
+                storage_descriptor=glue.CfnTable.StorageDescriptorProperty(
+                    location=parquet_location,
+                    input_format="org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat",
+                    output_format="org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat",
+                    serde_info=glue.CfnTable.SerdeInfoProperty(
+                        serialization_library="org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe"
+                    ),
+                    columns=[
+                        glue.CfnTable.ColumnProperty(name="messageid", type="string"),
+                        glue.CfnTable.ColumnProperty(name="applicationid", type="string"),
+                        glue.CfnTable.ColumnProperty(name="userid", type="string"),
+                        glue.CfnTable.ColumnProperty(name="usefulness", type="string"),
+                        glue.CfnTable.ColumnProperty(name="usefulness_comment", type="string"),
+                        glue.CfnTable.ColumnProperty(name="query", type="string"),
+                        glue.CfnTable.ColumnProperty(name="message", type="string"),
+                        glue.CfnTable.ColumnProperty(name="submittedat", type="string"),
+                        glue.CfnTable.ColumnProperty(name="submitted_at", type="timestamp"),
+                        glue.CfnTable.ColumnProperty(name="source_attribution_count", type="int"),
+                        glue.CfnTable.ColumnProperty(name="source_attribution_titles", type="array<string>"),
+                        glue.CfnTable.ColumnProperty(name="source_attribution_snippets", type="array<string>"),
+                        glue.CfnTable.ColumnProperty(name="source_attribution_urls", type="array<string>"),
+                        glue.CfnTable.ColumnProperty(name="source_attribution_citation_numbers", type="array<int>"),
+                    ]
+                )
+            )
+        )
+
+        self.feedback_table.node.add_dependency(glue_database)
+        self.feedback_parquet_table.node.add_dependency(glue_database)
+
 
     ##############################################################################
     # Method to add consumer lambda along with necessary permissions and policies
@@ -58,12 +764,15 @@ class QLambdaStack(Stack):
         policy_statement_q = iam.PolicyStatement(
             effect=iam.Effect.ALLOW,
             actions=[ "qbusiness:ListMessages"],
-            resources=[f"arn:aws:qbusiness:{Aws.REGION}:{Aws.ACCOUNT_ID}:application/{self.application_id}"]
+            resources=[f"arn:aws:qbusiness:{Aws.REGION}:{Aws.ACCOUNT_ID}:application/{application['application_id']}"
+                       for application in self.applications]
         )
         policy_statement_bedrock = iam.PolicyStatement(
             effect=iam.Effect.ALLOW,
-            actions=["bedrock:InvokeModel"],
-            resources=[f"arn:aws:bedrock:{Aws.REGION}::foundation-model/{self.modelid}"]
+            actions=["bedrock:InvokeModel", "bedrock:InvokeModelWithResponseStream"],
+            resources=[f"arn:aws:bedrock:{Aws.REGION}::foundation-model/{model_id}"
+                       for model_id in dict.fromkeys(filter(None, [self.modelid, self.fast_modelid,
+                           self.embedding_modelid if self.uses_embeddings else None]))]
         )
 
         policy_statement_ses = iam.PolicyStatement(
@@ -97,7 +806,7 @@ class QLambdaStack(Stack):
         self.consumer_role.add_managed_policy(iam.ManagedPolicy.from_aws_managed_policy_name("service-role/AWSLambdaBasicExecutionRole"))
 
         # Lambdas and layers for the business Q boto API
-        boto_layer = _lambda.LayerVersion(
+        self.boto_layer = _lambda.LayerVersion(
             self, "boto_python3_11_layer",
             code=_lambda.AssetCode('lambdas/layer/boto_python_layer.zip'),
             compatible_runtimes=[_lambda.Runtime.PYTHON_3_11])
@@ -105,21 +814,31 @@ class QLambdaStack(Stack):
         # Defining and deploying a Lambda function
         self.consumer_lambda = _lambda.Function(self, 'businessq-feedback-processor',
             function_name='businessq_feedback_processor',
-            handler='lambda-handler.lambda_handler',
+            handler='lambda-handler.batch_handler' if self.ingestion_mode == "sqs" else 'lambda-handler.lambda_handler',
             runtime=_lambda.Runtime.PYTHON_3_11,
             code=_lambda.Code.from_asset(
                 'lambdas/businessq_feedback_processor'),
             timeout=Duration.seconds(240),
             memory_size=256,
+            reserved_concurrent_executions=self.reserved_concurrency or None,
             role=self.consumer_role,
             environment={
             'S3_DATA_BUCKET': self.data_bucket.bucket_name,
             'FROM_ADDRESS': self.from_email,
             'TO_ADDRESS': self.to_email,
             'MODELID': self.modelid,
-            'GLUE_DATABASE_NAME': self.glue_database_name
+            'GLUE_DATABASE_NAME': self.glue_database_name,
+            'REPORT_MODE': self.report_mode,
+            'REPORT_FORMAT': self.report_format,
+            'REPORT_MAX_TOKENS': str(self.report_max_tokens),
+            'PROMPT_TOKEN_BUDGET': str(self.prompt_token_budget),
+            'PROMPT_SNIPPET_CHARS': str(self.prompt_snippet_chars),
+            'CONVERSATION_CACHE': self.conversation_cache,
+            'CONVERSATION_CACHE_TTL_SECONDS': str(self.conversation_cache_ttl_seconds),
+            **self.model_environment(),
+            **self.clustering_environment()
             },
-            layers=[boto_layer]
+            layers=[self.boto_layer]
             )
         
  
@@ -136,19 +855,28 @@ class QLambdaStack(Stack):
         self.trail = cloudtrail.Trail(self, 'BusinessQCloudTrail',
                 trail_name='BusinessQCloudTrail')
 
-        # Setting up an EventRule to trigger lambda function on certain conditions
-        event_rule = cloudtrail.Trail.on_event(self, "BusinessQCloudWatchEvent",
-            target=targets.LambdaFunction(self.consumer_lambda)
-        )
+        # Setting up an EventRule per application to trigger lambda function on certain conditions,
+        # either directly or through the application's SQS buffer that the Lambda drains in batches
+        for application in self.applications:
+            application_id = application["application_id"]
+            if self.ingestion_mode == "sqs":
+                event_target = targets.SqsQueue(self.add_feedback_queue(application))
+            else:
+                event_target = targets.LambdaFunction(self.consumer_lambda)
 
-        event_rule.add_event_pattern(
-            source=["aws.qbusiness"],
-            detail_type=["AWS API Call via CloudTrail"],
-            detail={
-                "eventSource":["qbusiness.amazonaws.com"],
-                "eventName": ["PutFeedback"]
-            }
-        )
+            event_rule = cloudtrail.Trail.on_event(self, f"BusinessQCloudWatchEvent-{application_id}",
+                target=event_target
+            )
+
+            event_rule.add_event_pattern(
+                source=["aws.qbusiness"],
+                detail_type=["AWS API Call via CloudTrail"],
+                detail={
+                    "eventSource":["qbusiness.amazonaws.com"],
+                    "eventName": ["PutFeedback"],
+                    "requestParameters": {"applicationId": [application_id]}
+                }
+            )
         
         # Attaching custom advanced event selectors to the CloudTrail 'trail'
         event_selectors = [
@@ -214,35 +942,6 @@ class QLambdaStack(Stack):
         )
 
    
-        # Create Glue crawler's IAM role   
-        self.glue_crawler_role = iam.Role(
-            self, 'GlueCrawlerRole',
-            assumed_by=iam.ServicePrincipal(
-                'glue.amazonaws.com'),
-        )
-        self.glue_crawler_role.attach_inline_policy(
-            iam.Policy(
-                self,
-                "glue_crawler_role_policy",
-                statements=[
-                    iam.PolicyStatement(
-                        actions=[
-                            "s3:GetBucketLocation",
-                            "s3:ListBucket",
-                            "s3:GetBucketAcl",
-                            "s3:GetObject",
-                        ],
-                        resources=[f"{self.data_bucket.bucket_arn}/*"]
-                    )
-                ]
-            )
-        )
-
-        # Add managed policies to Glue crawler role
-        self.glue_crawler_role.add_managed_policy(
-            iam.ManagedPolicy.from_aws_managed_policy_name('service-role/AWSGlueServiceRole'))
-
-
         # Create Glue Database
         glue_database= glue_alpha.Database(
             self,
@@ -253,23 +952,11 @@ class QLambdaStack(Stack):
         # Delete the database when deleting the stack
         glue_database.apply_removal_policy(policy=RemovalPolicy.DESTROY)
         
-        self.audit_policy = glue.CfnCrawler.SchemaChangePolicyProperty(update_behavior='UPDATE_IN_DATABASE', delete_behavior='LOG')
-        
-        self.glue_crawler = glue.CfnCrawler(self,f"{self.glue_database_name}-crawler",
-            name= f"{self.glue_database_name}-crawler",
-            role=self.glue_crawler_role.role_arn,
-            database_name=self.glue_database_name,
-            schedule=glue.CfnCrawler.ScheduleProperty(
-                schedule_expression="cron(0 * * * ? *)"
-                ),
-            targets=glue.CfnCrawler.TargetsProperty(
-                s3_targets= [glue.CfnCrawler.S3TargetProperty(
-                    path=f"s3://{self.data_bucket.bucket_name}/{self.glue_database_name}/feedback/",
-                    exclusions= ["Unsaved","athena_query_result/**"],
-                    sample_size=100
-                )]
-            )
-        )
+        # Declare the feedback tables with partition projection, or let the crawler discover them
+        if self.glue_table_mode == "projection":
+            self.add_feedback_tables(glue_database)
+        else:
+            self.add_glue_crawler()
 
 
         # Sample query to list all the USEFULNESS feedback by user.
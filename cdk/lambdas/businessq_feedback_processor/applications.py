@@ -0,0 +1,39 @@
+import json
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+# the Q Business application whose feedback is being processed; set per event by the
+# handler and carried into the pipeline stage threads with the rest of the context
+_current_application: ContextVar[Optional[str]] = ContextVar('current_application', default=None)
+
+
+def current_application() -> Optional[str]:
+    return _current_application.get()
+
+
+@contextmanager
+def application_scope(application_id: Optional[str]):
+    """Attributes the metrics and rate-limited calls made inside the block to application_id."""
+    token = _current_application.set(application_id)
+    try:
+        yield
+    finally:
+        _current_application.reset(token)
+
+
+def application_limits_from_environment() -> Dict[str, Dict[str, Tuple[float, float]]]:
+    """
+    Per-application requests per second from APPLICATION_RATE_LIMITS, a JSON object of
+    application id to service name ("bedrock-runtime", "ses", "qbusiness") to rate,
+    e.g. {"<applicationId>": {"bedrock-runtime": 1}}. Each bucket holds
+    RATE_LIMIT_BURST_SECONDS (2) of its rate, as the shared ones do.
+
+    :return: Application id to service name to (requests per second, burst).
+    """
+    burst_seconds = float(os.environ.get('RATE_LIMIT_BURST_SECONDS', '2'))
+    configured = json.loads(os.environ.get('APPLICATION_RATE_LIMITS') or '{}')
+    return {application_id: {service: (float(rate), max(1.0, float(rate) * burst_seconds))
+                              for service, rate in rates.items() if float(rate) > 0}
+            for application_id, rates in configured.items()}
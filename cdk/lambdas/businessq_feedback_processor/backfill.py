@@ -0,0 +1,315 @@
+import argparse
+import gzip
+import importlib.util
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# CloudTrail delivers one object per account, region and ~5 minutes:
+# AWSLogs/<account>/CloudTrail/<region>/YYYY/MM/DD/<account>_CloudTrail_<region>_YYYYMMDDTHHMMZ_<id>.json.gz
+LOG_FILE_TIME = re.compile(r'_(\d{8}T\d{4}Z)_[^/]*\.json\.gz$')
+
+# a log file can hold events up to this long before its delivery timestamp
+DELIVERY_SLACK = timedelta(minutes=15)
+
+
+def log_file_time(key: str) -> Optional[datetime]:
+    match = LOG_FILE_TIME.search(key)
+    if match is None:
+        return None
+    return datetime.strptime(match.group(1), '%Y%m%dT%H%MZ').replace(tzinfo=timezone.utc)
+
+
+def parse_event_time(value: str) -> datetime:
+    return datetime.strptime(value, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc)
+
+
+def list_s3_log_files(s3, bucket: str, prefix: str, start: datetime, end: datetime) -> Iterator[str]:
+    """Keys of the CloudTrail log files under prefix (the .../CloudTrail/<region> folder) that can hold [start, end)."""
+    prefix = prefix.rstrip('/')
+    day = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    while day < end + DELIVERY_SLACK:
+        for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=f'{prefix}/{day:%Y/%m/%d}/'):
+            for item in page.get('Contents', []):
+                delivered = log_file_time(item['Key'])
+                if delivered is not None and start <= delivered < end + DELIVERY_SLACK:
+                    yield item['Key']
+        day += timedelta(days=1)
+
+
+def list_local_log_files(path: str, start: datetime, end: datetime) -> Iterator[str]:
+    """Paths of the .json.gz CloudTrail log files below path that can hold [start, end)."""
+    for folder, _, files in sorted(os.walk(path)):
+        for name in sorted(files):
+            delivered = log_file_time(name)
+            if delivered is None and name.endswith('.json.gz'):
+                # files renamed on download are always read
+                yield os.path.join(folder, name)
+            elif delivered is not None and start <= delivered < end + DELIVERY_SLACK:
+                yield os.path.join(folder, name)
+
+
+def read_log_records(stream) -> List[Dict[str, Any]]:
+    """Decompresses a CloudTrail log file from a binary stream and returns its Records."""
+    with gzip.GzipFile(fileobj=stream) as f:
+        return json.load(f).get('Records', [])
+
+
+def feedback_events(records: List[Dict[str, Any]], start: datetime, end: datetime,
+                    application_id: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """
+    The successful PutFeedback calls in [start, end), wrapped the way EventBridge
+    delivers them to lambda_handler.
+    """
+    for record in records:
+        if record.get('eventSource') != 'qbusiness.amazonaws.com' or record.get('eventName') != 'PutFeedback':
+            continue
+        if record.get('errorCode') or not record.get('requestParameters'):
+            continue
+        if not start <= parse_event_time(record['eventTime']) < end:
+            continue
+        if application_id and record['requestParameters'].get('applicationId') != application_id:
+            continue
+        yield {
+            'version': '0',
+            'id': record.get('eventID'),
+            'source': 'aws.qbusiness',
+            'detail-type': 'AWS API Call via CloudTrail',
+            'time': record['eventTime'],
+            'region': record.get('awsRegion'),
+            'detail': record,
+        }
+
+
+class Checkpoint:
+    """
+    The log files already backfilled, saved as JSON after each finished file so an
+    interrupted run resumes where it stopped. A file is only recorded once every
+    feedback event in it was processed, so files with failures are retried.
+    """
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.done = set()
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.done = set(json.load(f).get('completed_log_files', []))
+
+    def __contains__(self, log_file: str) -> bool:
+        return log_file in self.done
+
+    def complete(self, log_file: str) -> None:
+        with self._lock:
+            self.done.add(log_file)
+            if not self.path:
+                return
+            # write then rename, so a crash never leaves a truncated checkpoint
+            folder = os.path.dirname(os.path.abspath(self.path))
+            with tempfile.NamedTemporaryFile('w', dir=folder, delete=False, suffix='.tmp') as f:
+                json.dump({'completed_log_files': sorted(self.done)}, f)
+            os.replace(f.name, self.path)
+
+
+def run_backfill(log_files: Iterator[str], open_log_file: Callable[[str], Any], process: Callable[[Dict[str, Any]], Any],
+                 start: datetime, end: datetime, workers: int = 8, checkpoint: Optional[Checkpoint] = None,
+                 application_id: Optional[str] = None, flush: Optional[Callable[[], Any]] = None) -> Dict[str, Any]:
+    """
+    Replays the PutFeedback events of the log files through process with at most
+    workers events in flight. Log files are read one at a time while earlier events
+    are still processing.
+
+    :param open_log_file: Returns a binary stream of a log file's gzipped content.
+    :param process: Called with each EventBridge-shaped event, e.g. process_feedback.
+    :param flush: Writes the records a buffering feedback sink holds, e.g. flush_feedback,
+                  and makes the events of records it could not write replayable before
+                  raising. Called as each log file finishes, before it is checkpointed,
+                  and once more after the last event.
+    :return: Run stats, including events per second.
+    """
+    checkpoint = checkpoint or Checkpoint(None)
+    stats = {'log_files': 0, 'log_files_skipped': 0, 'records': 0, 'feedback_events': 0,
+             'processed': 0, 'failed': 0, 'failed_events': [], 'failed_flushes': 0}
+    lock = threading.Lock()
+    # bounds the queued events, so memory stays flat however many files are read
+    slots = threading.BoundedSemaphore(workers * 2)
+    pending: Dict[str, List[int]] = {}
+
+    def finish(log_file: str, failed: bool) -> None:
+        with lock:
+            counts = pending[log_file]
+            counts[0] -= 1
+            counts[1] += failed
+            finished = counts[0] == 0
+        if finished and not counts[1]:
+            if flush is not None and not flush_all(log_file):
+                return
+            checkpoint.complete(log_file)
+
+    def flush_all(log_file: Optional[str] = None) -> bool:
+        """Flushes the sink; on failure no file with events in flight is checkpointed."""
+        try:
+            flush()
+            return True
+        except Exception:
+            # the buffer held records of every file in flight, and the unwritten ones
+            # are replayed on resume, so none of those files may be checkpointed
+            logger.exception(f"Writing the feedback records of {log_file or 'the last log files'} failed")
+            with lock:
+                stats['failed_flushes'] += 1
+                for counts in pending.values():
+                    if counts[0]:
+                        counts[1] += 1
+            return False
+
+    def replay(log_file: str, event: Dict[str, Any]) -> None:
+        failed = False
+        try:
+            process(event)
+            with lock:
+                stats['processed'] += 1
+        except Exception as e:
+            failed = True
+            logger.exception(f"Backfill of event {event['id']} from {log_file} failed")
+            with lock:
+                stats['failed'] += 1
+                stats['failed_events'].append({'log_file': log_file, 'event_id': event['id'], 'error': repr(e)})
+        finally:
+            slots.release()
+            finish(log_file, failed)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for log_file in log_files:
+            if log_file in checkpoint:
+                stats['log_files_skipped'] += 1
+                continue
+            records = read_log_records(open_log_file(log_file))
+            stats['log_files'] += 1
+            stats['records'] += len(records)
+
+            # one extra count holds the file open until all its events are submitted
+            pending[log_file] = [1, 0]
+            for event in feedback_events(records, start, end, application_id):
+                stats['feedback_events'] += 1
+                slots.acquire()
+                with lock:
+                    pending[log_file][0] += 1
+                pool.submit(replay, log_file, event)
+            finish(log_file, False)
+
+    # records of files that had a failed event were not flushed with them
+    if flush is not None:
+        flush_all()
+
+    stats['seconds'] = round(time.perf_counter() - started, 3)
+    stats['events_per_second'] = round(stats['feedback_events'] / stats['seconds'], 1) if stats['seconds'] else 0.0
+    return stats
+
+
+class BufferedReplay:
+    """
+    Replays events through the feedback handler and flushes its sink. The idempotency
+    keys of events whose buffered record could not be written are released, so
+    a resumed backfill replays them instead of skipping them as duplicates.
+    """
+
+    def __init__(self, handler, persist_only: bool = False):
+        self.handler = handler
+        self.persist_only = persist_only
+        # events whose record may still be buffered, by record key
+        self.events: Dict[Tuple, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def process(self, event: Dict[str, Any]) -> None:
+        key = self.handler.event_record_key(event)
+        if self.handler.feedback_sink.buffered:
+            with self._lock:
+                self.events[key] = event
+        record = None
+        try:
+            record = self.handler.process_feedback(event, persist_only=self.persist_only)
+        finally:
+            # failed, duplicate or not found: nothing of this event was buffered
+            if not record:
+                with self._lock:
+                    self.events.pop(key, None)
+
+    def flush(self) -> None:
+        try:
+            written = self.handler.flush_feedback()
+        except self.handler.SinkFlushError as e:
+            with self._lock:
+                for record in e.written:
+                    self.events.pop(self.handler.feedback_record_key(record), None)
+                unwritten = [self.events.pop(self.handler.feedback_record_key(record), None) for record in e.records]
+            for event in filter(None, unwritten):
+                self.handler.release_feedback(event)
+            raise
+        with self._lock:
+            for record in written:
+                self.events.pop(self.handler.feedback_record_key(record), None)
+
+
+def load_feedback_handler():
+    """Imports lambda-handler.py, whose hyphenated name rules out a plain import."""
+    spec = importlib.util.spec_from_file_location(
+        'feedback_handler', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lambda-handler.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def parse_time(value: str) -> datetime:
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def log_file_source(args) -> Tuple[Iterator[str], Callable[[str], Any]]:
+    if args.log_dir:
+        return list_local_log_files(args.log_dir, args.start, args.end), lambda path: open(path, 'rb')
+
+    from clients import get_client
+    s3 = get_client('s3')
+    return (list_s3_log_files(s3, args.bucket, args.prefix, args.start, args.end),
+            lambda key: s3.get_object(Bucket=args.bucket, Key=key)['Body'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Replay PutFeedback events from CloudTrail log files through the feedback pipeline. '
+                    'Uses the same environment variables as the feedback Lambda (S3_DATA_BUCKET, '
+                    'GLUE_DATABASE_NAME, MODELID, FROM_ADDRESS, TO_ADDRESS, IDEMPOTENCY, ...).')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--bucket', help='bucket of the BusinessQCloudTrail trail')
+    source.add_argument('--log-dir', help='local folder of downloaded .json.gz log files')
+    parser.add_argument('--prefix', help='AWSLogs/<account>/CloudTrail/<region> folder in the trail bucket')
+    parser.add_argument('--start', type=parse_time, required=True, help='ISO time, UTC unless an offset is given')
+    parser.add_argument('--end', type=parse_time, required=True)
+    parser.add_argument('--application-id', help='only replay feedback for this Q Business application')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--checkpoint', help='JSON file recording finished log files, for resuming')
+    parser.add_argument('--persist-only', action='store_true', help='write the feedback records without report emails')
+    args = parser.parse_args()
+    if args.bucket and not args.prefix:
+        parser.error('--prefix is required with --bucket')
+
+    logging.basicConfig(level=logging.WARNING)
+    handler = load_feedback_handler()
+    log_files, open_log_file = log_file_source(args)
+    replay = BufferedReplay(handler, persist_only=args.persist_only)
+    result = run_backfill(log_files, open_log_file, process=replay.process,
+                          start=args.start, end=args.end, workers=args.workers,
+                          checkpoint=Checkpoint(args.checkpoint), application_id=args.application_id,
+                          flush=replay.flush)
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,54 @@
+import threading
+
+# Client settings for a short-lived Lambda: fail fast on connect, bound reads by
+# what each call can take, and leave retries to botocore's standard mode (adaptive
+# for Bedrock, which throttles first under bursts). The pool covers the pipeline
+# stages that share a client concurrently. Throttles that outlast these retries are
+# paced and retried by throttling.RateLimiter.
+CLIENT_SETTINGS = {
+    'qbusiness': {'connect_timeout': 2, 'read_timeout': 15, 'retries': {'max_attempts': 3, 'mode': 'standard'}},
+    's3': {'connect_timeout': 2, 'read_timeout': 15, 'retries': {'max_attempts': 3, 'mode': 'standard'}},
+    'bedrock-runtime': {'connect_timeout': 2, 'read_timeout': 120, 'retries': {'max_attempts': 4, 'mode': 'adaptive'}},
+    'ses': {'connect_timeout': 2, 'read_timeout': 10, 'retries': {'max_attempts': 3, 'mode': 'standard'}},
+    'dynamodb': {'connect_timeout': 1, 'read_timeout': 5, 'retries': {'max_attempts': 3, 'mode': 'standard'}},
+    'sqs': {'connect_timeout': 2, 'read_timeout': 10, 'retries': {'max_attempts': 3, 'mode': 'standard'}},
+    'firehose': {'connect_timeout': 2, 'read_timeout': 10, 'retries': {'max_attempts': 3, 'mode': 'standard'}},
+}
+DEFAULT_SETTINGS = {'connect_timeout': 2, 'read_timeout': 30, 'retries': {'max_attempts': 3, 'mode': 'standard'}}
+MAX_POOL_CONNECTIONS = 10
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def get_client(service_name: str):
+    """
+    Returns the boto3 client for service_name, creating it on first use.
+
+    Clients are memoized at module level so warm invocations reuse them and their
+    connection pools, while a cold start only pays for the clients it needs. boto3
+    itself is imported on first use too, keeping it out of the module import.
+    """
+    client = _clients.get(service_name)
+    if client is None:
+        with _lock:
+            client = _clients.get(service_name)
+            if client is None:
+                import boto3
+                from botocore.config import Config
+
+                settings = CLIENT_SETTINGS.get(service_name, DEFAULT_SETTINGS)
+                client = boto3.client(service_name, config=Config(max_pool_connections=MAX_POOL_CONNECTIONS, **settings))
+                _clients[service_name] = client
+    return client
+
+
+def set_client(service_name: str, client) -> None:
+    """Replaces the client for service_name, e.g. with a stub in local runs."""
+    with _lock:
+        _clients[service_name] = client
+
+
+def reset_clients() -> None:
+    with _lock:
+        _clients.clear()
@@ -0,0 +1,231 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+import metrics
+import throttling
+from clients import get_client
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# cluster_id is stable for the life of the index; size counts the members so far,
+# including this one; report is True for the member that should be reported on,
+# the first one unless its report failed and the cluster was released
+Assignment = namedtuple('Assignment', ['cluster_id', 'similarity', 'size', 'is_new', 'report'])
+
+
+def feedback_text(record: Dict[str, Any]) -> str:
+    """What makes two feedbacks duplicates: the comment and the question asked."""
+    return f"{record.get('usefulness_comment') or ''}\n{record.get('query') or ''}".strip()
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class HashingEmbedder:
+    """
+    Deterministic local embedder: word and character trigram features hashed into
+    a fixed number of signed dimensions. Reworded feedback sharing most words or
+    word fragments lands close together, with no model call, which makes it the
+    embedder for tests and benchmarks.
+    """
+
+    def __init__(self, dimensions: int = 256):
+        self.dimensions = dimensions
+
+    def features(self, text: str) -> List[str]:
+        words = re.findall(r'[a-z0-9]+', text.lower())
+        joined = f" {' '.join(words)} "
+        return words + [joined[i:i + 3] for i in range(len(joined) - 2)]
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            hashes = np.array([zlib.crc32(feature.encode('utf-8')) for feature in self.features(text)], dtype=np.uint32)
+            if hashes.size:
+                # the low bits pick the dimension and the top bit the sign
+                np.add.at(vectors[row], hashes % self.dimensions, np.where(hashes >> 31, -1.0, 1.0))
+        return normalize_rows(vectors)
+
+
+class BedrockEmbedder:
+    """Amazon Titan text embeddings on Bedrock, one InvokeModel call per text."""
+
+    def __init__(self, model_id: str = 'amazon.titan-embed-text-v2:0', dimensions: int = 256, workers: int = 8):
+        self.model_id = model_id
+        self.dimensions = dimensions
+        self.workers = workers
+
+    def embed_one(self, text: str) -> List[float]:
+        response = throttling.call(
+            'bedrock-runtime', get_client('bedrock-runtime').invoke_model, bucket=self.model_id,
+            modelId=self.model_id, contentType='application/json', accept='application/json',
+            body=json.dumps({'inputText': text or '(empty)', 'dimensions': self.dimensions, 'normalize': True}))
+        return json.loads(response['body'].read())['embedding']
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        if len(texts) == 1:
+            embeddings = [self.embed_one(texts[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                embeddings = list(pool.map(self.embed_one, texts))
+        return normalize_rows(np.array(embeddings, dtype=np.float32).reshape(len(texts), self.dimensions))
+
+
+class ClusterIndex:
+    """
+    Nearest-centroid index over the recent clusters of unit-length embeddings.
+
+    Centroids are rows of one float32 matrix, so a lookup is a single matrix-vector
+    product. A vector joins the most similar cluster seen within window_seconds when
+    the cosine similarity reaches threshold, and otherwise starts a new one. Rows of
+    expired clusters are reused, and at max_clusters the least recently seen cluster
+    is evicted. Not thread-safe; FeedbackClusterer serializes access.
+    """
+
+    def __init__(self, dimensions: int, threshold: float = 0.85, window_seconds: float = 86400,
+                 capacity: int = 1024, max_clusters: int = 100000, clock: Callable[[], float] = time.time):
+        self.dimensions = dimensions
+        self.threshold = threshold
+        self.window_seconds = window_seconds
+        self.max_clusters = max_clusters
+        self.clock = clock
+        self.size = 0
+        self.next_id = 0
+        self.centroids = np.zeros((capacity, dimensions), dtype=np.float32)
+        self.sums = np.zeros((capacity, dimensions), dtype=np.float32)
+        self.counts = np.zeros(capacity, dtype=np.int64)
+        self.last_seen = np.zeros(capacity, dtype=np.float64)
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.unreported = np.zeros(capacity, dtype=bool)
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self.last_seen[:self.size] >= self.clock() - self.window_seconds))
+
+    def nearest(self, vector: np.ndarray, now: Optional[float] = None):
+        """Row and cosine similarity of the closest live cluster, (-1, -1.0) if there is none."""
+        if not self.size:
+            return -1, -1.0
+        now = self.clock() if now is None else now
+        scores = self.centroids[:self.size] @ vector
+        scores[self.last_seen[:self.size] < now - self.window_seconds] = -np.inf
+        row = int(np.argmax(scores))
+        return (row, float(scores[row])) if np.isfinite(scores[row]) else (-1, -1.0)
+
+    def assign(self, vector: np.ndarray) -> Assignment:
+        now = self.clock()
+        row, similarity = self.nearest(vector, now)
+        if row >= 0 and similarity >= self.threshold:
+            self.sums[row] += vector
+            self.centroids[row] = self.sums[row] / (np.linalg.norm(self.sums[row]) or 1)
+            self.counts[row] += 1
+            self.last_seen[row] = now
+            report = bool(self.unreported[row])
+            self.unreported[row] = False
+            return Assignment(int(self.ids[row]), similarity, int(self.counts[row]), False, report)
+
+        row = self.free_row(now)
+        self.centroids[row] = self.sums[row] = vector
+        self.counts[row] = 1
+        self.last_seen[row] = now
+        self.ids[row] = self.next_id
+        self.unreported[row] = False
+        self.next_id += 1
+        return Assignment(int(self.ids[row]), similarity, 1, True, True)
+
+    def release(self, cluster_id: int) -> None:
+        """Hands the report of a cluster to its next member, after the report failed."""
+        rows = np.flatnonzero(self.ids[:self.size] == cluster_id)
+        if rows.size:
+            self.unreported[rows[0]] = True
+
+    def free_row(self, now: float) -> int:
+        expired = np.flatnonzero(self.last_seen[:self.size] < now - self.window_seconds)
+        if expired.size:
+            return int(expired[0])
+        if self.size == self.max_clusters:
+            return int(np.argmin(self.last_seen[:self.size]))
+        if self.size == len(self.counts):
+            self.grow(min(2 * self.size, self.max_clusters))
+        self.size += 1
+        return self.size - 1
+
+    def grow(self, capacity: int) -> None:
+        for name in ('centroids', 'sums', 'counts', 'last_seen', 'ids', 'unreported'):
+            current = getattr(self, name)
+            grown = np.zeros((capacity,) + current.shape[1:], dtype=current.dtype)
+            grown[:len(current)] = current
+            setattr(self, name, grown)
+
+
+class FeedbackClusterer:
+    """
+    Clusters feedback by the embedding of its comment and query, with one index per
+    application and usefulness rating, so a thumbs up never joins a thumbs down.
+    """
+
+    def __init__(self, embedder, threshold: float = 0.85, window_seconds: float = 86400,
+                 max_clusters: int = 10000, clock: Callable[[], float] = time.time):
+        self.embedder = embedder
+        self.threshold = threshold
+        self.window_seconds = window_seconds
+        self.max_clusters = max_clusters
+        self.clock = clock
+        self.indexes: Dict[Any, ClusterIndex] = {}
+        self._lock = threading.Lock()
+
+    def index_for(self, record: Dict[str, Any]) -> ClusterIndex:
+        key = (record.get('applicationId'), record.get('usefulness'))
+        if key not in self.indexes:
+            self.indexes[key] = ClusterIndex(self.embedder.dimensions, self.threshold, self.window_seconds,
+                                             max_clusters=self.max_clusters, clock=self.clock)
+        return self.indexes[key]
+
+    def assign(self, record: Dict[str, Any]) -> Assignment:
+        # the embedding call runs outside the lock, only the index update is serialized
+        vector = self.embedder.embed([feedback_text(record)])[0]
+        with self._lock:
+            assignment = self.index_for(record).assign(vector)
+        metrics.emit({
+            'ClustersCreated': (int(assignment.is_new), metrics.COUNT),
+            'ClusterJoins': (int(not assignment.is_new), metrics.COUNT),
+        }, properties={'clusterSize': assignment.size, 'clusterSimilarity': round(assignment.similarity, 4)})
+        return assignment
+
+    def release(self, record: Dict[str, Any], assignment: Assignment) -> None:
+        with self._lock:
+            self.index_for(record).release(assignment.cluster_id)
+
+    def assign_all(self, records: List[Dict[str, Any]]) -> List[Assignment]:
+        """Clusters a batch, e.g. the digest window, with one embedding pass."""
+        vectors = self.embedder.embed([feedback_text(record) for record in records]) if records else []
+        with self._lock:
+            return [self.index_for(record).assign(vector) for record, vector in zip(records, vectors)]
+
+
+def embedder_from_environment():
+    """CLUSTER_EMBEDDER "bedrock" (EMBEDDING_MODELID) or the local "hashing" embedder."""
+    dimensions = int(os.environ.get('EMBEDDING_DIMENSIONS', '256'))
+    if os.environ.get('CLUSTER_EMBEDDER', 'bedrock') == 'hashing':
+        return HashingEmbedder(dimensions)
+    return BedrockEmbedder(os.environ.get('EMBEDDING_MODELID', 'amazon.titan-embed-text-v2:0'), dimensions)
+
+
+def clusterer_from_environment(embedder=None) -> FeedbackClusterer:
+    return FeedbackClusterer(
+        embedder or embedder_from_environment(),
+        threshold=float(os.environ.get('CLUSTER_SIMILARITY_THRESHOLD', '0.85')),
+        window_seconds=float(os.environ.get('CLUSTER_WINDOW_SECONDS', '86400')),
+        max_clusters=int(os.environ.get('CLUSTER_MAX_CLUSTERS', '10000')))
@@ -0,0 +1,242 @@
+import argparse
+import io
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from feedback_sink import is_feedback_object, read_records
+from partitioning import day_prefix, list_applications, parse_submitted_at
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Columnar layout of a compacted feedback day. sourceAttribution is flattened into
+# parallel list columns so Athena can read titles or urls without parsing JSON.
+FEEDBACK_SCHEMA = pa.schema([
+    ('messageid', pa.string()),
+    ('applicationid', pa.string()),
+    ('userid', pa.string()),
+    ('usefulness', pa.string()),
+    ('usefulness_comment', pa.string()),
+    ('query', pa.string()),
+    ('message', pa.string()),
+    ('submittedat', pa.string()),
+    ('submitted_at', pa.timestamp('ms', tz='UTC')),
+    ('source_attribution_count', pa.int32()),
+    ('source_attribution_titles', pa.list_(pa.string())),
+    ('source_attribution_snippets', pa.list_(pa.string())),
+    ('source_attribution_urls', pa.list_(pa.string())),
+    ('source_attribution_citation_numbers', pa.list_(pa.int32())),
+])
+
+PARQUET_PART_NAME = 'part-{:05d}.parquet'
+
+# Written after the parts of a compacted day, and removed before they are rewritten,
+# so a day is only skipped when its previous compaction finished. Athena ignores
+# files whose names start with an underscore.
+MANIFEST_NAME = '_manifest.json'
+
+
+def flatten_record(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Maps one feedback JSON record written by the feedback processor to a FEEDBACK_SCHEMA row."""
+    attributions = record.get('sourceAttribution') or []
+    urls = record.get('source_attribution_urls') or [item.get('url') for item in attributions]
+
+    return {
+        'messageid': record.get('messageId'),
+        'applicationid': record.get('applicationId'),
+        'userid': record.get('userId'),
+        'usefulness': record.get('usefulness'),
+        'usefulness_comment': record.get('usefulness_comment'),
+        'query': record.get('query'),
+        'message': record.get('message'),
+        'submittedat': None if record.get('submittedAt') is None else str(record.get('submittedAt')),
+        'submitted_at': parse_submitted_at(record.get('submittedAt')),
+        'source_attribution_count': len(attributions),
+        'source_attribution_titles': [item.get('title') for item in attributions],
+        'source_attribution_snippets': [item.get('snippet') for item in attributions],
+        'source_attribution_urls': [url for url in urls if url],
+        'source_attribution_citation_numbers': [item.get('citationNumber') for item in attributions],
+    }
+
+
+def records_to_table(records: Iterable[Dict[str, Any]]) -> pa.Table:
+    """Builds a FEEDBACK_SCHEMA table, dropping duplicate messageIds (last write wins)."""
+    rows = {}
+    for record in records:
+        rows[record.get('messageId')] = flatten_record(record)
+    rows = sorted(rows.values(), key=lambda row: (row['submitted_at'] is None, row['submitted_at'] or 0, row['messageid'] or ''))
+    return pa.Table.from_pylist(rows, schema=FEEDBACK_SCHEMA)
+
+
+def table_to_parquet_parts(table: pa.Table, rows_per_file: int) -> List[bytes]:
+    """Serialises the table into one Parquet file per rows_per_file rows."""
+    parts = []
+    for offset in range(0, max(table.num_rows, 1), rows_per_file):
+        buffer = io.BytesIO()
+        pq.write_table(table.slice(offset, rows_per_file), buffer, compression='snappy')
+        parts.append(buffer.getvalue())
+    return parts
+
+
+def compact_s3_day(s3, bucket: str, source_root: str, target_root: str, application_id: str, day: datetime,
+                   rows_per_file: int = 500000, force: bool = False) -> Dict[str, Any]:
+    """
+    Compacts the hour partitions of one application's day of feedback JSON objects
+    into a Parquet day partition; hourly Parquet files would be too small to pay off.
+
+    Output part names are deterministic and the source objects are left in place,
+    so the job can be re-run safely. A partition is skipped when the source object
+    count and latest modification time recorded in its manifest are unchanged.
+    The JSON objects stay the input of the JSON table, the digest, the rollup
+    rebuild and later recompactions; only the Parquet table reads the compacted day.
+
+    :return: Stats for the partition (rows, source objects/bytes, parquet files/bytes).
+    """
+    from botocore.exceptions import ClientError
+
+    source_prefix = day_prefix(source_root, application_id, day)
+    target_prefix = day_prefix(target_root, application_id, day)
+
+    objects = []
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=source_prefix):
+        objects.extend(item for item in page.get('Contents', []) if is_feedback_object(item['Key']))
+
+    stats = {'partition': source_prefix, 'source_objects': len(objects), 'source_bytes': sum(item['Size'] for item in objects),
+             'rows': 0, 'parquet_files': 0, 'parquet_bytes': 0, 'skipped': False}
+    if not objects:
+        return stats
+
+    fingerprint = {'source-objects': str(len(objects)),
+                   'source-last-modified': max(item['LastModified'] for item in objects).isoformat()}
+    manifest_key = target_prefix + MANIFEST_NAME
+    if not force:
+        try:
+            manifest = json.loads(s3.get_object(Bucket=bucket, Key=manifest_key)['Body'].read())
+            if manifest.get('fingerprint') == fingerprint:
+                stats['skipped'] = True
+                return stats
+        except ClientError:
+            pass
+    # an interrupted run leaves no manifest, so the next one compacts the day again
+    s3.delete_object(Bucket=bucket, Key=manifest_key)
+
+    records = [record for item in objects
+               for record in read_records(item['Key'], s3.get_object(Bucket=bucket, Key=item['Key'])['Body'].read())]
+    table = records_to_table(records)
+    parts = table_to_parquet_parts(table, rows_per_file)
+
+    written = set()
+    for number, body in enumerate(parts):
+        key = target_prefix + PARQUET_PART_NAME.format(number)
+        s3.put_object(Bucket=bucket, Key=key, Body=body)
+        written.add(key)
+
+    # remove parts left over from an earlier run that produced more files
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=target_prefix):
+        for item in page.get('Contents', []):
+            if item['Key'] not in written:
+                s3.delete_object(Bucket=bucket, Key=item['Key'])
+
+    s3.put_object(Bucket=bucket, Key=manifest_key, Body=json.dumps({
+        'fingerprint': fingerprint, 'parts': sorted(key[len(target_prefix):] for key in written), 'rows': table.num_rows}))
+
+    stats.update(rows=table.num_rows, parquet_files=len(parts), parquet_bytes=sum(len(body) for body in parts))
+    return stats
+
+
+def compact_directory(source_dir: str, output_dir: str, rows_per_file: int = 500000) -> List[Dict[str, Any]]:
+    """
+    Local equivalent of the scheduled job: compacts the hour= folders of feedback
+    JSON files under each application_id=/year=/month=/day= folder of source_dir into
+    Parquet day partitions in the same layout under output_dir.
+    """
+    days: Dict[str, List[str]] = {}
+    for folder, _, files in sorted(os.walk(source_dir)):
+        day_folder = os.path.dirname(folder) if os.path.basename(folder).startswith('hour=') else folder
+        days.setdefault(os.path.relpath(day_folder, source_dir), []).extend(
+            os.path.join(folder, name) for name in sorted(files) if is_feedback_object(name))
+
+    results = []
+    for partition, json_files in days.items():
+        if not json_files:
+            continue
+
+        started = time.perf_counter()
+        records = []
+        for path in json_files:
+            with open(path, 'rb') as f:
+                records.extend(read_records(path, f.read()))
+        table = records_to_table(records)
+        parts = table_to_parquet_parts(table, rows_per_file)
+
+        target = os.path.join(output_dir, partition)
+        os.makedirs(target, exist_ok=True)
+        for name in os.listdir(target):
+            if name.endswith('.parquet'):
+                os.remove(os.path.join(target, name))
+        for number, body in enumerate(parts):
+            with open(os.path.join(target, PARQUET_PART_NAME.format(number)), 'wb') as f:
+                f.write(body)
+
+        results.append({
+            'partition': partition,
+            'rows': table.num_rows,
+            'source_objects': len(json_files),
+            'source_bytes': sum(os.path.getsize(path) for path in json_files),
+            'parquet_files': len(parts),
+            'parquet_bytes': sum(len(body) for body in parts),
+            'seconds': time.perf_counter() - started,
+        })
+    return results
+
+
+def lambda_handler(event, context):
+    """
+    Scheduled entry point: compacts the finished (before today, UTC) days of every
+    application within COMPACTION_LOOKBACK_DAYS, so late-arriving feedback is picked
+    up on the next run. An explicit {"days": ["YYYY-MM-DD", ...], "force": true}
+    event recompacts specific days.
+    """
+    # imported here, like clients.py does, so the local compaction needs no boto3
+    import boto3
+
+    s3 = boto3.client('s3')
+    bucket = os.environ['S3_DATA_BUCKET']
+    glue_database_name = os.environ['GLUE_DATABASE_NAME']
+    lookback_days = int(os.environ.get('COMPACTION_LOOKBACK_DAYS', '3'))
+    rows_per_file = int(os.environ.get('COMPACTION_ROWS_PER_FILE', '500000'))
+
+    if event.get('days'):
+        days = [datetime.strptime(day, '%Y-%m-%d') for day in event['days']]
+    else:
+        today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        days = [today - timedelta(days=offset) for offset in range(lookback_days, 0, -1)]
+
+    source_root, target_root = f'{glue_database_name}/feedback', f'{glue_database_name}/feedback_parquet'
+    results = []
+    for application_id in list_applications(s3, bucket, source_root):
+        for day in days:
+            stats = compact_s3_day(s3, bucket, source_root, target_root, application_id, day,
+                                   rows_per_file=rows_per_file, force=bool(event.get('force')))
+            logger.info(json.dumps(stats))
+            results.append(stats)
+
+    return {'statusCode': 200, 'body': json.dumps(results)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compact local feedback JSON partitions into Parquet.')
+    parser.add_argument('source_dir', help='folder holding application_id=/year=/month=/day=/hour= partitions of feedback JSON files')
+    parser.add_argument('output_dir', help='folder to write the Parquet partitions to')
+    parser.add_argument('--rows-per-file', type=int, default=500000)
+    args = parser.parse_args()
+
+    for result in compact_directory(args.source_dir, args.output_dir, args.rows_per_file):
+        print(json.dumps(result))
@@ -0,0 +1,51 @@
+from typing import Any, Dict, Iterable, List, Optional
+
+
+class ConversationIndex:
+    """
+    Index over a window of Q Business conversation messages, built in one pass.
+
+    Maps each messageId to its position in ListMessages order so the rated message
+    and the turn listed before it (the AI response with its source attribution)
+    can be looked up in O(1) instead of rescanning the message list.
+    """
+
+    def __init__(self, messages: Optional[Iterable[Dict[str, Any]]] = None):
+        self.messages: List[Dict[str, Any]] = []
+        self._positions: Dict[str, int] = {}
+        if messages:
+            self.extend(messages)
+
+    def extend(self, messages: Iterable[Dict[str, Any]]) -> None:
+        """Appends a page of messages, keeping the first position seen for each messageId."""
+        for message in messages:
+            self._positions.setdefault(str(message.get('messageId')), len(self.messages))
+            self.messages.append(message)
+
+    def __contains__(self, message_id) -> bool:
+        return str(message_id) in self._positions
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def position(self, message_id) -> Optional[int]:
+        return self._positions.get(str(message_id))
+
+    def get(self, message_id) -> Optional[Dict[str, Any]]:
+        position = self.position(message_id)
+        return None if position is None else self.messages[position]
+
+    def previous(self, message_id) -> Optional[Dict[str, Any]]:
+        """Returns the message listed before message_id, or None if it is first or unknown."""
+        position = self.position(message_id)
+        if not position:
+            return None
+        return self.messages[position - 1]
+
+    def previous_body(self, message_id) -> Optional[str]:
+        previous = self.previous(message_id)
+        return None if previous is None else previous.get('body')
+
+    def previous_source_attribution(self, message_id) -> Optional[List[Dict[str, Any]]]:
+        previous = self.previous(message_id)
+        return None if previous is None else previous.get('sourceAttribution')
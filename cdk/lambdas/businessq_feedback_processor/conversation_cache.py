@@ -0,0 +1,79 @@
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from conversation import ConversationIndex
+
+# the messages read from the head of a conversation's listing, and the ListMessages
+# token that continues after them (None once the whole conversation was read)
+CachedConversation = namedtuple('CachedConversation', ['index', 'next_token', 'expires_at'])
+
+
+def conversation_key(application_id: str, conversation_id: str, user_id: str) -> Tuple[str, str, str]:
+    return application_id, conversation_id, user_id
+
+
+def cached_overlap(page: List[Dict[str, Any]], cached: Optional[CachedConversation]) -> Optional[int]:
+    """Position in a freshly read page of the first message the cached window holds, or None."""
+    if cached is None:
+        return None
+    return next((position for position, message in enumerate(page)
+                 if message.get('messageId') in cached.index), None)
+
+
+def splice(messages: List[Dict[str, Any]], overlap: int, cached: CachedConversation) -> ConversationIndex:
+    """
+    The messages read from the head of the listing, up to the first one the cached
+    window holds (at position overlap), followed by the window from that message on.
+    """
+    index = ConversationIndex(messages[:overlap])
+    index.extend(cached.index.messages[cached.index.position(messages[overlap]['messageId']):])
+    return index
+
+
+class ConversationCache:
+    """
+    Per-container LRU of conversation message windows, keyed by (applicationId,
+    conversationId, userId), so a user rating several answers of one conversation
+    within ttl_seconds costs one ListMessages call rather than one per rating.
+    Entries are replaced, not modified, so a reader never sees a window change.
+    """
+
+    def __init__(self, max_entries: int = 64, ttl_seconds: float = 60, clock: Callable[[], float] = time.time):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key) -> Optional[CachedConversation]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at <= self.clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, index: ConversationIndex, next_token: Optional[str]) -> None:
+        with self._lock:
+            self._entries[key] = CachedConversation(index, next_token, self.clock() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+def conversation_cache_from_environment() -> Optional[ConversationCache]:
+    """
+    Builds the cache selected by CONVERSATION_CACHE: "memory" (default) or "off",
+    holding CONVERSATION_CACHE_MAX_ENTRIES (64) conversations for
+    CONVERSATION_CACHE_TTL_SECONDS (60).
+    """
+    if os.environ.get('CONVERSATION_CACHE', 'memory') == 'off':
+        return None
+    return ConversationCache(int(os.environ.get('CONVERSATION_CACHE_MAX_ENTRIES', '64')),
+                             float(os.environ.get('CONVERSATION_CACHE_TTL_SECONDS', '60')))
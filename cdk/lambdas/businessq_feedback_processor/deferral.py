@@ -0,0 +1,138 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import metrics
+from clients import get_client
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# SQS caps the delay of a message at 15 minutes
+MAX_DELAY_SECONDS = 900
+
+# how long one deferred task may wait for the rate limiter, so a whole batch fits the
+# Lambda timeout, and the time kept back for the calls themselves and the response
+TASK_MAX_WAIT_SECONDS = float(os.environ.get('DEFERRED_TASK_MAX_WAIT_SECONDS', '5'))
+TASK_RESERVE_SECONDS = 5
+
+
+class SQSDeferralQueue:
+    """Defers tasks to an SQS queue drained by the deferred task Lambda (deferral.lambda_handler)."""
+
+    def __init__(self, queue_url: str, delay_seconds: int = 60, client=None):
+        self.queue_url = queue_url
+        self.delay_seconds = min(delay_seconds, MAX_DELAY_SECONDS)
+        self._client = client
+
+    @property
+    def client(self):
+        return self._client or get_client('sqs')
+
+    def put(self, task: Dict[str, Any]) -> None:
+        self.client.send_message(QueueUrl=self.queue_url, MessageBody=json.dumps(task),
+                                 DelaySeconds=self.delay_seconds)
+
+
+class MemoryDeferralQueue:
+    """Local stand-in for the SQS queue; due() hands back the tasks whose delay has passed."""
+
+    def __init__(self, delay_seconds: int = 60, clock: Callable[[], float] = time.time):
+        self.delay_seconds = delay_seconds
+        self.clock = clock
+        self.tasks: List = []
+        self._lock = threading.Lock()
+
+    def put(self, task: Dict[str, Any]) -> None:
+        with self._lock:
+            self.tasks.append((self.clock() + self.delay_seconds, task))
+
+    def due(self) -> List[Dict[str, Any]]:
+        now = self.clock()
+        with self._lock:
+            ready = [task for due_at, task in self.tasks if due_at <= now]
+            self.tasks = [(due_at, task) for due_at, task in self.tasks if due_at > now]
+        return ready
+
+
+class Deferral:
+    """Queues non-urgent work, such as a report email, that was throttled now but must not be dropped."""
+
+    def __init__(self, queue):
+        self.queue = queue
+
+    def defer_email(self, body: str, subject: Optional[str] = None, html: Optional[str] = None) -> str:
+        task = {'kind': 'email', 'body': body}
+        if subject:
+            task['subject'] = subject
+        if html:
+            task['html'] = html
+        self.queue.put(task)
+        metrics.emit({'DeferredTasks': (1, metrics.COUNT)}, properties={'kind': 'email'})
+        return 'Email deferred'
+
+
+def run_task(task: Dict[str, Any], max_wait_seconds: Optional[float] = None) -> Any:
+    from reporting import send_email
+
+    if task['kind'] == 'email':
+        return send_email(task['body'], html=task.get('html'), max_wait_seconds=max_wait_seconds,
+                          **({'subject': task['subject']} if 'subject' in task else {}))
+    raise ValueError(f"Unknown deferred task kind {task['kind']}")
+
+
+def deferral_from_environment() -> Optional[Deferral]:
+    """
+    Builds the deferral selected by DEFERRAL: "sqs" for DEFERRAL_QUEUE_URL, "memory"
+    for a local in-process queue, or "off" (default) to fail throttled work instead.
+    DEFERRAL_DELAY_SECONDS (60) is how long a task waits before its next attempt.
+    """
+    mode = os.environ.get('DEFERRAL', 'off')
+    if mode == 'off':
+        return None
+
+    delay_seconds = int(os.environ.get('DEFERRAL_DELAY_SECONDS', '60'))
+    if mode == 'sqs':
+        return Deferral(SQSDeferralQueue(os.environ.get('DEFERRAL_QUEUE_URL'), delay_seconds))
+    return Deferral(MemoryDeferralQueue(delay_seconds))
+
+
+def lambda_handler(event, context):
+    """
+    Entry point of the deferred task Lambda, fed by the deferral queue. Tasks still
+    throttled are reported in batchItemFailures, so SQS retries them after the
+    visibility timeout and parks them in the dead-letter queue once out of receives.
+
+    Each task waits at most TASK_MAX_WAIT_SECONDS for the rate limiter. Tasks the
+    remaining invocation time could not cover are not started and are reported in
+    batchItemFailures as well, so a timeout never resends the emails already sent.
+    """
+    records = event.get('Records', [])
+    batch_item_failures = []
+    postponed = 0
+
+    for record in records:
+        remaining_ms = context.get_remaining_time_in_millis() if context else None
+        if remaining_ms is not None and remaining_ms < (TASK_MAX_WAIT_SECONDS + TASK_RESERVE_SECONDS) * 1000:
+            postponed += 1
+            batch_item_failures.append({'itemIdentifier': record['messageId']})
+            continue
+        try:
+            run_task(json.loads(record['body']), max_wait_seconds=TASK_MAX_WAIT_SECONDS)
+        except Exception:
+            logger.exception(f"Deferred task in SQS message {record['messageId']} failed")
+            batch_item_failures.append({'itemIdentifier': record['messageId']})
+
+    if postponed:
+        logger.info(f'{postponed} deferred tasks left for the next invocation')
+
+    metrics.emit({
+        'DeferredTasksRun': (len(records) - len(batch_item_failures), metrics.COUNT),
+        'DeferredTaskFailures': (len(batch_item_failures) - postponed, metrics.COUNT),
+        'DeferredTasksPostponed': (postponed, metrics.COUNT),
+    })
+
+    return {'batchItemFailures': batch_item_failures}
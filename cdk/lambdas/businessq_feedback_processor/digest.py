@@ -0,0 +1,247 @@
+import argparse
+import json
+import logging
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List
+
+from feedback_sink import is_feedback_object, read_records
+from partitioning import list_applications, parse_submitted_at, window_prefixes
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+DIGEST_PROMPT = '''
+
+You are an intelligent LLM prompt engineer. The context is a JSON list of groups of user feedback on a RAG chatbot. Each group has an id, the key it was grouped by, counts and sample feedback items.
+
+For each group, write its id, one sentence on what the users found lacking, and the key suggestion for improving the source content.
+
+Then, in a Recommendations section, suggest 2-3 specific examples of content that can be added to the content sources to address the groups with the most NOT_USEFUL feedback.
+
+Do NOT use wiki syntax in the output.
+
+'''
+
+# characters of the AI answer kept per feedback item in the digest prompt
+MESSAGE_EXCERPT_CHARS = 300
+
+# groups listed in the digest email, in priority order
+MAX_LISTED_GROUPS = 50
+
+
+def load_records_from_s3(s3, bucket: str, glue_database_name: str, start: datetime, end: datetime) -> List[Dict[str, Any]]:
+    """Reads the feedback records submitted in [start, end), from the matching partitions of every application."""
+    root = f'{glue_database_name}/feedback'
+    records = []
+    for application_id in list_applications(s3, bucket, root):
+        for prefix in window_prefixes(root, application_id, start, end):
+            for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+                for item in page.get('Contents', []):
+                    if is_feedback_object(item['Key']):
+                        records.extend(read_records(item['Key'], s3.get_object(Bucket=bucket, Key=item['Key'])['Body'].read()))
+    # windows that do not start on the hour include records from outside them
+    return [record for record in records
+            if start <= (parse_submitted_at(record.get('submittedAt')) or start) < end]
+
+
+def load_records_from_directory(path: str) -> List[Dict[str, Any]]:
+    """Reads every feedback record JSON (or gzipped JSON lines) file below path."""
+    records = []
+    for folder, _, files in sorted(os.walk(path)):
+        for name in sorted(files):
+            if is_feedback_object(name):
+                with open(os.path.join(folder, name), 'rb') as f:
+                    records.extend(read_records(name, f.read()))
+    return records
+
+
+def normalize_text(text) -> str:
+    return re.sub(r'[^a-z0-9]+', ' ', str(text or '').lower()).strip()
+
+
+def group_key(record: Dict[str, Any], group_by: str) -> str:
+    if group_by == 'source_url':
+        urls = record.get('source_attribution_urls') or []
+        return urls[0] if urls else '(no source)'
+    if group_by == 'query':
+        return normalize_text(record.get('query')) or '(no query)'
+    # usefulness reason: the rating plus the normalized comment
+    return f"{record.get('usefulness')}: {normalize_text(record.get('usefulness_comment')) or '(no comment)'}"
+
+
+def cluster_keys(records: List[Dict[str, Any]]) -> List[str]:
+    """
+    Group keys from semantic clusters of the comment and query, so reworded
+    near-duplicates share a group. A cluster is labelled by its first record's reason.
+    """
+    from clustering import clusterer_from_environment
+
+    labels = {}
+    keys = []
+    for record, assignment in zip(records, clusterer_from_environment().assign_all(records)):
+        cluster = (record.get('applicationId'), record.get('usefulness'), assignment.cluster_id)
+        keys.append(labels.setdefault(cluster, f"{group_key(record, 'reason')} (cluster {len(labels) + 1})"))
+    return keys
+
+
+def group_records(records: List[Dict[str, Any]], group_by: str) -> List[Dict[str, Any]]:
+    """Groups feedback records by source URL, query, usefulness reason or cluster, most NOT_USEFUL first."""
+    groups = {}
+    keys = cluster_keys(records) if group_by == 'cluster' else [group_key(record, group_by) for record in records]
+    for record, key in zip(records, keys):
+        group = groups.setdefault(key, {'key': key, 'count': 0, 'not_useful': 0, 'items': []})
+        group['count'] += 1
+        group['not_useful'] += record.get('usefulness') == 'NOT_USEFUL'
+        group['items'].append(record)
+
+    ordered = sorted(groups.values(), key=lambda group: (-group['not_useful'], -group['count'], group['key']))
+    for number, group in enumerate(ordered, start=1):
+        group['id'] = number
+    return ordered
+
+
+def prompt_item(record: Dict[str, Any]) -> Dict[str, Any]:
+    """The fields of a feedback record the model needs to summarize it."""
+    return {
+        'usefulness': record.get('usefulness'),
+        'comment': record.get('usefulness_comment'),
+        'query': record.get('query'),
+        'message': (record.get('message') or '')[:MESSAGE_EXCERPT_CHARS],
+        'urls': record.get('source_attribution_urls') or [],
+    }
+
+
+def batch_groups(groups: List[Dict[str, Any]], items_per_call: int, max_model_calls: int) -> List[List[Dict[str, Any]]]:
+    """
+    Packs groups into at most max_model_calls prompt batches of at most items_per_call
+    sample items each. Groups are taken in priority order; the ones that do not fit
+    are left out of the model calls and only listed in the digest.
+    """
+    batches, current, current_items = [], [], 0
+    for group in groups:
+        size = min(len(group['items']), items_per_call)
+        if current and current_items + size > items_per_call:
+            batches.append(current)
+            current, current_items = [], 0
+            if len(batches) == max_model_calls:
+                break
+        current.append(group)
+        current_items += size
+    else:
+        if current:
+            batches.append(current)
+    return batches[:max_model_calls]
+
+
+def render_digest(window: str, group_by: str, records: List[Dict[str, Any]], groups: List[Dict[str, Any]],
+                  summaries: List[str]) -> str:
+    not_useful = sum(group['not_useful'] for group in groups)
+    lines = [
+        f'Business Q Feedback Digest: {window}',
+        '',
+        f'{len(records)} feedback records ({len(records) - not_useful} useful, {not_useful} not useful) '
+        f'in {len(groups)} groups by {group_by}.',
+        '',
+    ]
+    for summary in summaries:
+        lines += [summary.strip(), '']
+
+    lines.append('Groups:')
+    for group in groups[:MAX_LISTED_GROUPS]:
+        lines.append(f"{group['id']}. {group['key']} - {group['count']} feedback, {group['not_useful']} not useful")
+        for record in group['items'][:5]:
+            comment = record.get('usefulness_comment')
+            lines.append(f"   - {record.get('query')}" + (f' ({comment})' if comment else ''))
+    if len(groups) > MAX_LISTED_GROUPS:
+        lines.append(f'... and {len(groups) - MAX_LISTED_GROUPS} more groups')
+    return '\n'.join(lines)
+
+
+def run_digest(records: List[Dict[str, Any]], invoke: Callable[[str, str], str], deliver: Callable[[str], Any],
+               window: str, group_by: str = 'reason', items_per_call: int = 25, max_model_calls: int = 5) -> Dict[str, Any]:
+    """
+    Groups the records, makes at most max_model_calls batched model calls and delivers
+    one consolidated report.
+
+    :param invoke: Called with (prompt_context, prompt), returns the model completion.
+    :param deliver: Called with the rendered digest text, e.g. send_email.
+    :return: Digest stats.
+    """
+    stats = {'window': window, 'records': len(records), 'groups': 0, 'model_calls': 0, 'groups_summarized': 0}
+    if not records:
+        logger.info(f'No feedback records for {window}, no digest sent')
+        return stats
+
+    groups = group_records(records, group_by)
+    summaries = []
+    for batch in batch_groups(groups, items_per_call, max_model_calls):
+        context = json.dumps([{
+            'id': group['id'],
+            'key': group['key'],
+            'count': group['count'],
+            'not_useful': group['not_useful'],
+            'items': [prompt_item(record) for record in group['items'][:items_per_call]],
+        } for group in batch])
+        summaries.append(invoke(context, DIGEST_PROMPT))
+        stats['model_calls'] += 1
+        stats['groups_summarized'] += len(batch)
+
+    deliver(render_digest(window, group_by, records, groups, summaries))
+    stats['groups'] = len(groups)
+    return stats
+
+
+def digest_window(event: Dict[str, Any], now: datetime, period: str):
+    """[start, end) of the previous full hour or UTC day, unless the event names one."""
+    if event.get('start') and event.get('end'):
+        return (datetime.fromisoformat(event['start']).astimezone(timezone.utc),
+                datetime.fromisoformat(event['end']).astimezone(timezone.utc))
+    if period == 'hourly':
+        end = now.replace(minute=0, second=0, microsecond=0)
+        return end - timedelta(hours=1), end
+    end = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    return end - timedelta(days=1), end
+
+
+def lambda_handler(event, context):
+    """Scheduled entry point that emails the digest for the previous hour or day."""
+    from clients import get_client
+    from reporting import route_claude, send_email
+
+    period = os.environ.get('DIGEST_PERIOD', 'daily')
+    start, end = digest_window(event or {}, datetime.now(timezone.utc), period)
+    records = load_records_from_s3(get_client('s3'), os.environ['S3_DATA_BUCKET'],
+                                   os.environ['GLUE_DATABASE_NAME'], start, end)
+
+    stats = run_digest(
+        records,
+        invoke=route_claude,
+        deliver=lambda report: send_email(report, subject='Business Q Feedback Digest'),
+        window=f'{start.isoformat()} - {end.isoformat()}',
+        group_by=os.environ.get('DIGEST_GROUP_BY', 'reason'),
+        items_per_call=int(os.environ.get('DIGEST_ITEMS_PER_CALL', '25')),
+        max_model_calls=int(os.environ.get('DIGEST_MAX_MODEL_CALLS', '5')),
+    )
+    logger.info(json.dumps(stats))
+
+    return {'statusCode': 200, 'body': json.dumps(stats)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build a feedback digest from a local folder of feedback records.')
+    parser.add_argument('records_dir')
+    parser.add_argument('--group-by', choices=['reason', 'source_url', 'query', 'cluster'], default='reason')
+    parser.add_argument('--items-per-call', type=int, default=25)
+    parser.add_argument('--max-model-calls', type=int, default=5)
+    args = parser.parse_args()
+
+    def stub_model(prompt_context, prompt):
+        ids = [group['id'] for group in json.loads(prompt_context)]
+        return f'[stub model summary for groups {ids}]'
+
+    result = run_digest(load_records_from_directory(args.records_dir), invoke=stub_model, deliver=print,
+                        window=args.records_dir, group_by=args.group_by,
+                        items_per_call=args.items_per_call, max_model_calls=args.max_model_calls)
+    print(json.dumps(result))
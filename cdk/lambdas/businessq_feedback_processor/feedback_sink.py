@@ -0,0 +1,290 @@
+import abc
+import gzip
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import metrics
+from clients import get_client
+from partitioning import feedback_key, hour_prefix, parse_submitted_at
+
+# Buffered sinks write newline-delimited JSON, gzipped, one object per partition hour:
+#   <glue_database>/feedback/application_id=<id>/year=YYYY/month=MM/day=DD/hour=HH/feedback-<time>-<id>.json.gz
+# Athena's JSON SerDe and the Glue crawler read the .gz objects next to the .json ones.
+BUFFERED_OBJECT_SUFFIX = '.json.gz'
+
+# source_attribution_urls only repeats the url of each sourceAttribution entry, so
+# sink records leave it out and readers restore it with restore_record
+DERIVED_FIELDS = ('source_attribution_urls',)
+
+# Firehose PutRecordBatch limits
+FIREHOSE_MAX_RECORDS = 500
+FIREHOSE_MAX_BYTES = 4 * 1024 * 1024
+
+
+class SinkFlushError(Exception):
+    """Raised by flush when some buffered records could not be written; records holds them."""
+
+    def __init__(self, message: str, records: List[Dict[str, Any]], written: List[Dict[str, Any]]):
+        super().__init__(message)
+        self.records = records
+        self.written = written
+
+
+def feedback_root() -> str:
+    return f"{os.environ['GLUE_DATABASE_NAME']}/feedback"
+
+
+def submitted_time(record: Dict[str, Any]) -> datetime:
+    """The submission time that partitions a record, the processing time when unparseable, as in feedback_key."""
+    return parse_submitted_at(record.get('submittedAt')) or datetime.now(timezone.utc)
+
+
+def sink_record(record: Dict[str, Any], submitted: datetime) -> Dict[str, Any]:
+    """
+    The record as a buffered sink writes it: without the derived fields, with its
+    submitted_hour in UTC ("2024-02-02T14"), which the Firehose partition keys are read from.
+    """
+    normalized = {field: value for field, value in record.items() if field not in DERIVED_FIELDS}
+    normalized['submitted_hour'] = f'{submitted:%Y-%m-%dT%H}'
+    return normalized
+
+
+def restore_record(record: Dict[str, Any]) -> Dict[str, Any]:
+    """The feedback record as the handler built it, from a record read back from any sink."""
+    record.pop('submitted_hour', None)
+    if 'source_attribution_urls' not in record:
+        record['source_attribution_urls'] = [attribution['url'] for attribution in record.get('sourceAttribution') or []
+                                             if isinstance(attribution, dict) and attribution.get('url')]
+    return record
+
+
+def read_records(name: str, body: bytes) -> List[Dict[str, Any]]:
+    """The feedback records of an object or file: one JSON document, or gzipped JSON lines."""
+    if name.endswith('.gz'):
+        return [restore_record(json.loads(line)) for line in gzip.decompress(body).splitlines() if line.strip()]
+    return [restore_record(json.loads(body))]
+
+
+def is_feedback_object(name: str) -> bool:
+    return name.endswith('.json') or name.endswith('.gz')
+
+
+class S3ObjectWriter:
+    """Writes objects to S3_DATA_BUCKET, read per write like the handler's other required settings."""
+
+    def write(self, key: str, body) -> None:
+        get_client('s3').put_object(Body=body, Bucket=os.environ['S3_DATA_BUCKET'], Key=key)
+
+
+class FileObjectWriter:
+    """Local stand-in for S3: each object key becomes a file below directory."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def write(self, key: str, body) -> None:
+        path = os.path.join(self.directory, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(body.encode('utf-8') if isinstance(body, str) else body)
+
+
+class ObjectSink:
+    """One uncompressed JSON object per feedback record, written as it is put."""
+
+    buffered = False
+
+    def __init__(self, writer):
+        self.writer = writer
+
+    def put(self, record: Dict[str, Any]) -> None:
+        self.writer.write(feedback_key(os.environ['GLUE_DATABASE_NAME'], record), json.dumps(record))
+
+    def discard(self, record: Dict[str, Any]) -> None:
+        """Nothing to take back: a redelivery rewrites the same object."""
+
+    def flush(self, requeue: bool = True) -> List[Dict[str, Any]]:
+        return []
+
+
+class RecordBuffer(abc.ABC):
+    """
+    Base of the buffering sinks: holds the records put since the last flush, shared
+    by the threads of an invocation, and writes them with write_records on flush.
+    """
+
+    buffered = True
+    mode = None
+
+    def __init__(self):
+        self._records: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def put(self, record: Dict[str, Any]) -> None:
+        with self._lock:
+            self._records.append(record)
+
+    def discard(self, record: Dict[str, Any]) -> None:
+        """
+        Drops a record put since the last flush, e.g. when a later stage of its event
+        failed and the event will be redelivered, which puts the record again.
+        """
+        with self._lock:
+            self._records = [buffered for buffered in self._records if buffered is not record]
+
+    def flush(self, requeue: bool = True) -> List[Dict[str, Any]]:
+        """
+        Writes the buffered records.
+
+        :param requeue: Keep records that could not be written for the next flush,
+                        rather than dropping them for the caller to redeliver.
+        :return: The records written.
+        :raises SinkFlushError: With the records that could not be written, whatever the cause.
+        """
+        with self._lock:
+            records, self._records = self._records, []
+        if not records:
+            return []
+
+        started = time.perf_counter()
+        try:
+            written, failed, requests, sink_bytes, error = self.write_records(records)
+        except Exception as e:
+            written, failed, requests, sink_bytes, error = [], records, 0, 0, e
+
+        metrics.emit({
+            'SinkRecords': (len(written), metrics.COUNT),
+            'SinkFailedRecords': (len(failed), metrics.COUNT),
+            'SinkRequests': (requests, metrics.COUNT),
+            'SinkBytes': (sink_bytes, metrics.BYTES),
+            'SinkFlushMs': (round((time.perf_counter() - started) * 1000, 1), metrics.MILLISECONDS),
+        }, properties={'sink': self.mode})
+
+        if failed:
+            if requeue:
+                with self._lock:
+                    self._records[:0] = failed
+            raise SinkFlushError(f"{len(failed)} of {len(records)} feedback records not written: {error}",
+                                 failed, written)
+        return written
+
+    @abc.abstractmethod
+    def write_records(self, records: List[Dict[str, Any]]) -> Tuple[List, List, int, int, Optional[Exception]]:
+        """:return: The records written and failed, the requests made, the bytes written and the last error."""
+
+
+class BufferedSink(RecordBuffer):
+    """
+    Holds feedback records until flush, then writes one gzipped JSON lines object per
+    partition hour, so a batch of feedback costs a request per hour it spans rather
+    than one per record.
+    """
+
+    mode = 'buffered'
+
+    def __init__(self, writer):
+        super().__init__()
+        self.writer = writer
+
+    def write_records(self, records):
+        root = feedback_root()
+        partitions: Dict[str, List] = OrderedDict()
+        for record in records:
+            submitted = submitted_time(record)
+            partitions.setdefault(hour_prefix(root, record.get('applicationId'), submitted), []).append(
+                (record, sink_record(record, submitted)))
+
+        written, failed, compressed_bytes, error = [], [], 0, None
+        for prefix, entries in partitions.items():
+            body = gzip.compress(''.join(json.dumps(normalized) + '\n' for _, normalized in entries).encode('utf-8'))
+            key = f'{prefix}feedback-{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}-{uuid.uuid4().hex}{BUFFERED_OBJECT_SUFFIX}'
+            try:
+                self.writer.write(key, body)
+                written += [record for record, _ in entries]
+                compressed_bytes += len(body)
+            except Exception as e:
+                failed += [record for record, _ in entries]
+                error = e
+        return written, failed, len(partitions), compressed_bytes, error
+
+
+class FirehoseSink(RecordBuffer):
+    """
+    Holds feedback records until flush, then sends them to a Firehose delivery
+    stream with PutRecordBatch. The stream gzips them and partitions them by the
+    applicationId and submitted_hour of each JSON line. Records Firehose rejects
+    are resent once.
+    """
+
+    mode = 'firehose'
+
+    def __init__(self, stream_name: str, client=None):
+        super().__init__()
+        self.stream_name = stream_name
+        self._client = client
+
+    @property
+    def client(self):
+        return self._client or get_client('firehose')
+
+    def write_records(self, records):
+        lines = [(record, (json.dumps(sink_record(record, submitted_time(record))) + '\n').encode('utf-8'))
+                 for record in records]
+        written, failed, requests, sent_bytes, error = [], [], 0, 0, None
+        for batch in record_batches(lines):
+            for _ in range(2):
+                requests += 1
+                try:
+                    response = self.client.put_record_batch(DeliveryStreamName=self.stream_name,
+                                                            Records=[{'Data': data} for _, data in batch])
+                except Exception as e:
+                    error = e
+                    break
+                results = list(zip(batch, response.get('RequestResponses', [])))
+                accepted = [entry for entry, result in results if not result.get('ErrorCode')]
+                written += [record for record, _ in accepted]
+                sent_bytes += sum(len(data) for _, data in accepted)
+                rejected = [(entry, result) for entry, result in results if result.get('ErrorCode')]
+                batch = [entry for entry, _ in rejected]
+                if not batch:
+                    break
+                error = RuntimeError(f"Firehose rejected {len(batch)} records: {rejected[0][1].get('ErrorMessage')}")
+            failed += [record for record, _ in batch]
+        return written, failed, requests, sent_bytes, error
+
+
+def record_batches(entries):
+    """Splits (record, data) entries into PutRecordBatch calls within its record and size limits."""
+    batch, size = [], 0
+    for entry in entries:
+        if batch and (len(batch) == FIREHOSE_MAX_RECORDS or size + len(entry[1]) > FIREHOSE_MAX_BYTES):
+            yield batch
+            batch, size = [], 0
+        batch.append(entry)
+        size += len(entry[1])
+    if batch:
+        yield batch
+
+
+def sink_from_environment():
+    """
+    Builds the sink selected by FEEDBACK_SINK: "s3" (default) for an object per
+    record, "buffered" for gzipped JSON lines objects per flush, or "firehose" for
+    the FEEDBACK_DELIVERY_STREAM delivery stream. With FEEDBACK_SINK_DIRECTORY set,
+    objects are written below that local folder instead of S3_DATA_BUCKET.
+    """
+    mode = os.environ.get('FEEDBACK_SINK', 's3')
+    if mode == 'firehose':
+        return FirehoseSink(os.environ.get('FEEDBACK_DELIVERY_STREAM'))
+
+    directory = os.environ.get('FEEDBACK_SINK_DIRECTORY')
+    writer = FileObjectWriter(directory) if directory else S3ObjectWriter()
+    if mode == 'buffered':
+        return BufferedSink(writer)
+    return ObjectSink(writer)
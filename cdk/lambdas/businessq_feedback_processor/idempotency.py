@@ -0,0 +1,150 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Optional
+
+from botocore.exceptions import ClientError
+
+import metrics
+from clients import get_client
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+IN_PROGRESS = 'IN_PROGRESS'
+COMPLETED = 'COMPLETED'
+
+
+def idempotency_key(application_id: str, conversation_id: str, message_id: str, submitted_at) -> str:
+    """Identifies one PutFeedback submission; rating the same message again is a new submission."""
+    return f'{application_id}#{conversation_id}#{message_id}#{submitted_at}'
+
+
+class DynamoDBIdempotencyStore:
+    """
+    Records processed feedback with conditional writes, so concurrent or retried
+    deliveries of the same event can only be claimed once. expiresAt doubles as the
+    table's TTL attribute and as the lease of an IN_PROGRESS claim whose Lambda died.
+    """
+
+    def __init__(self, table_name: str, client=None, clock: Callable[[], float] = time.time):
+        self.table_name = table_name
+        self._client = client
+        self.clock = clock
+
+    @property
+    def client(self):
+        return self._client or get_client('dynamodb')
+
+    def claim(self, key: str, lease_seconds: int) -> bool:
+        now = self.clock()
+        try:
+            self.client.put_item(
+                TableName=self.table_name,
+                Item={'idempotencyKey': {'S': key}, 'status': {'S': IN_PROGRESS},
+                      'expiresAt': {'N': str(int(now + lease_seconds))}},
+                ConditionExpression='attribute_not_exists(idempotencyKey) OR expiresAt < :now',
+                ExpressionAttributeValues={':now': {'N': str(int(now))}})
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+    def complete(self, key: str, ttl_seconds: int) -> None:
+        self.client.put_item(
+            TableName=self.table_name,
+            Item={'idempotencyKey': {'S': key}, 'status': {'S': COMPLETED},
+                  'expiresAt': {'N': str(int(self.clock() + ttl_seconds))}})
+
+    def release(self, key: str) -> None:
+        self.client.delete_item(TableName=self.table_name, Key={'idempotencyKey': {'S': key}})
+
+
+class SQLiteIdempotencyStore:
+    """Local stand-in for the DynamoDB store; in memory by default, or backed by a sqlite file."""
+
+    def __init__(self, path: str = ':memory:', clock: Callable[[], float] = time.time):
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('CREATE TABLE IF NOT EXISTS idempotency '
+                                 '(idempotency_key TEXT PRIMARY KEY, status TEXT, expires_at REAL)')
+
+    def claim(self, key: str, lease_seconds: int) -> bool:
+        now = self.clock()
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                'INSERT INTO idempotency VALUES (?, ?, ?) ON CONFLICT(idempotency_key) '
+                'DO UPDATE SET status = excluded.status, expires_at = excluded.expires_at '
+                'WHERE idempotency.expires_at < ?',
+                (key, IN_PROGRESS, now + lease_seconds, now))
+            return cursor.rowcount == 1
+
+    def complete(self, key: str, ttl_seconds: int) -> None:
+        with self._lock, self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO idempotency VALUES (?, ?, ?)',
+                                     (key, COMPLETED, self.clock() + ttl_seconds))
+
+    def release(self, key: str) -> None:
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM idempotency WHERE idempotency_key = ?', (key,))
+
+
+class IdempotencyGuard:
+    """Claims feedback submissions before processing and reports the duplicate rate."""
+
+    def __init__(self, store, ttl_seconds: int = 604800, lease_seconds: int = 300):
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+        self.lease_seconds = lease_seconds
+        self.processed = 0
+        self.duplicates = 0
+
+    def claim(self, key: str) -> bool:
+        """True if this delivery should be processed, False if it is a duplicate."""
+        claimed = self.store.claim(key, self.lease_seconds)
+        if claimed:
+            self.processed += 1
+        else:
+            self.duplicates += 1
+        self.log_metrics(not claimed)
+        return claimed
+
+    def complete(self, key: str) -> None:
+        self.store.complete(key, self.ttl_seconds)
+
+    def release(self, key: str) -> None:
+        """Drops a claim after a failure so the retried delivery is processed."""
+        try:
+            self.store.release(key)
+        except Exception:
+            logger.exception(f'Could not release idempotency claim {key}')
+
+    def log_metrics(self, duplicate: bool) -> None:
+        total = self.processed + self.duplicates
+        metrics.emit({
+            'DuplicateDeliveries': (int(duplicate), metrics.COUNT),
+            'ProcessedDeliveries': (int(not duplicate), metrics.COUNT),
+        }, properties={'containerDuplicateRate': round(self.duplicates / total, 4) if total else 0.0})
+
+
+def guard_from_environment() -> Optional[IdempotencyGuard]:
+    """
+    Builds the guard selected by IDEMPOTENCY: "dynamodb" for the shared
+    IDEMPOTENCY_TABLE, "memory" (default) for a per-container sqlite store, or "off".
+    """
+    mode = os.environ.get('IDEMPOTENCY', 'memory')
+    if mode == 'off':
+        return None
+
+    if mode == 'dynamodb':
+        store = DynamoDBIdempotencyStore(os.environ.get('IDEMPOTENCY_TABLE'))
+    else:
+        store = SQLiteIdempotencyStore(os.environ.get('IDEMPOTENCY_SQLITE_PATH', ':memory:'))
+
+    return IdempotencyGuard(store,
+                            ttl_seconds=int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', '604800')),
+                            lease_seconds=int(os.environ.get('IDEMPOTENCY_LEASE_SECONDS', '300')))
@@ -1,127 +1,120 @@
-import boto3
 import json
 import logging
 import os
-from datetime import datetime, timezone
+import time
 from typing import Dict, List, Optional
-from botocore.exceptions import ClientError
+
+import metrics
+import throttling
+from applications import application_scope
+from clients import get_client
+from conversation import ConversationIndex
+from conversation_cache import cached_overlap, conversation_cache_from_environment, conversation_key, splice
+from deferral import deferral_from_environment
+from feedback_sink import SinkFlushError, sink_from_environment
+from idempotency import guard_from_environment, idempotency_key
+from pipeline import StageFailure, run_stages
+from prompt_builder import builder_from_environment
+from recommendation_cache import cache_from_environment, recommendation_key
+from report_templates import render_report
+from reporting import ReportStream, select_model, send_email, stream_claude
+from rollups import apply_record, store_from_environment
 
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+# DEBUG also logs the full messages, record and report of every invocation
+logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
 
-# Business Q client
-client = boto3.client('qbusiness')
+# AWS clients (qbusiness, s3) are created on first use by clients.get_client and
+# reused across warm invocations; required settings are read per invocation, so a
+# missing variable fails the invocation that needs it rather than the import
 
-# S3 client
-s3 = boto3.client('s3')
+# ListMessages paging; maxResults is capped at 100 by the Q Business API
+list_messages_page_size = int(os.environ.get('LIST_MESSAGES_PAGE_SIZE', '10'))
+list_messages_max_pages = int(os.environ.get('LIST_MESSAGES_MAX_PAGES', '50'))
 
-# Bedrock client used to interact with APIs around models
-bedrock = boto3.client(
-    service_name='bedrock'
-)
-    
-# Bedrock Runtime client used to invoke and question the models
-bedrock_runtime = boto3.client(
-    service_name='bedrock-runtime'
-)
+# "per_feedback" emails a report for every feedback, "digest" only persists it for the digest job
+report_mode = os.environ.get('REPORT_MODE', 'per_feedback')
 
-# SES for report sending
-ses = boto3.client('ses')
+# "template" renders the feedback details of the report email from templates and only
+# asks the model for recommendations, capped at REPORT_MAX_TOKENS; "model" has the
+# model write the whole report, sent as text
+report_format = os.environ.get('REPORT_FORMAT', 'template')
+report_max_tokens = int(os.environ.get('REPORT_MAX_TOKENS', '400'))
 
-# sink the feedback json to the s3 bucket
-s3_bucket = os.environ['S3_DATA_BUCKET']
-glue_database_name = os.environ['GLUE_DATABASE_NAME']
-model_id = os.environ['MODELID']
+# feedback records are written as an S3 object each, or buffered and written once per
+# invocation as gzipped JSON lines, locally or through Firehose (FEEDBACK_SINK)
+feedback_sink = sink_from_environment()
 
+# conversation windows already read, so ratings of several answers in one
+# conversation share a ListMessages lookup
+conversation_cache = conversation_cache_from_environment()
 
-def invoke_claude(model_id, prompt_context, prompt):
-    """
-    Invokes the Anthropic Claude 2 model to run an inference using the input
-    provided in the request body.
+# model recommendations cached by content hash, shared across warm invocations
+recommendation_cache = cache_from_environment()
 
-    :param prompt: The prompt that you want Claude to complete.
-    :return: Inference response from the model.
-    """
+# claims each PutFeedback submission once, absorbing EventBridge and Lambda retries
+idempotency_guard = guard_from_environment()
 
-    try:
-        # The different model providers have individual request and response formats.
-        # For the format, ranges, and default values for Anthropic Claude, refer to:
-        # https://docs.anthropic.com/claude/reference/complete_post
+# dedupes and trims the feedback record to the PROMPT_TOKEN_BUDGET before it reaches the model
+prompt_builder = builder_from_environment()
 
+# dashboard counters (day x application, source URL, user) updated as feedback is persisted
+rollup_store = store_from_environment()
 
-        prompt = "<context>" + prompt_context + "</context>\n\n" + prompt
+# report emails throttled by SES are queued for the deferred task Lambda instead of
+# failing the invocation; they wait at most EMAIL_MAX_WAIT_SECONDS for the rate limiter
+email_deferral = deferral_from_environment()
+email_max_wait_seconds = float(os.environ.get('EMAIL_MAX_WAIT_SECONDS', '2'))
 
-        # Claude requires you to enclose the prompt as follows:
-        
-        enclosed_prompt = "Human: " + prompt + "\n\nAssistant:"
+# near-duplicate feedback is reported once per cluster of recent feedback; numpy is
+# only imported when clustering is on
+if os.environ.get('CLUSTERING', 'off') != 'off':
+    from clustering import clusterer_from_environment
+    feedback_clusterer = clusterer_from_environment()
+else:
+    feedback_clusterer = None
 
-        body = {
-            "prompt": enclosed_prompt,
-            "max_tokens_to_sample": 1000,
-            "temperature": 0.5,
-            "stop_sequences": ["\n\nHuman:"],
-        }
+# feedback fields that identify who rated and when; kept out of the cached model input
+FEEDBACK_USER_FIELDS = ('messageId', 'applicationId', 'userId', 'submittedAt')
 
-        response = bedrock_runtime.invoke_model(
-            modelId="anthropic.claude-v2", body=json.dumps(body)
-        )
+REPORT_PROMPT = '''
 
-        logger.info(prompt)
-        
-        response_body = json.loads(response["body"].read())
-        completion = response_body["completion"]
+You are an intelligent LLM prompt engineer. Write a content report for this RAG Chat user report. This report is important for my career. 
 
-        return completion
+List of usefulness reason, and usefulness_comment, query, message, list all source titles, snippet summary, and urls, including source_attribution_urls.
 
-    except ClientError:
-        logger.error("Couldn't invoke Anthropic Claude")
-        raise
+List the key suggestion for improving the source content based on the usefulness_comment.
 
-def send_email(report_response):
-    
-    from_address = os.environ['FROM_ADDRESS']
-    to_address = os.environ['TO_ADDRESS']
-    
-    response = ses.send_email(
-        Source=from_address,
-        Destination={
-            'ToAddresses': [to_address]
-        },
-        Message={
-            'Subject': {
-                'Data': 'Business Q Feedback Report'
-            },
-            'Body': {
-                'Text': {
-                    'Data': report_response
-                }
-            }
-        }
-    )
-    
-    return("Email sent with message ID: " + response['MessageId'])
-    
-    
-    
-def get_previous_body(data: List[Dict[str, any]], target_message_id: str) -> Optional[str]:
-    previous_body = None
+In the Recommendations section, suggest 2-3 specific examples of content that can be added to the content sources to be more useful/appropriate based on the usefulness_comment.
 
-    for item in data:
-        if item.get('messageId') == target_message_id:
-            break
-        previous_body = item.get('body')
+Do NOT use wiki syntax in the output.
 
-    return previous_body
-    
-def get_previous_source_attribution(data: List[Dict[str, any]], target_message_id: str) -> Optional[str]:
-    previous_body = None
+'''
 
-    for item in data:
-        if item.get('messageId') == target_message_id:
-            break
-        previous_source_attribution = item.get('sourceAttribution')
+# the details the full report lists are rendered from the record, so the model only
+# writes the part that needs it
+RECOMMENDATIONS_PROMPT = '''
+
+You are an intelligent LLM prompt engineer reviewing a RAG Chat answer that a user rated, with their usefulness reason and usefulness_comment.
+
+Do NOT repeat the query, message, sources or user details; they are already in the report.
+
+Start with one line "Key suggestion:" giving the key suggestion for improving the source content based on the usefulness_comment.
+
+Then, under "Recommendations:", suggest 2-3 numbered, specific examples of content that can be added to the content sources to be more useful/appropriate based on the usefulness_comment.
+
+Keep the whole answer under 200 words. Do NOT use wiki syntax in the output.
+
+'''
+
+report_prompt = RECOMMENDATIONS_PROMPT if report_format == 'template' else REPORT_PROMPT
 
-    return previous_source_attribution
+
+def get_previous_body(data: List[Dict[str, any]], target_message_id: str) -> Optional[str]:
+    return ConversationIndex(data).previous_body(target_message_id)
+    
+def get_previous_source_attribution(data: List[Dict[str, any]], target_message_id: str) -> Optional[str]:
+    return ConversationIndex(data).previous_source_attribution(target_message_id)
 
 def extract_urls_from_json(data):
     urls = []
@@ -134,7 +127,291 @@ def extract_urls_from_json(data):
     return urls
     
 
-def lambda_handler(event, context):
+def find_feedback_messages(application_id: str, conversation_id: str, user_id: str, target_message_id: str):
+    """
+    Pages through a conversation with ListMessages until the rated message is found.
+
+    Messages are listed newest first, so the AI turn that precedes the rated message
+    in the listing is always on the same page or on one already read. The lookup
+    therefore stops on the page that contains the target and only costs more calls
+    the further back in the conversation the rated message is.
+
+    A window of the conversation cached by an earlier lookup answers without any
+    call when it holds the target below its first message; the turn listed before
+    the window's first message may have been posted since. Otherwise the head of the listing is read until
+    it reaches the cached window, which covers the messages posted since, and the
+    listing continues after the window from its cached token.
+
+    :param target_message_id: The messageId from the PutFeedback request.
+    :return: A ConversationIndex over the messages read so far and the lookup stats
+             (pages, api_calls, found, ms, cache: hit, extended, miss or off).
+    """
+    stats = {'pages': 0, 'api_calls': 0, 'found': False, 'ms': 0.0, 'cache': 'off'}
+    started = time.perf_counter()
+    key = conversation_key(application_id, conversation_id, user_id)
+    cached = None
+    if conversation_cache is not None:
+        cached = conversation_cache.get(key)
+        stats['cache'] = 'miss'
+        if cached is not None and cached.index.position(target_message_id):
+            stats.update(found=True, cache='hit', ms=(time.perf_counter() - started) * 1000)
+            return cached.index, stats
+
+    index = ConversationIndex()
+    next_token = None
+    request = {
+        'applicationId': application_id,
+        'conversationId': conversation_id,
+        'userId': user_id,
+        'maxResults': list_messages_page_size
+    }
+
+    while stats['api_calls'] < list_messages_max_pages:
+        response = throttling.call('qbusiness', get_client('qbusiness').list_messages, **request)
+        stats['api_calls'] += 1
+
+        page = response.get('messages', [])
+        next_token = response.get('nextToken')
+        overlap = cached_overlap(page, cached)
+        if overlap is not None:
+            # the rest of the listing down to the cached token was read before; every
+            # page read since the head of the listing comes before the window
+            index = splice(index.messages + page, len(index) + overlap, cached)
+            next_token, cached = cached.next_token, None
+            stats['cache'] = 'extended'
+        else:
+            index.extend(page)
+        if page:
+            stats['pages'] += 1
+
+        if target_message_id in index:
+            stats['found'] = True
+            break
+
+        if not next_token:
+            break
+        request['nextToken'] = next_token
+
+    if conversation_cache is not None:
+        conversation_cache.put(key, index, next_token)
+
+    stats['ms'] = (time.perf_counter() - started) * 1000
+    if not stats['found']:
+        logger.warning(f"Message {target_message_id} not found in {len(index)} messages "
+                       f"({stats['pages']} pages / {stats['api_calls']} ListMessages calls)")
+
+    return index, stats
+
+
+def emit_lookup_metrics(lookup_stats, response_data):
+    lookup_metrics = {
+        'ListMessagesMs': (round(lookup_stats['ms'], 1), metrics.MILLISECONDS),
+        'ListMessagesCalls': (lookup_stats['api_calls'], metrics.COUNT),
+        'MessagesNotFound': (int(not lookup_stats['found']), metrics.COUNT),
+        'RecordBytes': (len(response_data.encode('utf-8')), metrics.BYTES),
+    }
+    if lookup_stats['cache'] != 'off':
+        lookup_metrics['ConversationCacheHits'] = (int(lookup_stats['cache'] == 'hit'), metrics.COUNT)
+        lookup_metrics['ConversationCacheMisses'] = (int(lookup_stats['cache'] != 'hit'), metrics.COUNT)
+    metrics.emit(lookup_metrics, properties={'listMessagesPages': lookup_stats['pages'],
+                                             'conversationCache': lookup_stats['cache']})
+
+
+def update_rollups(record):
+    """
+    Counts a persisted record in the dashboard rollups. A failure only skews the
+    counters until the next rebuild from S3, so it is logged rather than retried.
+    """
+    if rollup_store is None:
+        return
+    try:
+        apply_record(rollup_store, record)
+        metrics.emit({'RollupUpdates': (1, metrics.COUNT)})
+    except Exception:
+        logger.exception(f"Updating the rollups for message {record['messageId']} failed")
+        metrics.emit({'RollupFailures': (1, metrics.COUNT)})
+
+
+def cluster_feedback(record):
+    """
+    Attaches the record to the most similar recent feedback cluster, or starts one.
+    If clustering fails the record is reported on its own.
+
+    :return: The clustering.Assignment, None on failure.
+    """
+    try:
+        return feedback_clusterer.assign(record)
+    except Exception:
+        logger.exception(f"Clustering feedback for message {record['messageId']} failed")
+        return None
+
+
+def cluster_report(cluster, record, log_payloads=False):
+    """
+    The report for the first feedback of a cluster. Near-duplicates joining it later
+    return None: they are persisted and counted without a model call or email.
+    """
+    if cluster is not None and not cluster.report:
+        return None
+    return generate_recommendation(record, log_payloads)
+
+
+def format_report(record, report):
+    """
+    The text and HTML email bodies of a report, which reads a streaming report to
+    its end; the "model" format has no HTML body.
+    """
+    if report_format == 'model':
+        return f"userId: {record.get('userId')}\nsubmittedAt: {record.get('submittedAt')}\n\n" + str(report), None
+    return render_report(record, report, prompt_builder.snippet_chars)
+
+
+def deliver_email(body, html=None):
+    """
+    Emails a report, deferring it when SES is throttling. The email is not urgent,
+    so rather than holding the invocation for a token or failing it, it is queued
+    and sent later; the record is already persisted either way.
+    """
+    if email_deferral is None:
+        return send_email(body, html=html)
+    try:
+        return send_email(body, max_wait_seconds=email_max_wait_seconds, html=html)
+    except Exception as e:
+        if not throttling.is_throttled(e):
+            raise
+        logger.warning(f"Deferring the report email after SES throttling: {e}")
+        return email_deferral.defer_email(body, html=html)
+
+
+def generate_recommendation(record, log_payloads=False):
+    """
+    Returns the model's content report for a feedback record, from the recommendation
+    cache when the same content was reported on before. In the "template" report
+    format this is only the key suggestion and recommendations.
+
+    A report the model has to write is returned as a ReportStream once its first
+    chunk arrived, so the email stage renders the record's part of the email while
+    the model is still writing; the report is cached and logged when it ends.
+
+    :param log_payloads: Log the report, for invocations sampled for payload logging.
+    """
+    # the model only sees the feedback content, so the same answer rated by many
+    # users maps to one cached recommendation; who and when is added to the email
+    prompt_context = prompt_builder.build(record, exclude_fields=FEEDBACK_USER_FIELDS)
+    model_id, route = select_model(prompt_context, report_prompt)
+    max_tokens = report_max_tokens if report_format == 'template' else None
+
+    key = None
+    if recommendation_cache is not None:
+        key = recommendation_key(model_id, report_prompt, record)
+        report_response = recommendation_cache.get(key, prompt_context)
+        if report_response is not None:
+            metrics.log_payload(log_payloads, 'Report', report_response)
+            return report_response
+
+    def complete(report_response, seconds):
+        metrics.log_payload(log_payloads, 'Report', report_response)
+        if key is not None:
+            recommendation_cache.put(key, report_response, seconds * 1000)
+
+    return ReportStream(stream_claude(model_id, prompt_context, report_prompt, route, max_tokens),
+                        on_complete=complete).start()
+
+
+def update_rollups_when_persisted(record):
+    """Counts a record in the rollups now, unless the sink buffers it until flush_feedback."""
+    if not feedback_sink.buffered:
+        update_rollups(record)
+
+
+def flush_feedback(requeue=False):
+    """
+    Writes the records the feedback sink buffered and counts them in the rollups,
+    which only count persisted feedback.
+
+    :param requeue: Keep the records that could not be written for the next flush.
+    :return: The records written.
+    :raises SinkFlushError: With the records that could not be written.
+    """
+    try:
+        written = feedback_sink.flush(requeue)
+    except SinkFlushError as e:
+        for record in e.written:
+            update_rollups(record)
+        raise
+    for record in written:
+        update_rollups(record)
+    return written
+
+
+def feedback_idempotency_key(event):
+    request_parameters = event["detail"]["requestParameters"]
+    return idempotency_key(request_parameters["applicationId"], request_parameters["conversationId"],
+                           request_parameters["messageId"], request_parameters["messageUsefulness"]['submittedAt'])
+
+
+def event_record_key(event):
+    """(applicationId, messageId, submittedAt) of the record an event persists, as feedback_record_key."""
+    request_parameters = event["detail"]["requestParameters"]
+    return (request_parameters["applicationId"], str(request_parameters["messageId"]),
+            request_parameters["messageUsefulness"]['submittedAt'])
+
+
+def feedback_record_key(record):
+    return record.get('applicationId'), record.get('messageId'), record.get('submittedAt')
+
+
+def release_feedback(event):
+    """Lets a redelivery of the event run the pipeline again, once its record could not be written."""
+    if idempotency_guard is not None:
+        idempotency_guard.release(feedback_idempotency_key(event))
+
+
+def process_feedback(event, persist_only=False):
+    """
+    Runs the feedback pipeline for one EventBridge PutFeedback event, unless the same
+    submission (applicationId, conversationId, messageId, submittedAt) was already
+    processed. Duplicates return before any outbound call is made. The metrics and
+    rate-limited calls of the event are attributed to its application.
+
+    :param event: The "AWS API Call via CloudTrail" event for PutFeedback.
+    :param persist_only: Only persist the feedback record, without a report email.
+    :return: The feedback record as a JSON string, empty if the message was not found
+             or the event is a duplicate.
+    """
+    with application_scope(event["detail"]["requestParameters"].get("applicationId")):
+        if idempotency_guard is None:
+            return run_feedback_pipeline(event, persist_only)
+
+        key = feedback_idempotency_key(event)
+
+        if not idempotency_guard.claim(key):
+            logger.info(f"Skipping duplicate delivery of feedback {key}")
+            return ""
+
+        try:
+            response_data = run_feedback_pipeline(event, persist_only)
+        except Exception:
+            idempotency_guard.release(key)
+            raise
+
+        if not response_data:
+            # not found, e.g. ListMessages has not caught up yet: a later delivery may find it
+            idempotency_guard.release(key)
+            return response_data
+
+        idempotency_guard.complete(key)
+        return response_data
+
+
+def run_feedback_pipeline(event, persist_only=False):
+    """
+    Looks up the rated message, persists the feedback record to S3 and emails the report.
+
+    :param event: The "AWS API Call via CloudTrail" event for PutFeedback.
+    :param persist_only: Skip the report, as in the digest report mode.
+    :return: The feedback record as a JSON string, empty if the message was not found.
+    """
     
     messageId = str(event["detail"]["requestParameters"]["messageId"])
     applicationId = event["detail"]["requestParameters"]["applicationId"]
@@ -142,12 +419,9 @@ def lambda_handler(event, context):
     submittedAt = event["detail"]["requestParameters"]["messageUsefulness"]['submittedAt']
     userId = event["detail"]["requestParameters"]['userId']
 
-    response = client.list_messages(
-        applicationId=event["detail"]["requestParameters"]["applicationId"],
-        conversationId=event["detail"]["requestParameters"]["conversationId"],
-        maxResults=10,
-        userId=event["detail"]["requestParameters"]['userId']
-    )
+    conversationId = event["detail"]["requestParameters"]["conversationId"]
+
+    index, lookup_stats = find_feedback_messages(applicationId, conversationId, userId, messageId)
     
     # with thumbs down there are comments sometimes
     try:
@@ -158,77 +432,137 @@ def lambda_handler(event, context):
     messages_list = []
     source_attribution_urls = []
     
-    logger.info("All Messages")
-    logger.info(response['messages'])
+    log_payloads = metrics.payload_logging_enabled()
+    metrics.log_payload(log_payloads, 'All Messages', index.messages)
     response_data = ""
     sourceAttribution = ""
     
-    # Loop through each message
-    for message in response['messages']:
-        
-        if str(message['messageId']) == messageId:
-            
-            message_ID = str(message['messageId'])
-            message_body = message['body']
-            
-            # get the message before to get the AI response
-            previous_body = get_previous_body(response['messages'], message_ID)
-            logger.info("debug 00")
-            previous_body_source_attribution = get_previous_source_attribution(response['messages'], message_ID)
-            logger.info("debug 0")
-            
-            # check if previous_body_source_attribution is not None
-            if previous_body_source_attribution is not None:
-                # get the sourceattribute urls from citations and add to a list
-                source_attribution_urls = extract_urls_from_json(json.dumps(previous_body_source_attribution))
-
-            logger.info("debug 1")
-            # Add message details to the analytics data
-            messages_list.append({
-                'messageId': message_ID,
-                'query': message_body,
-                'message': previous_body,
-                'source_attribution_urls': source_attribution_urls,
-                'sourceAttribution': previous_body_source_attribution,
-                'applicationId': applicationId,
-                'usefulness': usefulness,
-                'usefulness_comment':   usefulness_comment,
-                'userId': userId,
-                'submittedAt': submittedAt
-            })
-            logger.info("debug 2")        
-            # create json response payload
-            response_data = json.dumps(messages_list[0])
-            logger.info(response_data)
-            
-            current_date = datetime.now()
-            key = f'{glue_database_name}/feedback/year={current_date.year}/month={current_date.strftime("%m")}/day={current_date.strftime("%d")}/{message_ID}.json'
-            
-            bucket_name = s3_bucket
-            s3.put_object(Body=response_data, Bucket=bucket_name, Key=key)
-            
-            prompt = '''
-
-            You are an intelligent LLM prompt engineer. Write a content report for this RAG Chat user report. This report is important for my career. 
+    # Look up the rated message in the conversation index
+    message = index.get(messageId)
 
-            List of userid, submittedAt, usefulness reason, and usefulness_comment, query, message, list all titles, snippet summary, and source_attribution_urls, sourceAttribution.
-
-            List the key suggestion for improving the source content based on the usefulness_comment.
-
-            In the Recommendations section, suggest 2-3 specific examples of content that can be added to the content sources to be more useful/appropriate based on the usefulness_comment.
+    if message is not None:
+        
+        message_ID = str(message['messageId'])
+        message_body = message['body']
+        
+        # get the message before to get the AI response
+        previous_body = index.previous_body(message_ID)
+        previous_body_source_attribution = index.previous_source_attribution(message_ID)
+        
+        # check if previous_body_source_attribution is not None
+        if previous_body_source_attribution is not None:
+            # get the sourceattribute urls from citations and add to a list
+            source_attribution_urls = extract_urls_from_json(json.dumps(previous_body_source_attribution))
+
+        # Add message details to the analytics data
+        messages_list.append({
+            'messageId': message_ID,
+            'query': message_body,
+            'message': previous_body,
+            'source_attribution_urls': source_attribution_urls,
+            'sourceAttribution': previous_body_source_attribution,
+            'applicationId': applicationId,
+            'usefulness': usefulness,
+            'usefulness_comment':   usefulness_comment,
+            'userId': userId,
+            'submittedAt': submittedAt
+        })
+        # create json response payload
+        response_data = json.dumps(messages_list[0])
+        metrics.log_payload(log_payloads, 'Feedback record', response_data)
+        
+        emit_lookup_metrics(lookup_stats, response_data)
+
+        # The record is partitioned by the submission hour in UTC, so retried and
+        # backfilled feedback lands next to the feedback given at the same time.
+        # The write does not depend on the model call, so the stages run
+        # concurrently and a Bedrock or SES failure cannot lose the record
+        stages = [('persist', lambda: feedback_sink.put(messages_list[0]), ())]
+
+        # the scheduled digest job reports on the persisted records instead
+        if report_mode != 'digest' and not persist_only and feedback_clusterer is None:
+            stages += [
+                ('recommend', lambda: generate_recommendation(messages_list[0], log_payloads), ()),
+                ('email', lambda report: deliver_email(*format_report(messages_list[0], report)), ('recommend',)),
+            ]
+        elif report_mode != 'digest' and not persist_only:
+            stages += [
+                ('cluster', lambda: cluster_feedback(messages_list[0]), ()),
+                ('recommend', lambda cluster: cluster_report(cluster, messages_list[0], log_payloads), ('cluster',)),
+                ('email', lambda report: report and deliver_email(*format_report(messages_list[0], report)), ('recommend',)),
+            ]
+
+        try:
+            run_stages(stages)
+        except StageFailure as e:
+            # the event is released and redelivered, which persists the record again
+            feedback_sink.discard(messages_list[0])
+            # a retry, or the next near-duplicate, has to send the report this one could not
+            cluster = e.stage_results.get('cluster')
+            if cluster is not None and cluster.value is not None and cluster.value.report:
+                feedback_clusterer.release(messages_list[0], cluster.value)
+            raise
+        # counted once every stage succeeded; a retried delivery is stopped by the idempotency guard
+        update_rollups_when_persisted(messages_list[0])
+    else:
+        emit_lookup_metrics(lookup_stats, response_data)
+
+    return response_data
 
-            Do NOT use wiki syntax in the output.
 
-            '''
-            
-            report_response = invoke_claude(model_id,response_data,prompt)
-            logger.info(report_response)
-            send_email(report_response)
-            
-            break
+def lambda_handler(event, context):
+    
+    response_data = process_feedback(event)
+    try:
+        flush_feedback()
+    except SinkFlushError:
+        release_feedback(event)
+        raise
             
     # Return the JSON response
     return {
         'statusCode': 200,
         'body': response_data
-    }
\ No newline at end of file
+    }
+
+
+def batch_handler(event, context):
+    """
+    Entry point for the SQS-buffered ingestion mode.
+
+    Each SQS record body is an EventBridge PutFeedback event. Records are processed
+    one at a time and failures are reported per record with batchItemFailures, so
+    SQS only redelivers the events that failed rather than the whole batch. A
+    buffering feedback sink writes the batch's records once, at the end; events
+    whose record it could not write are reported as failures too.
+    """
+    records = event.get('Records', [])
+    batch_item_failures = []
+    # (applicationId, messageId, submittedAt) of each processed event's record
+    processed = {}
+
+    for record in records:
+        try:
+            feedback_event = json.loads(record['body'])
+            process_feedback(feedback_event)
+            processed[event_record_key(feedback_event)] = (record['messageId'], feedback_event)
+        except Exception:
+            logger.exception(f"Failed to process feedback event from SQS message {record['messageId']}")
+            batch_item_failures.append({'itemIdentifier': record['messageId']})
+
+    try:
+        flush_feedback()
+    except SinkFlushError as e:
+        logger.exception(f"Failed to write {len(e.records)} buffered feedback records")
+        for feedback in e.records:
+            sqs_message = processed.get(feedback_record_key(feedback))
+            if sqs_message is not None:
+                release_feedback(sqs_message[1])
+                batch_item_failures.append({'itemIdentifier': sqs_message[0]})
+
+    metrics.emit({
+        'BatchEvents': (len(records), metrics.COUNT),
+        'BatchFailures': (len(batch_item_failures), metrics.COUNT),
+    })
+
+    return {'batchItemFailures': batch_item_failures}
\ No newline at end of file
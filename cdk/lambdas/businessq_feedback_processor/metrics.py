@@ -0,0 +1,105 @@
+import json
+import logging
+import os
+import random
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from applications import current_application
+
+logger = logging.getLogger()
+
+COUNT = 'Count'
+MILLISECONDS = 'Milliseconds'
+BYTES = 'Bytes'
+
+# "emf" writes CloudWatch Embedded Metric Format lines to stdout, "off" drops them
+METRICS_MODE = os.environ.get('METRICS', 'emf')
+NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'BusinessQFeedback')
+SERVICE = os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'businessq_feedback_processor')
+
+# share of invocations that log full payloads (messages, record, report) at INFO;
+# at DEBUG level every invocation does
+PAYLOAD_LOG_SAMPLE_RATE = float(os.environ.get('PAYLOAD_LOG_SAMPLE_RATE', '0'))
+PAYLOAD_LOG_MAX_CHARS = int(os.environ.get('PAYLOAD_LOG_MAX_CHARS', '4000'))
+
+
+def write_line(line: str) -> None:
+    # EMF lines must be whole log events, so they bypass the logging prefix
+    sys.stdout.write(line + '\n')
+    sys.stdout.flush()
+
+
+_writer: Callable[[str], None] = write_line
+
+
+def set_writer(writer: Optional[Callable[[str], None]]) -> None:
+    """Redirects EMF lines, e.g. to a list in offline tests; None restores stdout."""
+    global _writer
+    _writer = writer or write_line
+
+
+def emf_document(namespace: str, dimensions: Dict[str, str], metrics: Dict[str, Tuple[float, str]],
+                 properties: Optional[Dict[str, Any]] = None, timestamp_ms: Optional[int] = None,
+                 dimension_sets: Optional[List[List[str]]] = None) -> Dict[str, Any]:
+    """
+    A CloudWatch Embedded Metric Format document: metric values and dimensions as
+    top-level members, declared under _aws so CloudWatch extracts them as metrics.
+    Properties are kept in the log event for Logs Insights but are not metrics.
+
+    :param metrics: Metric name to (value, unit).
+    :param dimension_sets: The dimension combinations each metric is extracted with;
+                           all of dimensions together by default.
+    """
+    document = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000) if timestamp_ms is None else timestamp_ms,
+            'CloudWatchMetrics': [{
+                'Namespace': namespace,
+                'Dimensions': dimension_sets or [list(dimensions)],
+                'Metrics': [{'Name': name, 'Unit': unit} for name, (_, unit) in metrics.items()],
+            }],
+        },
+    }
+    document.update(properties or {})
+    document.update(dimensions)
+    document.update({name: value for name, (value, _) in metrics.items()})
+    return document
+
+
+def emit(metrics: Dict[str, Tuple[float, str]], properties: Optional[Dict[str, Any]] = None,
+         dimensions: Optional[Dict[str, str]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Writes one EMF line with the Service dimension (plus any given ones). Inside an
+    applications.application_scope the metrics are also extracted per ApplicationId,
+    next to the totals across applications.
+
+    :return: The document written, or None when metrics are off.
+    """
+    if METRICS_MODE == 'off' or not metrics:
+        return None
+    dimensions = dict({'Service': SERVICE}, **(dimensions or {}))
+    dimension_sets = None
+    application_id = current_application()
+    if application_id:
+        dimension_sets = [list(dimensions), list(dimensions) + ['ApplicationId']]
+        dimensions['ApplicationId'] = application_id
+    document = emf_document(NAMESPACE, dimensions, metrics, properties, dimension_sets=dimension_sets)
+    _writer(json.dumps(document, default=str))
+    return document
+
+
+def payload_logging_enabled() -> bool:
+    """Decided once per invocation, so a sampled invocation logs all its payloads."""
+    return logger.isEnabledFor(logging.DEBUG) or (
+        PAYLOAD_LOG_SAMPLE_RATE > 0 and random.random() < PAYLOAD_LOG_SAMPLE_RATE)
+
+
+def log_payload(enabled: bool, label: str, payload: Any) -> None:
+    if not enabled:
+        return
+    text = payload if isinstance(payload, str) else json.dumps(payload, default=str)
+    if len(text) > PAYLOAD_LOG_MAX_CHARS:
+        text = text[:PAYLOAD_LOG_MAX_CHARS] + f'... ({len(text)} chars)'
+    logger.info(f'{label}: {text}')
@@ -0,0 +1,123 @@
+import argparse
+import json
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from partitioning import feedback_key
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# <glue_database>/feedback/year=YYYY/month=MM/day=DD/<messageId>.json, written by
+# processing time in the Lambda's clock before the application and hour partitions
+LEGACY_KEY = re.compile(r'/feedback/year=(\d{4})/month=(\d{2})/day=(\d{2})/[^/]+\.json$')
+LEGACY_PARQUET_KEY = re.compile(r'/feedback_parquet/year=\d{4}/month=\d{2}/day=\d{2}/[^/]+\.parquet$')
+
+
+def legacy_day(key: str) -> Optional[datetime]:
+    match = LEGACY_KEY.search(key)
+    if match is None:
+        return None
+    return datetime(*(int(part) for part in match.groups()), tzinfo=timezone.utc)
+
+
+def list_keys(s3, bucket: str, prefix: str, pattern: re.Pattern) -> Iterator[str]:
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+        for item in page.get('Contents', []):
+            if pattern.search(item['Key']):
+                yield item['Key']
+
+
+def migrate_object(s3, bucket: str, glue_database_name: str, key: str, delete_source: bool = True,
+                   dry_run: bool = False) -> str:
+    """
+    Copies one legacy feedback object to its key in the application and hour layout,
+    then deletes the original. A record without a parseable submittedAt keeps the
+    day of its legacy partition.
+
+    :return: The new key.
+    """
+    record = json.loads(s3.get_object(Bucket=bucket, Key=key)['Body'].read())
+    new_key = feedback_key(glue_database_name, record, now=legacy_day(key))
+    if dry_run:
+        return new_key
+    # a server-side copy keeps the stored bytes exactly as the Lambda wrote them
+    s3.copy_object(Bucket=bucket, Key=new_key, CopySource={'Bucket': bucket, 'Key': key})
+    if delete_source:
+        s3.delete_object(Bucket=bucket, Key=key)
+    return new_key
+
+
+def run_migration(keys: Iterator[str], migrate: Callable[[str], Any], workers: int = 16) -> Dict[str, Any]:
+    """
+    Migrates the keys with at most workers objects in flight. Migrated objects no
+    longer match the legacy layout, so an interrupted run is resumed by running it again.
+    """
+    stats = {'objects': 0, 'migrated': 0, 'failed': 0, 'failed_keys': []}
+    lock = threading.Lock()
+    # bounds the queued keys, so memory stays flat however many objects are listed
+    slots = threading.BoundedSemaphore(workers * 2)
+
+    def move(key: str) -> None:
+        try:
+            migrate(key)
+            with lock:
+                stats['migrated'] += 1
+        except Exception as e:
+            logger.exception(f"Migrating {key} failed")
+            with lock:
+                stats['failed'] += 1
+                stats['failed_keys'].append({'key': key, 'error': repr(e)})
+        finally:
+            slots.release()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for key in keys:
+            stats['objects'] += 1
+            slots.acquire()
+            pool.submit(move, key)
+
+    stats['seconds'] = round(time.perf_counter() - started, 3)
+    stats['objects_per_second'] = round(stats['objects'] / stats['seconds'], 1) if stats['seconds'] else 0.0
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Move feedback records from the year=/month=/day= layout into the '
+                    'application_id=/year=/month=/day=/hour= layout keyed by submittedAt in UTC.')
+    parser.add_argument('--bucket', required=True, help='the S3_DATA_BUCKET of the stack')
+    parser.add_argument('--glue-database', default='business_q_feedback')
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--keep-source', action='store_true', help='copy without deleting the legacy objects')
+    parser.add_argument('--dry-run', action='store_true', help='only print where the objects would go')
+    parser.add_argument('--delete-legacy-parquet', action='store_true',
+                        help='also delete the Parquet day partitions of the legacy layout; recompact the '
+                             'migrated days afterwards with {"days": [...], "force": true}')
+    args = parser.parse_args()
+
+    from clients import get_client
+
+    logging.basicConfig(level=logging.WARNING)
+    s3 = get_client('s3')
+    legacy_keys = list_keys(s3, args.bucket, f'{args.glue_database}/feedback/year=', LEGACY_KEY)
+
+    if args.dry_run:
+        for legacy_key in legacy_keys:
+            print(f'{legacy_key} -> {migrate_object(s3, args.bucket, args.glue_database, legacy_key, dry_run=True)}')
+        raise SystemExit(0)
+
+    result = run_migration(legacy_keys, lambda key: migrate_object(s3, args.bucket, args.glue_database, key,
+                                                                   delete_source=not args.keep_source),
+                           workers=args.workers)
+    if args.delete_legacy_parquet and not result['failed']:
+        parquet_keys = list_keys(s3, args.bucket, f'{args.glue_database}/feedback_parquet/year=', LEGACY_PARQUET_KEY)
+        result['legacy_parquet'] = run_migration(parquet_keys, lambda key: s3.delete_object(Bucket=args.bucket, Key=key),
+                                                 workers=args.workers)
+    print(json.dumps(result, indent=2))
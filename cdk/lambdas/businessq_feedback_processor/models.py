@@ -0,0 +1,226 @@
+import json
+import os
+import time
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+import metrics
+import throttling
+from clients import get_client
+
+ANTHROPIC_VERSION = 'bedrock-2023-05-31'
+
+# "messages" is the Anthropic Messages API that every Claude model on Bedrock
+# accepts; "completion" is the legacy Human:/Assistant: text completion format
+# that only the Claude 2.x and Instant models accept
+REQUEST_FORMATS = ('messages', 'completion')
+
+
+def estimate_tokens(text: str) -> int:
+    # roughly four characters per token for English text
+    return len(text or '') // 4
+
+
+def build_request(request_format: str, prompt: str, max_tokens: int, temperature: float) -> Dict[str, Any]:
+    """The InvokeModel body for an Anthropic model in the given request format."""
+    if request_format == 'completion':
+        return {
+            'prompt': 'Human: ' + prompt + '\n\nAssistant:',
+            'max_tokens_to_sample': max_tokens,
+            'temperature': temperature,
+            'stop_sequences': ['\n\nHuman:'],
+        }
+    return {
+        'anthropic_version': ANTHROPIC_VERSION,
+        'max_tokens': max_tokens,
+        'temperature': temperature,
+        'messages': [{'role': 'user', 'content': [{'type': 'text', 'text': prompt}]}],
+    }
+
+
+def response_text(request_format: str, response_body: Dict[str, Any]) -> str:
+    """The generated text of a non-streaming InvokeModel response."""
+    if request_format == 'completion':
+        return response_body['completion']
+    return ''.join(block.get('text', '') for block in response_body.get('content', []) if block.get('type') == 'text')
+
+
+def chunk_text(request_format: str, chunk: Dict[str, Any]) -> str:
+    """The generated text carried by one InvokeModelWithResponseStream chunk, if any."""
+    if request_format == 'completion':
+        return chunk.get('completion', '')
+    if chunk.get('type') == 'content_block_delta':
+        return chunk.get('delta', {}).get('text', '')
+    return ''
+
+
+def response_tokens(response: Dict[str, Any], response_body: Dict[str, Any]) -> Tuple[Optional[int], Optional[int]]:
+    """
+    The input and output token counts of an InvokeModel call: the Messages API
+    usage, else the token count headers Bedrock adds to every response; None
+    where neither has one.
+    """
+    usage = response_body.get('usage') or {}
+    headers = response.get('ResponseMetadata', {}).get('HTTPHeaders', {})
+
+    def count(usage_field, header):
+        value = usage.get(usage_field, headers.get(header))
+        return None if value is None else int(value)
+
+    return (count('input_tokens', 'x-amzn-bedrock-input-token-count'),
+            count('output_tokens', 'x-amzn-bedrock-output-token-count'))
+
+
+def chunk_tokens(chunk: Dict[str, Any]) -> Tuple[Optional[int], Optional[int]]:
+    """
+    The input and output token counts an InvokeModelWithResponseStream chunk
+    reports, None where it has none: the Messages message_start and message_delta
+    usage, and the invocation metrics Bedrock adds to the last chunk.
+    """
+    usage = chunk.get('message', {}).get('usage') if chunk.get('type') == 'message_start' else chunk.get('usage')
+    usage = usage or {}
+    invocation = chunk.get('amazon-bedrock-invocationMetrics') or {}
+    return (usage.get('input_tokens', invocation.get('inputTokenCount')),
+            usage.get('output_tokens', invocation.get('outputTokenCount')))
+
+
+class ModelRouter:
+    """
+    Picks the model for a prompt: payloads estimated at or under token_threshold
+    input tokens go to the fast model and larger ones to the strong model.
+
+    When latency_budget_ms is set and the strong model's recent total latency (an
+    exponentially weighted average of observed calls) goes over budget, large
+    payloads fall back to the fast model for recovery_seconds; the next large
+    payload after that probes the strong model again.
+
+    Without a fast model every prompt goes to the strong model.
+    """
+
+    def __init__(self, strong_model_id: str, fast_model_id: Optional[str] = None, token_threshold: int = 2000,
+                 latency_budget_ms: float = 0, recovery_seconds: float = 300, smoothing: float = 0.3,
+                 clock: Callable[[], float] = time.monotonic):
+        self.strong_model_id = strong_model_id
+        self.fast_model_id = fast_model_id or None
+        self.token_threshold = token_threshold
+        self.latency_budget_ms = latency_budget_ms
+        self.recovery_seconds = recovery_seconds
+        self.smoothing = smoothing
+        self.clock = clock
+        self.latency_ms: Dict[str, float] = {}
+        self.degraded_until = 0.0
+
+    def select(self, prompt: str):
+        """Returns (model_id, reason) for a prompt."""
+        if self.fast_model_id is None:
+            return self.strong_model_id, 'default'
+        if estimate_tokens(prompt) <= self.token_threshold:
+            return self.fast_model_id, 'small_payload'
+        if self.clock() < self.degraded_until:
+            return self.fast_model_id, 'latency_budget'
+        return self.strong_model_id, 'large_payload'
+
+    def observe(self, model_id: str, total_ms: float) -> None:
+        """Records the total latency of a call, degrading the strong model if it is over budget."""
+        previous = self.latency_ms.get(model_id)
+        self.latency_ms[model_id] = total_ms if previous is None else (
+            self.smoothing * total_ms + (1 - self.smoothing) * previous)
+        if (self.latency_budget_ms and model_id == self.strong_model_id
+                and self.latency_ms[model_id] > self.latency_budget_ms):
+            self.degraded_until = self.clock() + self.recovery_seconds
+
+
+class ModelInvoker:
+    """
+    Invokes Anthropic models on Bedrock in the configured request format, streaming
+    the response by default, and logs time to first token, total time and the token
+    counts Bedrock reports per call.
+    """
+
+    def __init__(self, request_format: str = 'messages', streaming: bool = True, max_tokens: int = 1000,
+                 temperature: float = 0.5, router: Optional[ModelRouter] = None):
+        if request_format not in REQUEST_FORMATS:
+            raise ValueError(f'Unknown model request format {request_format}, expected one of {REQUEST_FORMATS}')
+        self.request_format = request_format
+        self.streaming = streaming
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.router = router
+
+    def stream(self, model_id: str, prompt: str, route: str = 'default', max_tokens: Optional[int] = None) -> Iterator[str]:
+        """
+        Yields the generated text as it arrives, so callers can start consuming the
+        report before the model has finished. Timing is logged once the stream ends.
+
+        :param max_tokens: Caps this call's output below the invoker's max_tokens.
+        """
+        max_tokens = max_tokens or self.max_tokens
+        body = json.dumps(build_request(self.request_format, prompt, max_tokens, self.temperature))
+        bedrock_runtime = get_client('bedrock-runtime')
+        started = time.perf_counter()
+        first_token_ms = None
+        output_chars = 0
+        input_tokens = output_tokens = None
+
+        if self.streaming:
+            response = throttling.call('bedrock-runtime', bedrock_runtime.invoke_model_with_response_stream,
+                                       bucket=model_id, modelId=model_id, body=body)
+            for event in response['body']:
+                if 'chunk' not in event:
+                    continue
+                chunk = json.loads(event['chunk']['bytes'])
+                chunk_input_tokens, chunk_output_tokens = chunk_tokens(chunk)
+                input_tokens = input_tokens if chunk_input_tokens is None else chunk_input_tokens
+                output_tokens = output_tokens if chunk_output_tokens is None else chunk_output_tokens
+                text = chunk_text(self.request_format, chunk)
+                if text:
+                    if first_token_ms is None:
+                        first_token_ms = (time.perf_counter() - started) * 1000
+                    output_chars += len(text)
+                    yield text
+        else:
+            response = throttling.call('bedrock-runtime', bedrock_runtime.invoke_model,
+                                       bucket=model_id, modelId=model_id, body=body)
+            response_body = json.loads(response['body'].read())
+            input_tokens, output_tokens = response_tokens(response, response_body)
+            text = response_text(self.request_format, response_body)
+            first_token_ms = (time.perf_counter() - started) * 1000
+            output_chars = len(text)
+            yield text
+
+        total_ms = (time.perf_counter() - started) * 1000
+        if self.router is not None:
+            self.router.observe(model_id, total_ms)
+        model_metrics = {
+            'ModelTotalMs': (round(total_ms, 1), metrics.MILLISECONDS),
+            # Bedrock's counts, estimated only when a response carries none
+            'ModelInputTokens': (estimate_tokens(prompt) if input_tokens is None else int(input_tokens), metrics.COUNT),
+            'ModelOutputTokens': (output_chars // 4 if output_tokens is None else int(output_tokens), metrics.COUNT),
+        }
+        if first_token_ms is not None:
+            model_metrics['ModelTimeToFirstTokenMs'] = (round(first_token_ms, 1), metrics.MILLISECONDS)
+        metrics.emit(model_metrics, dimensions={'ModelId': model_id},
+                     properties={'route': route, 'requestFormat': self.request_format, 'streaming': self.streaming,
+                                 'maxTokens': max_tokens})
+
+    def invoke(self, model_id: str, prompt: str, route: str = 'default', max_tokens: Optional[int] = None) -> str:
+        return ''.join(self.stream(model_id, prompt, route, max_tokens))
+
+
+def invoker_from_environment() -> ModelInvoker:
+    """
+    Builds the invoker from MODEL_REQUEST_FORMAT (messages), MODEL_STREAMING (true),
+    MODEL_MAX_TOKENS (1000) and the router settings: MODELID is the strong model,
+    FAST_MODELID (optional) the fast one, ROUTING_TOKEN_THRESHOLD (2000) the largest
+    payload sent to the fast model, MODEL_LATENCY_BUDGET_MS (0, off) the strong
+    model latency above which large payloads fall back to the fast model, and
+    MODEL_RECOVERY_SECONDS (300) how long that fallback lasts.
+    """
+    router = ModelRouter(os.environ['MODELID'],
+                         fast_model_id=os.environ.get('FAST_MODELID'),
+                         token_threshold=int(os.environ.get('ROUTING_TOKEN_THRESHOLD', '2000')),
+                         latency_budget_ms=float(os.environ.get('MODEL_LATENCY_BUDGET_MS', '0')),
+                         recovery_seconds=float(os.environ.get('MODEL_RECOVERY_SECONDS', '300')))
+    return ModelInvoker(request_format=os.environ.get('MODEL_REQUEST_FORMAT', 'messages'),
+                        streaming=os.environ.get('MODEL_STREAMING', 'true').lower() == 'true',
+                        max_tokens=int(os.environ.get('MODEL_MAX_TOKENS', '1000')),
+                        router=router)
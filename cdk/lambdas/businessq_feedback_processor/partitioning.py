@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Optional
+
+# Feedback records are stored by submission time (UTC) under their Q Business application:
+#   <glue_database>/feedback/application_id=<id>/year=YYYY/month=MM/day=DD/hour=HH/<messageId>.json
+# so Athena and the digest only read the applications and hours a query asks for.
+APPLICATION_PARTITION = 'application_id'
+
+# Formats seen for messageUsefulness.submittedAt in CloudTrail PutFeedback events
+SUBMITTED_AT_FORMATS = ['%b %d, %Y, %I:%M:%S %p', '%Y-%m-%dT%H:%M:%S.%fZ', '%Y-%m-%dT%H:%M:%SZ']
+
+
+def parse_submitted_at(value) -> Optional[datetime]:
+    """Parses a PutFeedback submittedAt value into a UTC datetime, None if unparseable."""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, tz=timezone.utc)
+    try:
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        return parsed.astimezone(timezone.utc) if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+    except ValueError:
+        pass
+    for fmt in SUBMITTED_AT_FORMATS:
+        try:
+            return datetime.strptime(str(value), fmt).replace(tzinfo=timezone.utc)
+        except ValueError:
+            continue
+    return None
+
+
+def application_prefix(root: str, application_id: str) -> str:
+    return f'{root}/{APPLICATION_PARTITION}={application_id}/'
+
+
+def day_prefix(root: str, application_id: str, day: datetime) -> str:
+    return application_prefix(root, application_id) + f'year={day.year}/month={day:%m}/day={day:%d}/'
+
+
+def hour_prefix(root: str, application_id: str, hour: datetime) -> str:
+    return day_prefix(root, application_id, hour) + f'hour={hour:%H}/'
+
+
+def feedback_key(glue_database_name: str, record: Dict[str, Any], now: Optional[datetime] = None) -> str:
+    """
+    S3 key of a feedback record, partitioned by its submittedAt hour in UTC. An
+    unparseable submittedAt falls back to the processing time.
+    """
+    submitted = parse_submitted_at(record.get('submittedAt')) or now or datetime.now(timezone.utc)
+    return hour_prefix(f'{glue_database_name}/feedback', record.get('applicationId'), submitted) + f"{record['messageId']}.json"
+
+
+def list_applications(s3, bucket: str, root: str) -> List[str]:
+    """The application ids that have an application_id= partition under root."""
+    applications = []
+    marker = f'{root}/{APPLICATION_PARTITION}='
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=marker, Delimiter='/'):
+        for prefix in page.get('CommonPrefixes', []):
+            applications.append(prefix['Prefix'][len(marker):].rstrip('/'))
+    return applications
+
+
+def window_prefixes(root: str, application_id: str, start: datetime, end: datetime) -> Iterator[str]:
+    """
+    Prefixes covering the submission hours in [start, end): a day prefix for each
+    whole UTC day, hour prefixes for the partial days at either end.
+    """
+    hour = start.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    end = end.astimezone(timezone.utc)
+    while hour < end:
+        if hour.hour == 0 and hour + timedelta(days=1) <= end:
+            yield day_prefix(root, application_id, hour)
+            hour += timedelta(days=1)
+        else:
+            yield hour_prefix(root, application_id, hour)
+            hour += timedelta(hours=1)
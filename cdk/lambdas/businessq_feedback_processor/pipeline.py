@@ -0,0 +1,106 @@
+import contextvars
+import functools
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import metrics
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+StageResult = namedtuple('StageResult', ['name', 'value', 'error', 'seconds', 'skipped'])
+
+# shared by warm invocations and concurrent run_stages calls; a stage is only submitted
+# once its dependencies have finished, so no worker sits waiting on another stage
+executor = ThreadPoolExecutor(max_workers=int(os.environ.get('PIPELINE_MAX_WORKERS', '4')),
+                              thread_name_prefix='feedback-stage')
+
+
+class StageFailure(Exception):
+    """Raised once every stage has finished, if any of them failed; stage_results holds all of them."""
+
+    def __init__(self, results: List[StageResult], stage_results: Optional[Dict[str, StageResult]] = None):
+        self.results = results
+        self.stage_results = stage_results or {}
+        super().__init__(', '.join(f'{result.name}: {result.error!r}' for result in results))
+
+
+def run_stage(name: str, function: Callable[..., Any], inputs: Sequence[StageResult]) -> StageResult:
+    started = time.perf_counter()
+    try:
+        value = function(*[result.value for result in inputs])
+        return StageResult(name, value, None, time.perf_counter() - started, False)
+    except Exception as e:
+        logger.exception(f'Feedback stage {name} failed')
+        return StageResult(name, None, e, time.perf_counter() - started, False)
+
+
+def when_done(futures: Sequence[Future], callback: Callable[[], None]) -> None:
+    """Calls callback once every future is done, right away when there are none."""
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def done(_):
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            callback()
+
+    if not futures:
+        callback()
+    for future in futures:
+        future.add_done_callback(done)
+
+
+def submit_stage(pool, result: Future, name: str, function: Callable[..., Any], dependencies: Sequence[Future],
+                 context: contextvars.Context) -> None:
+    """Runs a stage whose dependencies are done on the pool, or skips it if one of them failed or was skipped."""
+    inputs = [dependency.result() for dependency in dependencies]
+    if any(dependency.error is not None or dependency.skipped for dependency in inputs):
+        result.set_result(StageResult(name, None, None, 0.0, True))
+        return
+    future = pool.submit(context.run, run_stage, name, function, inputs)
+    future.add_done_callback(lambda future: result.set_result(future.result()))
+
+
+def run_stages(stages: Iterable[Tuple[str, Callable[..., Any], Sequence[str]]], pool=None) -> Dict[str, StageResult]:
+    """
+    Runs the post-lookup stages of the feedback pipeline concurrently.
+
+    Each stage is (name, function, dependency names). A stage starts as soon as its
+    dependencies have finished and receives their return values as arguments. A
+    failing stage only skips the stages that depend on it; the rest still run, and
+    StageFailure is raised after all of them are done.
+
+    :return: StageResult per stage name, including its wall time in seconds.
+    """
+    pool = pool or executor
+    futures: Dict[str, Future] = {}
+    for name, function, dependencies in stages:
+        futures[name] = Future()
+        dependency_futures = [futures[dependency] for dependency in dependencies]
+        # each stage runs in a copy of the caller's context, e.g. its applications.application_scope
+        when_done(dependency_futures, functools.partial(submit_stage, pool, futures[name], name, function,
+                                                        dependency_futures, contextvars.copy_context()))
+
+    results = {name: future.result() for name, future in futures.items()}
+
+    # one timer per stage that ran, e.g. PersistMs (S3 put), RecommendMs, EmailMs (SES send)
+    failed = [result for result in results.values() if result.error is not None]
+    stage_metrics = {f'{name.title()}Ms': (round(result.seconds * 1000, 1), metrics.MILLISECONDS)
+                     for name, result in results.items() if not result.skipped}
+    stage_metrics['StageFailures'] = (len(failed), metrics.COUNT)
+    metrics.emit(stage_metrics, properties={
+        'failedStages': [result.name for result in failed],
+        'skippedStages': [name for name, result in results.items() if result.skipped],
+    })
+
+    if failed:
+        raise StageFailure(failed, results)
+    return results
@@ -0,0 +1,139 @@
+import json
+import os
+import re
+from typing import Any, Dict, List, Optional
+
+import metrics
+from models import estimate_tokens
+
+TRUNCATION_MARK = ' ...'
+
+
+def terms(text) -> set:
+    return set(re.findall(r'\w{3,}', str(text or '').casefold()))
+
+
+def truncate(text: str, max_chars: int) -> str:
+    """Cuts text to at most max_chars, on a word boundary when there is one."""
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max(0, max_chars - len(TRUNCATION_MARK))]
+    if ' ' in cut:
+        cut = cut.rsplit(' ', 1)[0]
+    return cut + TRUNCATION_MARK
+
+
+def dedupe_attributions(attributions: Optional[List[Dict[str, Any]]], snippet_chars: int) -> List[Dict[str, Any]]:
+    """
+    Merges citations of the same source: one entry per URL (or title when there is
+    no URL) with its citation numbers and the distinct snippets cited from it, cut
+    to snippet_chars. Other attribution fields (textMessageSegments, updatedAt) are
+    dropped.
+    """
+    merged: Dict[str, Dict[str, Any]] = {}
+    for attribution in attributions or []:
+        if not isinstance(attribution, dict):
+            continue
+        source = attribution.get('url') or attribution.get('title') or ''
+        entry = merged.setdefault(source, {
+            'title': attribution.get('title'), 'url': attribution.get('url'), 'citations': [], 'snippets': []})
+        if attribution.get('citationNumber') is not None:
+            entry['citations'].append(attribution['citationNumber'])
+        # only the part of the snippet that can survive truncation is normalized
+        snippet = truncate(' '.join(str(attribution.get('snippet') or '')[:2 * snippet_chars].split()), snippet_chars)
+        if snippet and snippet not in entry['snippets']:
+            entry['snippets'].append(snippet)
+    return list(merged.values())
+
+
+def rank_attributions(attributions: List[Dict[str, Any]], query, comment) -> List[Dict[str, Any]]:
+    """
+    Orders sources by how many query and comment terms their title and snippets
+    share, then by first citation number, so truncation drops the least relevant.
+    """
+    wanted = terms(query) | terms(comment)
+
+    def score(entry):
+        overlap = len(wanted & terms(' '.join([entry.get('title') or ''] + entry['snippets'])))
+        first_citation = min(entry['citations']) if entry['citations'] else float('inf')
+        return -overlap, first_citation
+
+    return sorted(attributions, key=score)
+
+
+class PromptBuilder:
+    """
+    Builds the model input for a feedback record within a token budget.
+
+    Duplicate citations and the source_attribution_urls list (the same URLs as the
+    attributions) are removed, snippets are cut to snippet_chars and sources are
+    ranked by relevance to the query and comment. While the estimate is over budget_tokens,
+    snippets of the least relevant sources are dropped, then the AI message is cut.
+    """
+
+    def __init__(self, budget_tokens: int = 3000, snippet_chars: int = 600, min_message_chars: int = 1000):
+        self.budget_tokens = budget_tokens
+        self.snippet_chars = snippet_chars
+        self.min_message_chars = min_message_chars
+
+    def build(self, record: Dict[str, Any], exclude_fields=()) -> str:
+        """
+        :param record: The feedback record as persisted to S3.
+        :param exclude_fields: Record fields to leave out of the model input.
+        :return: The model input as a JSON string.
+        """
+        context = {field: value for field, value in record.items()
+                   if field not in exclude_fields and field not in ('sourceAttribution', 'source_attribution_urls')}
+        original_tokens = estimate_tokens(json.dumps({field: value for field, value in record.items()
+                                                      if field not in exclude_fields}, default=str))
+
+        sources = rank_attributions(dedupe_attributions(record.get('sourceAttribution'), self.snippet_chars),
+                                    record.get('query'), record.get('usefulness_comment'))
+        cited_urls = {source['url'] for source in sources if source['url']}
+        uncited_urls = list(dict.fromkeys(url for url in record.get('source_attribution_urls') or []
+                                          if url not in cited_urls))
+
+        def render():
+            rendered = dict(context, sources=[{field: value for field, value in source.items() if value}
+                                              for source in sources])
+            if uncited_urls:
+                rendered['source_attribution_urls'] = uncited_urls
+            return json.dumps(rendered, default=str)
+
+        prompt_context = render()
+        dropped_snippets = 0
+        # drop snippets from the least relevant source first, keeping its title and url;
+        # the length is tracked per dropped snippet instead of re-rendering each time
+        length = len(prompt_context)
+        for source in reversed(sources):
+            while source['snippets'] and length // 4 > self.budget_tokens:
+                length -= len(json.dumps(source['snippets'].pop())) + 2
+                dropped_snippets += 1
+        if dropped_snippets:
+            prompt_context = render()
+
+        message = context.get('message')
+        if isinstance(message, str) and estimate_tokens(prompt_context) > self.budget_tokens:
+            excess_chars = (estimate_tokens(prompt_context) - self.budget_tokens) * 4
+            context['message'] = truncate(message, max(self.min_message_chars, len(message) - excess_chars))
+            prompt_context = render()
+
+        tokens = estimate_tokens(prompt_context)
+        metrics.emit({
+            'PromptTokens': (tokens, metrics.COUNT),
+            'PromptTokensSaved': (original_tokens - tokens, metrics.COUNT),
+            'PromptSnippetsDropped': (dropped_snippets, metrics.COUNT),
+        }, properties={
+            'budgetTokens': self.budget_tokens,
+            'attributions': len(record.get('sourceAttribution') or []),
+            'sources': len(sources),
+            'messageTruncated': context.get('message') != message,
+            'overBudget': tokens > self.budget_tokens,
+        })
+        return prompt_context
+
+
+def builder_from_environment() -> PromptBuilder:
+    """Reads PROMPT_TOKEN_BUDGET (3000) and PROMPT_SNIPPET_CHARS (600)."""
+    return PromptBuilder(budget_tokens=int(os.environ.get('PROMPT_TOKEN_BUDGET', '3000')),
+                         snippet_chars=int(os.environ.get('PROMPT_SNIPPET_CHARS', '600')))
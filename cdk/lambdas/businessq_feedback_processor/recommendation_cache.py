@@ -0,0 +1,205 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+import metrics
+from clients import get_client
+from models import estimate_tokens
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+def normalize(text) -> str:
+    return re.sub(r'\s+', ' ', str(text or '')).strip().casefold()
+
+
+def recommendation_key(model_id: str, prompt: str, record: Dict[str, Any]) -> str:
+    """
+    Content hash of everything the model sees for a feedback record: the model and
+    prompt, the query, the AI message, the comment and the cited source URLs. Who
+    gave the feedback and when is left out, so the same canned answer thumbed down
+    by many users maps to one cache entry.
+    """
+    payload = {
+        'model_id': model_id,
+        'prompt': normalize(prompt),
+        'query': normalize(record.get('query')),
+        'message': normalize(record.get('message')),
+        'comment': normalize(record.get('usefulness_comment')),
+        'usefulness': record.get('usefulness'),
+        'urls': sorted(set(record.get('source_attribution_urls') or [])),
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class LRUCacheBackend:
+    """
+    In-process cache that survives across warm invocations of one Lambda container.
+    Pipeline stage threads and backfill workers share it, so every access holds the lock.
+    """
+
+    def __init__(self, max_entries: int = 256, clock: Callable[[], float] = time.time):
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry['expiresAt'] <= self.clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class DynamoDBCacheBackend:
+    """
+    Cache shared by all Lambda instances. Items carry an expiresAt attribute used
+    as the table's TTL; expiry is also checked on read since TTL deletion is lazy.
+    """
+
+    def __init__(self, table_name: str, client=None, clock: Callable[[], float] = time.time):
+        self.table_name = table_name
+        self._client = client
+        self.clock = clock
+
+    @property
+    def client(self):
+        return self._client or get_client('dynamodb')
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        item = self.client.get_item(TableName=self.table_name, Key={'cacheKey': {'S': key}}).get('Item')
+        if item is None or float(item['expiresAt']['N']) <= self.clock():
+            return None
+        return {
+            'recommendation': item['recommendation']['S'],
+            'latencyMs': float(item['latencyMs']['N']),
+            'expiresAt': float(item['expiresAt']['N']),
+        }
+
+    def put(self, key: str, entry: Dict[str, Any]) -> None:
+        self.client.put_item(TableName=self.table_name, Item={
+            'cacheKey': {'S': key},
+            'recommendation': {'S': entry['recommendation']},
+            'latencyMs': {'N': str(round(entry['latencyMs'], 1))},
+            'expiresAt': {'N': str(int(entry['expiresAt']))},
+        })
+
+
+class TieredCacheBackend:
+    """Checks the in-process cache first and fills it from the shared cache on a hit."""
+
+    def __init__(self, local, shared):
+        self.local = local
+        self.shared = shared
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self.local.get(key)
+        if entry is None:
+            entry = self.shared.get(key)
+            if entry is not None:
+                self.local.put(key, entry)
+        return entry
+
+    def put(self, key: str, entry: Dict[str, Any]) -> None:
+        self.local.put(key, entry)
+        self.shared.put(key, entry)
+
+
+class RecommendationCache:
+    """Caches model recommendations by content hash and logs hit/miss metrics."""
+
+    def __init__(self, backend, ttl_seconds: int = 86400, clock: Callable[[], float] = time.time):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str, prompt_context: str = '') -> Optional[str]:
+        """
+        Returns the cached recommendation for key, None on a miss.
+
+        :param prompt_context: The model input, used to estimate the tokens a hit saves.
+        """
+        entry = None
+        try:
+            entry = self.backend.get(key)
+        except Exception:
+            # a cache outage must not stop the report
+            logger.exception('Recommendation cache read failed')
+
+        if entry is None:
+            self.misses += 1
+            self.log_metrics(False, 0, 0)
+            return None
+
+        self.hits += 1
+        self.log_metrics(True, estimate_tokens(prompt_context) + estimate_tokens(entry['recommendation']),
+                         entry['latencyMs'])
+        return entry['recommendation']
+
+    def put(self, key: str, recommendation: str, latency_ms: float) -> None:
+        """Caches a recommendation the model took latency_ms to write."""
+        try:
+            self.backend.put(key, {'recommendation': recommendation, 'latencyMs': latency_ms,
+                                   'expiresAt': self.clock() + self.ttl_seconds})
+        except Exception:
+            logger.exception('Recommendation cache write failed')
+
+    def get_or_invoke(self, key: str, invoke: Callable[[], str], prompt_context: str = '') -> str:
+        """
+        Returns the cached recommendation for key, or calls invoke() and caches its result.
+
+        :param prompt_context: The model input, used to estimate the tokens a hit saves.
+        """
+        recommendation = self.get(key, prompt_context)
+        if recommendation is None:
+            started = time.perf_counter()
+            recommendation = invoke()
+            self.put(key, recommendation, (time.perf_counter() - started) * 1000)
+        return recommendation
+
+    def log_metrics(self, hit: bool, tokens_saved: int, latency_saved_ms: float) -> None:
+        metrics.emit({
+            'RecommendationCacheHits': (int(hit), metrics.COUNT),
+            'RecommendationCacheMisses': (int(not hit), metrics.COUNT),
+            'EstimatedTokensSaved': (tokens_saved, metrics.COUNT),
+            'LatencySavedMs': (round(latency_saved_ms, 1), metrics.MILLISECONDS),
+        }, properties={'containerCacheHits': self.hits, 'containerCacheMisses': self.misses})
+
+
+def cache_from_environment() -> Optional[RecommendationCache]:
+    """
+    Builds the cache selected by RECOMMENDATION_CACHE: "memory" (default) for a
+    per-container LRU, "dynamodb" for an LRU in front of the shared
+    RECOMMENDATION_CACHE_TABLE, or "off".
+    """
+    mode = os.environ.get('RECOMMENDATION_CACHE', 'memory')
+    if mode == 'off':
+        return None
+
+    ttl_seconds = int(os.environ.get('RECOMMENDATION_CACHE_TTL_SECONDS', '86400'))
+    backend = LRUCacheBackend(int(os.environ.get('RECOMMENDATION_CACHE_MAX_ENTRIES', '256')))
+    if mode == 'dynamodb':
+        backend = TieredCacheBackend(backend, DynamoDBCacheBackend(os.environ.get('RECOMMENDATION_CACHE_TABLE')))
+
+    return RecommendationCache(backend, ttl_seconds)
@@ -0,0 +1,71 @@
+import os
+import threading
+from typing import Any, Dict, Iterable, Tuple, Union
+
+from prompt_builder import dedupe_attributions
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+TEXT_TEMPLATE = 'feedback_report.txt.j2'
+HTML_TEMPLATE = 'feedback_report.html.j2'
+
+# built on first render, so jinja2 stays out of the module import
+_environment = None
+_lock = threading.Lock()
+
+
+def get_environment():
+    global _environment
+    if _environment is None:
+        with _lock:
+            if _environment is None:
+                from jinja2 import Environment, FileSystemLoader, StrictUndefined, select_autoescape
+
+                _environment = Environment(loader=FileSystemLoader(TEMPLATE_DIR),
+                                           autoescape=select_autoescape(['html.j2']),
+                                           undefined=StrictUndefined, trim_blocks=True, lstrip_blocks=True)
+    return _environment
+
+
+class StreamedText:
+    """
+    Template value of text that may still be streaming. It is read to the end only
+    where a template renders it, so everything before it renders while the model
+    is still writing.
+    """
+
+    def __init__(self, chunks: Union[str, Iterable[str]]):
+        self.chunks = chunks
+
+    def __str__(self):
+        return (self.chunks if isinstance(self.chunks, str) else ''.join(self.chunks)).strip()
+
+
+def report_context(record: Dict[str, Any], recommendations: Union[str, Iterable[str]],
+                   snippet_chars: int = 600) -> Dict[str, Any]:
+    """The template variables for a feedback record, with its citations merged per source."""
+    return {
+        'userId': record.get('userId'),
+        'submittedAt': record.get('submittedAt'),
+        'usefulness': record.get('usefulness'),
+        'usefulness_comment': record.get('usefulness_comment'),
+        'query': record.get('query') or '',
+        'message': record.get('message') or '',
+        'sources': dedupe_attributions(record.get('sourceAttribution'), snippet_chars),
+        'recommendations': StreamedText(recommendations or ''),
+    }
+
+
+def render_report(record: Dict[str, Any], recommendations: Union[str, Iterable[str]],
+                  snippet_chars: int = 600) -> Tuple[str, str]:
+    """
+    Renders the report email for a feedback record: the user details, query,
+    message and sources straight from the record, followed by the model's
+    recommendations. recommendations may be the model's stream (a
+    reporting.ReportStream), which is only read once the text body reaches it.
+
+    :return: The text and HTML bodies.
+    """
+    context = report_context(record, recommendations, snippet_chars)
+    environment = get_environment()
+    return (environment.get_template(TEXT_TEMPLATE).render(context),
+            environment.get_template(HTML_TEMPLATE).render(context))
@@ -0,0 +1,150 @@
+import logging
+import os
+import time
+from botocore.exceptions import ClientError
+
+import throttling
+from clients import get_client
+from models import invoker_from_environment
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+# built on first use, so MODELID is only required once a report is generated
+_invoker = None
+
+
+def get_invoker():
+    global _invoker
+    if _invoker is None:
+        _invoker = invoker_from_environment()
+    return _invoker
+
+
+def enclose_prompt(prompt_context, prompt):
+    return "<context>" + prompt_context + "</context>\n\n" + prompt
+
+
+def select_model(prompt_context, prompt):
+    """
+    Routes a report prompt by size: the fast model (FAST_MODELID) for small
+    payloads, the configured MODELID for large ones.
+
+    :return: The model id and the routing reason.
+    """
+    return get_invoker().router.select(enclose_prompt(prompt_context, prompt))
+
+
+def stream_claude(model_id, prompt_context, prompt, route='default', max_tokens=None):
+    """
+    Invokes an Anthropic Claude model on Bedrock with the feedback context and
+    yields the report text as the model streams it.
+
+    :param model_id: The Bedrock model id to invoke.
+    :param prompt: The instructions that follow the context.
+    :param max_tokens: Output token cap for this call, MODEL_MAX_TOKENS by default.
+    """
+    try:
+        yield from get_invoker().stream(model_id, enclose_prompt(prompt_context, prompt), route, max_tokens)
+
+    except ClientError:
+        logger.error(f"Couldn't invoke Anthropic Claude model {model_id}")
+        raise
+
+
+class ReportStream:
+    """
+    A model report as it streams, for one consumer at a time. start() waits for the
+    first chunk, so a failed call fails the stage that started it; iterating yields
+    the chunks as they arrive, replaying the ones already read, and str() is the
+    whole text. on_complete is called with the text and the seconds the model took
+    once the stream ends.
+    """
+
+    def __init__(self, chunks, on_complete=None):
+        self._chunks = iter(chunks)
+        self._read = []
+        self._done = False
+        self._started = time.perf_counter()
+        self.on_complete = on_complete
+
+    def _next_chunk(self):
+        try:
+            chunk = next(self._chunks)
+        except StopIteration:
+            self._done = True
+            if self.on_complete is not None:
+                self.on_complete(''.join(self._read), time.perf_counter() - self._started)
+            return None
+        self._read.append(chunk)
+        return chunk
+
+    def start(self):
+        if not self._read and not self._done:
+            self._next_chunk()
+        return self
+
+    def __iter__(self):
+        position = 0
+        while True:
+            if position < len(self._read):
+                chunk = self._read[position]
+            elif self._done or self._next_chunk() is None:
+                return
+            else:
+                chunk = self._read[position]
+            position += 1
+            yield chunk
+
+    def __str__(self):
+        return ''.join(self)
+
+
+def invoke_claude(model_id, prompt_context, prompt, route='default', max_tokens=None):
+    """
+    Invokes an Anthropic Claude model on Bedrock to run an inference using the
+    input provided in the request body.
+
+    :param model_id: The Bedrock model id to invoke.
+    :param prompt: The instructions that follow the context.
+    :return: Inference response from the model.
+    """
+    return ''.join(stream_claude(model_id, prompt_context, prompt, route, max_tokens))
+
+
+def route_claude(prompt_context, prompt):
+    """Invokes the model select_model picks for the prompt."""
+    model_id, route = select_model(prompt_context, prompt)
+    return invoke_claude(model_id, prompt_context, prompt, route)
+
+def send_email(report_response, subject='Business Q Feedback Report', max_wait_seconds=None, html=None):
+    """
+    Sends a report email within the SES send rate.
+
+    :param max_wait_seconds: How long to wait for the rate limiter before giving up
+                             with throttling.RateLimitTimeout.
+    :param html: An HTML body sent alongside the text one.
+    """
+    body = {'Text': {'Data': report_response, 'Charset': 'UTF-8'}}
+    if html:
+        body['Html'] = {'Data': html, 'Charset': 'UTF-8'}
+
+    from_address = os.environ['FROM_ADDRESS']
+    to_address = os.environ['TO_ADDRESS']
+    
+    response = throttling.call(
+        'ses', get_client('ses').send_email, max_wait_seconds=max_wait_seconds,
+        Source=from_address,
+        Destination={
+            'ToAddresses': [to_address]
+        },
+        Message={
+            'Subject': {
+                'Data': subject
+            },
+            'Body': body
+        }
+    )
+    
+    return("Email sent with message ID: " + response['MessageId'])
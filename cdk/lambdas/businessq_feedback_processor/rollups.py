@@ -0,0 +1,217 @@
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Tuple
+
+from clients import get_client
+from feedback_sink import is_feedback_object, read_records
+from partitioning import parse_submitted_at
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Rollup rows are (rollup, key) with a count per usefulness value plus a total:
+#   day#<applicationId>, <YYYY-MM-DD>   feedback per UTC submission day and application
+#   source, <url>                       feedback citing a source URL (each URL once per record)
+#   user, <userId>                      feedback per user
+# A dashboard reads one rollup with a single Query, e.g. the days of an application.
+TOTAL = 'total'
+
+RowKey = Tuple[str, str]
+
+
+def rollup_keys(record: Dict[str, Any]) -> List[RowKey]:
+    """The rollup rows a feedback record counts towards."""
+    submitted = parse_submitted_at(record.get('submittedAt'))
+    keys = [(f"day#{record.get('applicationId')}", f'{submitted:%Y-%m-%d}' if submitted else 'unknown')]
+    keys += [('source', url) for url in sorted(set(record.get('source_attribution_urls') or []))]
+    keys.append(('user', str(record.get('userId'))))
+    return keys
+
+
+def compute_rollups(records: Iterable[Dict[str, Any]]) -> Dict[RowKey, Counter]:
+    """Full recomputation of every rollup row from the feedback records."""
+    rollups: Dict[RowKey, Counter] = {}
+    for record in records:
+        for key in rollup_keys(record):
+            counts = rollups.setdefault(key, Counter())
+            counts[record.get('usefulness') or 'UNKNOWN'] += 1
+            counts[TOTAL] += 1
+    return rollups
+
+
+class DynamoDBRollupStore:
+    """
+    Rollup rows in a DynamoDB table keyed by rollup (partition) and key (sort).
+    Counts are incremented atomically with ADD, so concurrent Lambdas never lose
+    an update.
+    """
+
+    def __init__(self, table_name: str, client=None):
+        self.table_name = table_name
+        self._client = client
+
+    @property
+    def client(self):
+        return self._client or get_client('dynamodb')
+
+    def increment(self, key: RowKey, usefulness: str, count: int = 1) -> None:
+        self.client.update_item(
+            TableName=self.table_name,
+            Key={'rollup': {'S': key[0]}, 'key': {'S': key[1]}},
+            UpdateExpression='ADD #total :count, #usefulness :count',
+            ExpressionAttributeNames={'#total': TOTAL, '#usefulness': usefulness},
+            ExpressionAttributeValues={':count': {'N': str(count)}})
+
+    def query(self, rollup: str) -> Dict[str, Counter]:
+        rows = {}
+        for page in self.client.get_paginator('query').paginate(
+                TableName=self.table_name, KeyConditionExpression='#rollup = :rollup',
+                ExpressionAttributeNames={'#rollup': 'rollup'}, ExpressionAttributeValues={':rollup': {'S': rollup}}):
+            for item in page['Items']:
+                rows[item['key']['S']] = self.counts(item)
+        return rows
+
+    def items(self) -> Dict[RowKey, Counter]:
+        rows = {}
+        for page in self.client.get_paginator('scan').paginate(TableName=self.table_name):
+            for item in page['Items']:
+                rows[(item['rollup']['S'], item['key']['S'])] = self.counts(item)
+        return rows
+
+    @staticmethod
+    def counts(item) -> Counter:
+        return Counter({name: int(value['N']) for name, value in item.items() if 'N' in value})
+
+    def replace(self, rollups: Dict[RowKey, Counter]) -> None:
+        """Overwrites the table with rollups, deleting rows that no longer exist."""
+        stale = set(self.items()) - set(rollups)
+        requests = [{'DeleteRequest': {'Key': {'rollup': {'S': rollup}, 'key': {'S': key}}}} for rollup, key in stale]
+        requests += [{'PutRequest': {'Item': dict(
+            {'rollup': {'S': rollup}, 'key': {'S': key}},
+            **{name: {'N': str(value)} for name, value in counts.items()})}}
+            for (rollup, key), counts in rollups.items()]
+        for start in range(0, len(requests), 25):
+            batch = {self.table_name: requests[start:start + 25]}
+            while batch:
+                batch = self.client.batch_write_item(RequestItems=batch).get('UnprocessedItems') or None
+
+
+class SQLiteRollupStore:
+    """Local stand-in for the DynamoDB store; in memory by default, or backed by a sqlite file."""
+
+    def __init__(self, path: str = ':memory:'):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('CREATE TABLE IF NOT EXISTS rollups '
+                                 '(rollup TEXT, key TEXT, name TEXT, count INTEGER, PRIMARY KEY (rollup, key, name))')
+
+    def increment(self, key: RowKey, usefulness: str, count: int = 1) -> None:
+        with self._lock, self._connection:
+            for name in (TOTAL, usefulness):
+                self._connection.execute(
+                    'INSERT INTO rollups VALUES (?, ?, ?, ?) ON CONFLICT(rollup, key, name) '
+                    'DO UPDATE SET count = count + excluded.count', (key[0], key[1], name, count))
+
+    def query(self, rollup: str) -> Dict[str, Counter]:
+        rows: Dict[str, Counter] = {}
+        with self._lock:
+            for key, name, count in self._connection.execute(
+                    'SELECT key, name, count FROM rollups WHERE rollup = ?', (rollup,)):
+                rows.setdefault(key, Counter())[name] = count
+        return rows
+
+    def items(self) -> Dict[RowKey, Counter]:
+        rows: Dict[RowKey, Counter] = {}
+        with self._lock:
+            for rollup, key, name, count in self._connection.execute('SELECT rollup, key, name, count FROM rollups'):
+                rows.setdefault((rollup, key), Counter())[name] = count
+        return rows
+
+    def replace(self, rollups: Dict[RowKey, Counter]) -> None:
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM rollups')
+            self._connection.executemany('INSERT INTO rollups VALUES (?, ?, ?, ?)', [
+                (rollup, key, name, count) for (rollup, key), counts in rollups.items() for name, count in counts.items()])
+
+
+def apply_record(store, record: Dict[str, Any]) -> None:
+    """Counts one newly persisted feedback record in the rollups."""
+    usefulness = record.get('usefulness') or 'UNKNOWN'
+    for key in rollup_keys(record):
+        store.increment(key, usefulness)
+
+
+def store_from_environment():
+    """
+    Builds the store selected by ROLLUPS: "dynamodb" for the shared ROLLUP_TABLE,
+    "memory" for a per-container sqlite store (local runs), or "off" (default).
+    """
+    mode = os.environ.get('ROLLUPS', 'off')
+    if mode == 'dynamodb':
+        return DynamoDBRollupStore(os.environ.get('ROLLUP_TABLE'))
+    if mode == 'memory':
+        return SQLiteRollupStore(os.environ.get('ROLLUP_SQLITE_PATH', ':memory:'))
+    return None
+
+
+def load_all_records_from_s3(s3, bucket: str, glue_database_name: str, workers: int = 16) -> List[Dict[str, Any]]:
+    """
+    Reads every feedback record under <glue_database>/feedback/, from the JSON object
+    of each record and the gzipped JSON lines objects of the buffered and Firehose sinks.
+    """
+    keys = [item['Key']
+            for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=f'{glue_database_name}/feedback/')
+            for item in page.get('Contents', []) if is_feedback_object(item['Key'])]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return [record for records in pool.map(
+            lambda key: read_records(key, s3.get_object(Bucket=bucket, Key=key)['Body'].read()), keys)
+                for record in records]
+
+
+def lambda_handler(event, context):
+    """Rebuilds the rollup table from every feedback record in S3, e.g. after enabling rollups."""
+    records = load_all_records_from_s3(get_client('s3'), os.environ['S3_DATA_BUCKET'], os.environ['GLUE_DATABASE_NAME'])
+    rollups = compute_rollups(records)
+    DynamoDBRollupStore(os.environ['ROLLUP_TABLE']).replace(rollups)
+
+    stats = {'records': len(records), 'rollup_rows': len(rollups)}
+    logger.info(json.dumps(stats))
+    return {'statusCode': 200, 'body': json.dumps(stats)}
+
+
+def verify(store, records: Iterable[Dict[str, Any]]) -> List[str]:
+    """Differences between the store's rollups and a full recomputation, empty when they match."""
+    expected, actual = compute_rollups(records), store.items()
+    return [f'{key}: expected {dict(expected.get(key, {}))}, stored {dict(actual.get(key, {}))}'
+            for key in sorted(set(expected) | set(actual)) if expected.get(key) != actual.get(key)]
+
+
+if __name__ == '__main__':
+    from digest import load_records_from_directory
+
+    parser = argparse.ArgumentParser(description='Build feedback rollups from a local folder of feedback records.')
+    parser.add_argument('records_dir')
+    parser.add_argument('--sqlite', default=':memory:', help='sqlite file to write the rollups to')
+    parser.add_argument('--verify', action='store_true',
+                        help='apply the records one by one and check the result against a full recomputation')
+    args = parser.parse_args()
+
+    local_records = load_records_from_directory(args.records_dir)
+    local_store = SQLiteRollupStore(args.sqlite)
+    if args.verify:
+        local_store.replace({})
+        for local_record in local_records:
+            apply_record(local_store, local_record)
+        differences = verify(local_store, local_records)
+        print('\n'.join(differences) or f'rollups of {len(local_records)} records match a full recomputation')
+        raise SystemExit(1 if differences else 0)
+
+    local_store.replace(compute_rollups(local_records))
+    for rollup_name in ('user', 'source'):
+        print(rollup_name, json.dumps(local_store.query(rollup_name), indent=2))
@@ -0,0 +1,353 @@
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from botocore.exceptions import ClientError
+
+import metrics
+from applications import application_limits_from_environment, current_application
+from clients import get_client
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# error codes Bedrock, SES and Q Business return when a request is over quota;
+# SES reports its maximum send rate as "Throttling"
+THROTTLE_ERROR_CODES = {'ThrottlingException', 'Throttling', 'TooManyRequestsException', 'RequestLimitExceeded',
+                        'ProvisionedThroughputExceededException', 'SlowDown'}
+
+# a throttle halves the shared rate of a bucket, down to MIN_RATE_SCALE, which then
+# wins back RATE_RECOVERY of the configured rate per second without throttles
+MIN_RATE_SCALE = 1 / 16
+RATE_RECOVERY = 0.1
+
+
+class RateLimitTimeout(Exception):
+    """No token of the bucket became available within the caller's wait budget."""
+
+
+def is_throttled(error: Exception) -> bool:
+    if isinstance(error, RateLimitTimeout):
+        return True
+    return isinstance(error, ClientError) and error.response.get('Error', {}).get('Code') in THROTTLE_ERROR_CODES
+
+
+def refill(tokens: float, updated_at: float, scale: float, rate: float, burst: float, now: float) -> Tuple[float, float]:
+    """The bucket's tokens and rate scale at now, counted at updated_at."""
+    elapsed = max(0.0, now - updated_at)
+    return min(burst, tokens + elapsed * rate * scale), min(1.0, scale + elapsed * RATE_RECOVERY)
+
+
+class DynamoDBTokenBucketStore:
+    """
+    Token buckets shared by every Lambda instance. Each bucket is one item holding
+    its tokens, the time they were counted and the share of the configured rate it
+    currently refills at. Taking a token is a read followed by a write conditioned
+    on the read's updatedAt, so two instances can never spend the same token.
+    """
+
+    def __init__(self, table_name: str, client=None, attempts: int = 3):
+        self.table_name = table_name
+        self._client = client
+        self.attempts = attempts
+
+    @property
+    def client(self):
+        return self._client or get_client('dynamodb')
+
+    def read(self, bucket: str):
+        item = self.client.get_item(TableName=self.table_name, Key={'bucket': {'S': bucket}},
+                                    ConsistentRead=True).get('Item')
+        if item is None:
+            return None
+        return float(item['tokens']['N']), item['updatedAt']['N'], float(item['scale']['N'])
+
+    def write(self, bucket: str, tokens: float, now: float, scale: float, seen: Optional[str]) -> bool:
+        request = {
+            'TableName': self.table_name,
+            'Item': {'bucket': {'S': bucket}, 'tokens': {'N': repr(tokens)}, 'updatedAt': {'N': repr(now)},
+                     'scale': {'N': repr(scale)}},
+        }
+        if seen is None:
+            request['ConditionExpression'] = 'attribute_not_exists(#bucket)'
+            request['ExpressionAttributeNames'] = {'#bucket': 'bucket'}
+        else:
+            request['ConditionExpression'] = 'updatedAt = :seen'
+            request['ExpressionAttributeValues'] = {':seen': {'N': seen}}
+        try:
+            self.client.put_item(**request)
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+    def take(self, bucket: str, rate: float, burst: float, now: float) -> float:
+        """Takes one token; returns 0 if it was granted, else the seconds until one refills."""
+        for _ in range(self.attempts):
+            current = self.read(bucket)
+            tokens, seen, scale = (burst, None, 1.0) if current is None else current
+            updated_at = now if seen is None else float(seen)
+            tokens, scale = refill(tokens, updated_at, scale, rate, burst, now)
+            if tokens < 1:
+                return (1 - tokens) / (rate * scale)
+            if self.write(bucket, tokens - 1, max(now, updated_at), scale, seen):
+                return 0.0
+        # lost every race for the item: as busy as an empty bucket
+        return 1 / rate
+
+    def throttled(self, bucket: str, rate: float, burst: float, now: float) -> None:
+        """Halves the bucket's rate and empties it, so every instance backs off."""
+        for _ in range(self.attempts):
+            current = self.read(bucket)
+            tokens, seen, scale = (burst, None, 1.0) if current is None else current
+            updated_at = now if seen is None else float(seen)
+            _, scale = refill(tokens, updated_at, scale, rate, burst, now)
+            if self.write(bucket, 0.0, max(now, updated_at), max(MIN_RATE_SCALE, scale / 2), seen):
+                return
+
+
+class SQLiteTokenBucketStore:
+    """
+    Local stand-in for the DynamoDB store; in memory by default, or backed by a
+    sqlite file that several processes can share like instances share the table.
+    """
+
+    def __init__(self, path: str = ':memory:'):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._connection.execute('CREATE TABLE IF NOT EXISTS buckets '
+                                 '(bucket TEXT PRIMARY KEY, tokens REAL, updated_at REAL, scale REAL)')
+
+    @contextmanager
+    def transaction(self):
+        # IMMEDIATE takes the write lock before the read, so processes sharing the
+        # file cannot both spend the token they read
+        with self._lock:
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield
+                self._connection.execute('COMMIT')
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                raise
+
+    def read(self, bucket: str, burst: float, now: float) -> Tuple[float, float, float]:
+        row = self._connection.execute('SELECT tokens, updated_at, scale FROM buckets WHERE bucket = ?',
+                                       (bucket,)).fetchone()
+        return (burst, now, 1.0) if row is None else row
+
+    def write(self, bucket: str, tokens: float, now: float, scale: float) -> None:
+        self._connection.execute('INSERT OR REPLACE INTO buckets VALUES (?, ?, ?, ?)', (bucket, tokens, now, scale))
+
+    def take(self, bucket: str, rate: float, burst: float, now: float) -> float:
+        with self.transaction():
+            tokens, updated_at, scale = self.read(bucket, burst, now)
+            tokens, scale = refill(tokens, updated_at, scale, rate, burst, now)
+            if tokens < 1:
+                return (1 - tokens) / (rate * scale)
+            self.write(bucket, tokens - 1, max(now, updated_at), scale)
+            return 0.0
+
+    def throttled(self, bucket: str, rate: float, burst: float, now: float) -> None:
+        with self.transaction():
+            tokens, updated_at, scale = self.read(bucket, burst, now)
+            _, scale = refill(tokens, updated_at, scale, rate, burst, now)
+            self.write(bucket, 0.0, max(now, updated_at), max(MIN_RATE_SCALE, scale / 2))
+
+
+class RateLimiter:
+    """
+    Paces calls to each service with a token bucket and retries throttled calls.
+
+    A call first takes a token from its bucket, waiting with jitter while the bucket
+    is empty for at most max_wait_seconds. A throttled call halves the bucket's
+    shared rate, which recovers as tokens are granted again, and is retried after a
+    full-jitter exponential backoff up to max_attempts times. A store outage lets
+    calls through unpaced rather than failing them.
+
+    A call made inside an applications.application_scope whose application has its
+    own limit for the service first takes a token from that application's bucket,
+    so one application's burst waits on its own share instead of draining the
+    shared bucket for the others.
+
+    :param limits: Service name to (requests per second, burst).
+    :param application_limits: Application id to service name to (requests per second, burst).
+    """
+
+    def __init__(self, store, limits: Dict[str, Tuple[float, float]], max_wait_seconds: float = 30,
+                 max_attempts: int = 5, base_delay: float = 0.25, max_delay: float = 20,
+                 clock: Callable[[], float] = time.time, sleep: Callable[[float], None] = time.sleep,
+                 application_limits: Optional[Dict[str, Dict[str, Tuple[float, float]]]] = None):
+        self.store = store
+        self.limits = limits
+        self.application_limits = application_limits or {}
+        self.max_wait_seconds = max_wait_seconds
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.clock = clock
+        self.sleep = sleep
+
+    def acquire(self, service: str, bucket: str, max_wait_seconds: float,
+                limit: Optional[Tuple[float, float]] = None) -> float:
+        """
+        Takes a token of the bucket, waiting for one if needed; returns the seconds waited.
+
+        :param limit: The bucket's (requests per second, burst); the service's by default.
+        """
+        rate, burst = limit or self.limits[service]
+        waited = 0.0
+        while True:
+            try:
+                wait = self.store.take(bucket, rate, burst, self.clock())
+            except Exception:
+                logger.exception(f'Rate limit store failed for {bucket}')
+                metrics.emit({'RateLimiterErrors': (1, metrics.COUNT)}, dimensions={'Api': service})
+                return waited
+            if not wait:
+                return waited
+            if waited + wait > max_wait_seconds:
+                raise RateLimitTimeout(f'No {bucket} token within {max_wait_seconds}s')
+            # jitter spreads the instances that saw the same empty bucket
+            wait *= random.uniform(1.0, 1.5)
+            self.sleep(wait)
+            waited += wait
+
+    def call(self, service: str, function: Callable[..., Any], bucket: Optional[str] = None,
+             max_wait_seconds: Optional[float] = None, **kwargs) -> Any:
+        """
+        Calls function(**kwargs) under the service's rate limit.
+
+        :param bucket: Splits the service into buckets, e.g. one per Bedrock model;
+                       the service name by default.
+        :param max_wait_seconds: Overrides how long the call may wait for a token.
+        """
+        application_id = current_application()
+        application_limit = self.application_limits.get(application_id, {}).get(service)
+        if service not in self.limits and application_limit is None:
+            return function(**kwargs)
+        bucket = f'{service}#{bucket}' if bucket else service
+        max_wait_seconds = self.max_wait_seconds if max_wait_seconds is None else max_wait_seconds
+        waited = backoff = 0.0
+        throttles = 0
+        try:
+            for attempt in range(1, self.max_attempts + 1):
+                if application_limit is not None:
+                    waited += self.acquire(service, f'{bucket}@{application_id}', max_wait_seconds - waited - backoff,
+                                           application_limit)
+                if service in self.limits:
+                    waited += self.acquire(service, bucket, max_wait_seconds - waited - backoff)
+                try:
+                    return function(**kwargs)
+                except ClientError as e:
+                    if not is_throttled(e):
+                        raise
+                    throttles += 1
+                    self.report_throttle(service, bucket)
+                    delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                    if attempt == self.max_attempts or waited + backoff + delay > max_wait_seconds:
+                        raise
+                    self.sleep(delay)
+                    backoff += delay
+        except RateLimitTimeout:
+            metrics.emit({'RateLimitTimeouts': (1, metrics.COUNT)}, dimensions={'Api': service})
+            raise
+        finally:
+            if waited or throttles:
+                metrics.emit({
+                    'Throttles': (throttles, metrics.COUNT),
+                    'RateLimitWaitMs': (round(waited * 1000, 1), metrics.MILLISECONDS),
+                    'ThrottleBackoffMs': (round(backoff * 1000, 1), metrics.MILLISECONDS),
+                }, dimensions={'Api': service}, properties={'bucket': bucket})
+
+    def report_throttle(self, service: str, bucket: str) -> None:
+        if service not in self.limits:
+            return
+        rate, burst = self.limits[service]
+        try:
+            self.store.throttled(bucket, rate, burst, self.clock())
+        except Exception:
+            logger.exception(f'Rate limit store failed to record a throttle of {bucket}')
+
+
+def limits_from_environment() -> Dict[str, Tuple[float, float]]:
+    """
+    Requests per second for Bedrock (BEDROCK_REQUESTS_PER_SECOND, 2, per model), SES
+    (SES_EMAILS_PER_SECOND, 1) and Q Business ListMessages (QBUSINESS_REQUESTS_PER_SECOND,
+    5); each bucket holds RATE_LIMIT_BURST_SECONDS (2) of its rate.
+    """
+    burst_seconds = float(os.environ.get('RATE_LIMIT_BURST_SECONDS', '2'))
+    limits = {}
+    for service, variable, default in (('bedrock-runtime', 'BEDROCK_REQUESTS_PER_SECOND', '2'),
+                                       ('ses', 'SES_EMAILS_PER_SECOND', '1'),
+                                       ('qbusiness', 'QBUSINESS_REQUESTS_PER_SECOND', '5')):
+        rate = float(os.environ.get(variable, default))
+        if rate > 0:
+            limits[service] = (rate, max(1.0, rate * burst_seconds))
+    return limits
+
+
+def limiter_from_environment() -> Optional[RateLimiter]:
+    """
+    Builds the limiter selected by RATE_LIMITING: "dynamodb" for buckets shared in
+    RATE_LIMIT_TABLE, "memory" (default) for per-container sqlite buckets, or "off".
+    APPLICATION_RATE_LIMITS adds per-application buckets in front of the shared ones.
+    """
+    mode = os.environ.get('RATE_LIMITING', 'memory')
+    if mode == 'off':
+        return None
+
+    if mode == 'dynamodb':
+        store = DynamoDBTokenBucketStore(os.environ.get('RATE_LIMIT_TABLE'))
+    else:
+        store = SQLiteTokenBucketStore(os.environ.get('RATE_LIMIT_SQLITE_PATH', ':memory:'))
+
+    return RateLimiter(store, limits_from_environment(),
+                       max_wait_seconds=float(os.environ.get('RATE_LIMIT_MAX_WAIT_SECONDS', '30')),
+                       max_attempts=int(os.environ.get('RATE_LIMIT_MAX_ATTEMPTS', '5')),
+                       application_limits=application_limits_from_environment())
+
+
+# built on first use and shared by every module that calls a rate-limited service
+_limiter = None
+_limiter_built = False
+_limiter_lock = threading.Lock()
+
+
+def get_limiter() -> Optional[RateLimiter]:
+    global _limiter, _limiter_built
+    if not _limiter_built:
+        with _limiter_lock:
+            if not _limiter_built:
+                _limiter = limiter_from_environment()
+                _limiter_built = True
+    return _limiter
+
+
+def set_limiter(limiter: Optional[RateLimiter]) -> None:
+    """Replaces the limiter, e.g. with one over a local store; None turns rate limiting off."""
+    global _limiter, _limiter_built
+    with _limiter_lock:
+        _limiter, _limiter_built = limiter, True
+
+
+def reset_limiter() -> None:
+    """Rebuilds the limiter from the environment on next use."""
+    global _limiter, _limiter_built
+    with _limiter_lock:
+        _limiter, _limiter_built = None, False
+
+
+def call(service: str, function: Callable[..., Any], bucket: Optional[str] = None,
+         max_wait_seconds: Optional[float] = None, **kwargs) -> Any:
+    """Calls function(**kwargs) through the shared limiter, or directly when rate limiting is off."""
+    limiter = get_limiter()
+    if limiter is None:
+        return function(**kwargs)
+    return limiter.call(service, function, bucket=bucket, max_wait_seconds=max_wait_seconds, **kwargs)
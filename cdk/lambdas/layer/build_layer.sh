@@ -5,8 +5,14 @@
 
 set -e
 
+# NumPy (about 40 MB unzipped) is only needed by feedback clustering: ./build_layer.sh --clustering
+requirements="-r requirements.txt"
+if [ "$1" = "--clustering" ]; then
+    requirements="$requirements -r requirements-clustering.txt"
+fi
+
 # 3.11
-docker run -v "$PWD":/var/task "public.ecr.aws/sam/build-python3.11" /bin/sh -c "pip install -r requirements.txt -t python/lib/python3.11/site-packages/; exit"
+docker run -v "$PWD":/var/task "public.ecr.aws/sam/build-python3.11" /bin/sh -c "pip install $requirements -t python/lib/python3.11/site-packages/; exit"
 zip -r boto_python_layer.zip python > /dev/null
 
 sudo rm -rf python
\ No newline at end of file
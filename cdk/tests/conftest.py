@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+CDK_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the benchmark stubs drive the feedback processor locally, for the tests as well
+sys.path.insert(0, os.path.join(CDK_DIR, 'benchmarks'))
+
+import stubs  # noqa: E402
+
+# and the tests import the processor modules directly
+sys.path.insert(0, stubs.PROCESSOR_DIR)
+
+
+@pytest.fixture
+def load_handler():
+    """stubs.load_handler, with the environment, clients and limiter it sets undone after the test."""
+    saved = dict(os.environ)
+    yield stubs.load_handler
+    os.environ.clear()
+    os.environ.update(saved)
+    import clients
+    import throttling
+    clients.reset_clients()
+    throttling.reset_limiter()
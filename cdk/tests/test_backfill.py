@@ -0,0 +1,67 @@
+import gzip
+import io
+import json
+from datetime import datetime, timezone
+
+import stubs
+from test_feedback_sink import written_records
+
+START = datetime(2024, 2, 2, tzinfo=timezone.utc)
+END = datetime(2024, 2, 3, tzinfo=timezone.utc)
+
+
+def log_file(number, events):
+    """A gzipped CloudTrail log file with PutFeedback calls rating messages <number>-0.. ."""
+    records = []
+    for event in range(events):
+        request_parameters = stubs.feedback_event(f'msg-{number}-{event}', conversation_id='conversation-1',
+                                                  user_id=f'user-{number}-{event}')['detail']['requestParameters']
+        records.append({'eventSource': 'qbusiness.amazonaws.com', 'eventName': 'PutFeedback',
+                        'eventTime': f'2024-02-02T1{number}:00:{event:02d}Z', 'eventID': f'event-{number}-{event}',
+                        'requestParameters': request_parameters})
+    return gzip.compress(json.dumps({'Records': records}).encode('utf-8'))
+
+
+class FailingWriter:
+    """Wraps the sink's object writer, failing the first `failures` writes."""
+
+    def __init__(self, writer, failures):
+        self.writer = writer
+        self.failures = failures
+
+    def write(self, key, body):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError('S3 unavailable')
+        self.writer.write(key, body)
+
+
+def test_resumed_backfill_replays_records_a_flush_could_not_write(load_handler, tmp_path):
+    handler = load_handler(FEEDBACK_SINK='buffered', FEEDBACK_SINK_DIRECTORY=tmp_path / 'feedback', IDEMPOTENCY='memory',
+                           LIST_MESSAGES_PAGE_SIZE=100)
+    import backfill
+
+    files = {f'file-{number}': log_file(number, 3) for number in range(2)}
+    conversations = {'conversation-1': [message for number in range(2) for event in range(3) for message in (
+        {'messageId': f'answer-{number}-{event}', 'type': 'SYSTEM', 'body': 'Answer.'},
+        {'messageId': f'msg-{number}-{event}', 'type': 'USER', 'body': 'Question?'})]}
+    stubs.install_clients(qbusiness=stubs.StubQBusiness(conversations))
+    handler.feedback_sink.writer = FailingWriter(handler.feedback_sink.writer, failures=1)
+    checkpoint_path = str(tmp_path / 'checkpoint.json')
+
+    def run():
+        replay = backfill.BufferedReplay(handler, persist_only=True)
+        return backfill.run_backfill(list(files), lambda name: io.BytesIO(files[name]), process=replay.process,
+                                     start=START, end=END, workers=1, checkpoint=backfill.Checkpoint(checkpoint_path),
+                                     flush=replay.flush)
+
+    stats = run()
+    assert stats['failed_flushes'] == 1
+    assert 'file-0' not in backfill.Checkpoint(checkpoint_path)
+
+    # the resumed run replays the unwritten events rather than skipping them as duplicates
+    stats = run()
+    assert stats['failed_flushes'] == 0
+    assert set(backfill.Checkpoint(checkpoint_path).done) == set(files)
+    user_ids = [record['userId'] for record in written_records(tmp_path / 'feedback')]
+    assert sorted(user_ids) == sorted(f'user-{number}-{event}' for number in range(2) for event in range(3))
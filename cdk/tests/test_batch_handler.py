@@ -0,0 +1,46 @@
+import json
+
+import boto3
+from moto import mock_aws
+
+import stubs
+
+BUCKET = stubs.BENCHMARK_ENVIRONMENT['S3_DATA_BUCKET']
+
+
+def sqs_record(message_id, body):
+    return {'messageId': message_id, 'body': body, 'eventSource': 'aws:sqs'}
+
+
+def conversation(n):
+    """A two-message conversation whose message ids are unique to conversation n."""
+    return [dict(message, messageId=f"msg-{n}-{message['messageId'][len('msg-'):]}")
+            for message in stubs.synthetic_conversation(2)]
+
+
+@mock_aws
+def test_batch_handler_reports_only_the_failed_events(load_handler):
+    handler = load_handler(FEEDBACK_SINK='s3')
+    s3 = boto3.client('s3', region_name='us-east-1')
+    s3.create_bucket(Bucket=BUCKET)
+    ses = boto3.client('ses', region_name='us-east-1')
+    ses.verify_email_identity(EmailAddress='from@example.com')
+    # moto has no Q Business or Bedrock runtime; S3 and SES are moto's
+    conversations = {f'conversation-{n}': conversation(n) for n in (0, 3)}
+    stubs.install_clients(qbusiness=stubs.StubQBusiness(conversations), bedrock_runtime=stubs.StubBedrockRuntime())
+    events = {n: stubs.feedback_event(f'msg-{n}-0', conversation_id=f'conversation-{n}', user_id=f'user-{n}') for n in range(4)}
+    batch = {'Records': [
+        sqs_record('sqs-0', json.dumps(events[0])),
+        sqs_record('sqs-1', '{"detail": '),  # not JSON
+        sqs_record('sqs-2', json.dumps(events[2])),  # its conversation cannot be read
+        sqs_record('sqs-3', json.dumps(events[3])),
+    ]}
+
+    result = handler.batch_handler(batch, None)
+
+    assert result == {'batchItemFailures': [{'itemIdentifier': 'sqs-1'}, {'itemIdentifier': 'sqs-2'}]}
+    keys = [item['Key'] for item in s3.list_objects_v2(Bucket=BUCKET)['Contents']]
+    assert sorted(key.rsplit('/', 1)[-1] for key in keys) == ['msg-0-0.json', 'msg-3-0.json']
+    assert all(key.startswith('business_q_feedback/feedback/application_id=application-1/year=2024/month=02/day=02/')
+               for key in keys)
+    assert ses.get_send_quota()['SentLast24Hours'] == 2
@@ -0,0 +1,60 @@
+import gzip
+import io
+import json
+from datetime import datetime, timezone
+
+import boto3
+import pyarrow.parquet as pq
+from moto import mock_aws
+
+BUCKET = 'feedback'
+SOURCE = 'business_q_feedback/feedback'
+TARGET = 'business_q_feedback/feedback_parquet'
+DAY = datetime(2024, 2, 2, tzinfo=timezone.utc)
+
+
+def feedback_record(n, submitted_at):
+    return {'messageId': f'msg-{n}', 'applicationId': 'application-1', 'userId': f'user-{n}', 'usefulness': 'NOT_USEFUL',
+            'submittedAt': submitted_at, 'sourceAttribution': [{'title': 'Doc', 'url': 'https://example.com/doc'}],
+            'source_attribution_urls': ['https://example.com/doc']}
+
+
+def put_day(s3):
+    from feedback_sink import sink_record, submitted_time
+    from partitioning import feedback_key, hour_prefix
+
+    # 22:30 on Feb 1 at -02:00 is 00:30 on Feb 2 in UTC
+    record = feedback_record(0, '2024-02-01T22:30:00-02:00')
+    s3.put_object(Bucket=BUCKET, Key=feedback_key('business_q_feedback', record), Body=json.dumps(record))
+    buffered = [feedback_record(n, 'Feb 2, 2024, 2:54:33 PM') for n in (1, 2)]
+    lines = ''.join(json.dumps(sink_record(record, submitted_time(record))) + '\n' for record in buffered)
+    s3.put_object(Bucket=BUCKET, Key=hour_prefix(SOURCE, 'application-1', DAY.replace(hour=14)) + 'feedback-1.json.gz',
+                  Body=gzip.compress(lines.encode('utf-8')))
+
+
+@mock_aws
+def test_compaction_reads_every_sink_and_skips_only_finished_days():
+    from compaction import MANIFEST_NAME, compact_s3_day
+    from partitioning import day_prefix
+
+    s3 = boto3.client('s3', region_name='us-east-1')
+    s3.create_bucket(Bucket=BUCKET)
+    put_day(s3)
+
+    stats = compact_s3_day(s3, BUCKET, SOURCE, TARGET, 'application-1', DAY)
+
+    assert (stats['source_objects'], stats['rows'], stats['skipped']) == (2, 3, False)
+    target = day_prefix(TARGET, 'application-1', DAY)
+    table = pq.read_table(io.BytesIO(s3.get_object(Bucket=BUCKET, Key=target + 'part-00000.parquet')['Body'].read()))
+    rows = {row['messageid']: row for row in table.to_pylist()}
+    assert rows['msg-0']['submitted_at'] == datetime(2024, 2, 2, 0, 30, tzinfo=timezone.utc)
+    assert rows['msg-1']['source_attribution_urls'] == ['https://example.com/doc']
+    manifest = json.loads(s3.get_object(Bucket=BUCKET, Key=target + MANIFEST_NAME)['Body'].read())
+    assert (manifest['parts'], manifest['rows']) == (['part-00000.parquet'], 3)
+
+    assert compact_s3_day(s3, BUCKET, SOURCE, TARGET, 'application-1', DAY)['skipped']
+
+    # a run that stopped after writing its parts left no manifest, so the day is compacted again
+    s3.delete_object(Bucket=BUCKET, Key=target + MANIFEST_NAME)
+    assert not compact_s3_day(s3, BUCKET, SOURCE, TARGET, 'application-1', DAY)['skipped']
+    assert compact_s3_day(s3, BUCKET, SOURCE, TARGET, 'application-1', DAY)['skipped']
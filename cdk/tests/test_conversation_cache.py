@@ -0,0 +1,48 @@
+import stubs
+
+
+def conversation(newest):
+    """Messages m<newest> down to m0, newest first as ListMessages lists them."""
+    return [{'messageId': f'm{n}', 'type': 'USER' if n % 2 else 'SYSTEM', 'body': f'body {n}'}
+            for n in range(newest, -1, -1)]
+
+
+def lookup(handler, target):
+    return handler.find_feedback_messages('application-1', 'conversation-1', 'user-1', target)
+
+
+def test_lookup_keeps_every_page_read_before_the_cached_window(load_handler):
+    handler = load_handler(CONVERSATION_CACHE='memory', LIST_MESSAGES_PAGE_SIZE=3)
+    conversations = {'conversation-1': conversation(10)}
+    stubs.install_clients(qbusiness=stubs.StubQBusiness(conversations))
+
+    index, stats = lookup(handler, 'm9')
+    assert [message['messageId'] for message in index.messages] == ['m10', 'm9', 'm8']
+
+    # two pages of messages arrive after the window was cached
+    conversations['conversation-1'] = conversation(14)
+    index, stats = lookup(handler, 'm11')
+
+    assert stats['cache'] == 'extended'
+    assert [message['messageId'] for message in index.messages] == ['m14', 'm13', 'm12', 'm11', 'm10', 'm9', 'm8']
+    assert index.previous('m11')['messageId'] == 'm12'
+
+    # the window written back holds the pages read before it too
+    index, stats = lookup(handler, 'm13')
+    assert stats['cache'] == 'hit'
+    assert index.previous('m13')['messageId'] == 'm14'
+
+
+def test_target_first_in_cached_window_is_looked_up_again(load_handler):
+    handler = load_handler(CONVERSATION_CACHE='memory', LIST_MESSAGES_PAGE_SIZE=3)
+    conversations = {'conversation-1': conversation(10)}
+    qbusiness = stubs.StubQBusiness(conversations)
+    stubs.install_clients(qbusiness=qbusiness)
+
+    lookup(handler, 'm9')
+    conversations['conversation-1'] = conversation(11)
+    index, stats = lookup(handler, 'm10')
+
+    assert stats['cache'] == 'extended'
+    assert qbusiness.calls['list_messages'] == 2
+    assert index.previous('m10')['messageId'] == 'm11'
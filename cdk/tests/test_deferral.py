@@ -0,0 +1,41 @@
+import json
+
+import stubs
+
+
+class CountdownContext:
+    """A Lambda context whose remaining time drops by step_ms on every check."""
+
+    def __init__(self, remaining_ms, step_ms):
+        self.remaining_ms = remaining_ms
+        self.step_ms = step_ms
+
+    def get_remaining_time_in_millis(self):
+        remaining_ms, self.remaining_ms = self.remaining_ms, self.remaining_ms - self.step_ms
+        return remaining_ms
+
+
+def test_deferred_emails_the_invocation_cannot_cover_are_left_to_sqs(load_handler, monkeypatch):
+    load_handler()
+    import deferral
+    import reporting
+
+    ses = stubs.StubSES()
+    stubs.install_clients(ses=ses)
+    waits = []
+    send_email = reporting.send_email
+
+    def waiting_send_email(*args, max_wait_seconds=None, **kwargs):
+        waits.append(max_wait_seconds)
+        return send_email(*args, max_wait_seconds=max_wait_seconds, **kwargs)
+
+    monkeypatch.setattr(reporting, 'send_email', waiting_send_email)
+    records = [{'messageId': str(n), 'body': json.dumps({'kind': 'email', 'body': f'report {n}'})}
+               for n in range(5)]
+
+    # a task starts only with its 5 s wait and 5 s of reserve left: at 22, 17 and 12 s, not at 7 s
+    result = deferral.lambda_handler({'Records': records}, CountdownContext(22000, 5000))
+
+    assert ses.sent == 3
+    assert waits == [deferral.TASK_MAX_WAIT_SECONDS] * 3
+    assert result == {'batchItemFailures': [{'itemIdentifier': '3'}, {'itemIdentifier': '4'}]}
@@ -0,0 +1,56 @@
+import json
+import os
+
+import stubs
+
+
+def sqs_batch(events):
+    return {'Records': [{'messageId': f'sqs-{n}', 'body': json.dumps(event)} for n, event in enumerate(events)]}
+
+
+def written_records(directory):
+    from feedback_sink import read_records
+
+    records = []
+    for folder, _, files in os.walk(directory):
+        for name in files:
+            with open(os.path.join(folder, name), 'rb') as f:
+                records += read_records(name, f.read())
+    return records
+
+
+class FailingSES(stubs.StubSES):
+    """Fails the first `failures` sends, as SES would after botocore's retries."""
+
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = failures
+
+    def send_email(self, **kwargs):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError('SES unavailable')
+        return super().send_email(**kwargs)
+
+
+def test_failed_report_leaves_no_buffered_record(load_handler, tmp_path):
+    handler = load_handler(FEEDBACK_SINK='buffered', FEEDBACK_SINK_DIRECTORY=tmp_path, ROLLUPS='memory',
+                           IDEMPOTENCY='memory')
+    conversations = {f'conversation-{n}': stubs.synthetic_conversation(2) for n in range(2)}
+    stubs.install_clients(qbusiness=stubs.StubQBusiness(conversations), bedrock_runtime=stubs.StubBedrockRuntime(),
+                          ses=FailingSES(failures=1))
+    events = [stubs.feedback_event('msg-1', conversation_id=f'conversation-{n}', user_id=f'user-{n}') for n in range(2)]
+
+    result = handler.batch_handler(sqs_batch(events), None)
+
+    assert result['batchItemFailures'] == [{'itemIdentifier': 'sqs-0'}]
+    assert [record['userId'] for record in written_records(tmp_path)] == ['user-1']
+    assert handler.rollup_store.query('user') == {'user-1': {'total': 1, 'NOT_USEFUL': 1}}
+
+    # SQS redelivers the failed event, which is written and counted once
+    result = handler.batch_handler(sqs_batch(events[:1]), None)
+
+    assert result['batchItemFailures'] == []
+    assert sorted(record['userId'] for record in written_records(tmp_path)) == ['user-0', 'user-1']
+    assert handler.rollup_store.query('user') == {'user-0': {'total': 1, 'NOT_USEFUL': 1},
+                                                  'user-1': {'total': 1, 'NOT_USEFUL': 1}}
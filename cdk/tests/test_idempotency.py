@@ -0,0 +1,19 @@
+import stubs
+
+
+def test_a_message_not_found_yet_is_processed_on_redelivery(load_handler):
+    handler = load_handler(IDEMPOTENCY='memory', FEEDBACK_SINK='s3')
+    conversations = {'conversation-1': []}
+    qbusiness = stubs.StubQBusiness(conversations)
+    ses = stubs.StubSES()
+    stubs.install_clients(qbusiness=qbusiness, s3=stubs.StubS3(), bedrock_runtime=stubs.StubBedrockRuntime(), ses=ses)
+    event = stubs.feedback_event('msg-0')
+
+    assert handler.process_feedback(event) == ''
+
+    # the conversation caught up: the retried delivery is not taken for a duplicate
+    conversations['conversation-1'] = stubs.synthetic_conversation(2)
+    assert handler.process_feedback(event)
+    assert handler.process_feedback(event) == ''
+    assert qbusiness.calls['list_messages'] == 2
+    assert ses.sent == 1
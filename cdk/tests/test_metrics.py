@@ -0,0 +1,97 @@
+import json
+import logging
+
+import pytest
+
+import metrics
+from applications import application_scope
+
+
+@pytest.fixture
+def lines(monkeypatch):
+    """The EMF lines written during the test, with metrics on whatever METRICS says."""
+    written = []
+    monkeypatch.setattr(metrics, 'METRICS_MODE', 'emf')
+    monkeypatch.setattr(metrics, 'NAMESPACE', 'TestNamespace')
+    monkeypatch.setattr(metrics, 'SERVICE', 'test_service')
+    metrics.set_writer(written.append)
+    yield written
+    metrics.set_writer(None)
+
+
+def test_emit_declares_the_metrics_under_aws(lines):
+    document = metrics.emit({'PersistMs': (12.5, metrics.MILLISECONDS), 'RecordBytes': (2048, metrics.BYTES)},
+                            properties={'conversationId': 'c1'}, dimensions={'ModelId': 'm1'})
+
+    assert [json.loads(line) for line in lines] == [document]
+    declaration, = document['_aws']['CloudWatchMetrics']
+    assert declaration == {
+        'Namespace': 'TestNamespace',
+        'Dimensions': [['Service', 'ModelId']],
+        'Metrics': [{'Name': 'PersistMs', 'Unit': 'Milliseconds'}, {'Name': 'RecordBytes', 'Unit': 'Bytes'}],
+    }
+    assert isinstance(document['_aws']['Timestamp'], int)
+    # values, dimensions and properties are top-level members of the log event
+    assert document['PersistMs'] == 12.5
+    assert document['RecordBytes'] == 2048
+    assert document['Service'] == 'test_service'
+    assert document['ModelId'] == 'm1'
+    assert document['conversationId'] == 'c1'
+
+
+def test_application_scope_adds_the_application_dimension_set(lines):
+    with application_scope('app-1'):
+        scoped = metrics.emit({'FeedbackProcessed': (1, metrics.COUNT)})
+    unscoped = metrics.emit({'FeedbackProcessed': (1, metrics.COUNT)})
+
+    # the totals across applications are kept next to the per-application ones
+    assert scoped['_aws']['CloudWatchMetrics'][0]['Dimensions'] == [['Service'], ['Service', 'ApplicationId']]
+    assert scoped['ApplicationId'] == 'app-1'
+    assert scoped['FeedbackProcessed'] == 1
+    assert unscoped['_aws']['CloudWatchMetrics'][0]['Dimensions'] == [['Service']]
+    assert 'ApplicationId' not in unscoped
+
+
+def test_metrics_off_writes_nothing(lines, monkeypatch):
+    monkeypatch.setattr(metrics, 'METRICS_MODE', 'off')
+
+    assert metrics.emit({'FeedbackProcessed': (1, metrics.COUNT)}) is None
+    assert metrics.emit({}) is None
+    assert lines == []
+
+
+def test_set_writer_none_restores_stdout(lines, capsys):
+    metrics.emit({'FeedbackProcessed': (1, metrics.COUNT)})
+    metrics.set_writer(None)
+    metrics.emit({'FeedbackProcessed': (2, metrics.COUNT)})
+
+    assert [json.loads(line)['FeedbackProcessed'] for line in lines] == [1]
+    assert json.loads(capsys.readouterr().out)['FeedbackProcessed'] == 2
+
+
+@pytest.mark.parametrize('sample_rate, expected', [(0.0, False), (1.0, True)])
+def test_payload_logging_is_sampled(monkeypatch, caplog, sample_rate, expected):
+    monkeypatch.setattr(metrics, 'PAYLOAD_LOG_SAMPLE_RATE', sample_rate)
+    caplog.set_level(logging.INFO)
+
+    enabled = metrics.payload_logging_enabled()
+    metrics.log_payload(enabled, 'record', {'comment': 'x' * 10})
+
+    assert enabled is expected
+    assert ('record: {"comment": "xxxxxxxxxx"}' in caplog.messages) is expected
+
+
+def test_debug_logging_logs_every_payload(monkeypatch, caplog):
+    monkeypatch.setattr(metrics, 'PAYLOAD_LOG_SAMPLE_RATE', 0.0)
+    caplog.set_level(logging.DEBUG)
+
+    assert metrics.payload_logging_enabled()
+
+
+def test_long_payloads_are_cut(monkeypatch, caplog):
+    monkeypatch.setattr(metrics, 'PAYLOAD_LOG_MAX_CHARS', 10)
+    caplog.set_level(logging.INFO)
+
+    metrics.log_payload(True, 'report', 'y' * 25)
+
+    assert caplog.messages == ['report: yyyyyyyyyy... (25 chars)']
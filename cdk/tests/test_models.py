@@ -0,0 +1,112 @@
+import json
+
+import pytest
+
+import stubs
+
+
+@pytest.fixture
+def model_metrics(load_handler, monkeypatch):
+    """The EMF documents of the Bedrock calls made during the test."""
+    load_handler()
+    import metrics
+
+    lines = []
+    monkeypatch.setattr(metrics, 'METRICS_MODE', 'emf')
+    metrics.set_writer(lines.append)
+    yield lambda: [document for document in map(json.loads, lines) if 'ModelTotalMs' in document]
+    metrics.set_writer(None)
+
+
+class TokenizingBedrock(stubs.StubBedrockRuntime):
+    """Reports 123 input and 45 output tokens, which a count of four characters per token would not give."""
+
+    @staticmethod
+    def tokens(prompt, completion):
+        return 123, 45
+
+
+class CountingBedrock(stubs.StubBedrockRuntime):
+    """Counts the stream chunks its caller has read."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.chunks_read = 0
+
+    def stream_events(self, messages, prompt, completion):
+        for event in super().stream_events(messages, prompt, completion):
+            self.chunks_read += 1
+            yield event
+
+
+@pytest.mark.parametrize('request_format', ['messages', 'completion'])
+@pytest.mark.parametrize('streaming', [True, False])
+def test_invoke_publishes_the_token_counts_bedrock_reports(model_metrics, request_format, streaming):
+    from models import ModelInvoker
+
+    bedrock = TokenizingBedrock(completion='x' * 400)
+    stubs.install_clients(bedrock_runtime=bedrock)
+
+    text = ModelInvoker(request_format=request_format, streaming=streaming).invoke(
+        'model-1', 'Why was this answer rated not useful?', max_tokens=50)
+
+    assert text == 'x' * 200
+    document, = model_metrics()
+    assert (document['ModelInputTokens'], document['ModelOutputTokens']) == (123, 45)
+    assert 0 <= document['ModelTimeToFirstTokenMs'] <= document['ModelTotalMs']
+    assert document['ModelId'] == 'model-1' and document['requestFormat'] == request_format
+    assert document['streaming'] is streaming
+    assert bedrock.calls == {'invoke_model_with_response_stream' if streaming else 'invoke_model': 1}
+
+
+def test_stream_yields_the_report_as_it_arrives(model_metrics):
+    from models import ModelInvoker
+
+    bedrock = CountingBedrock(completion='Key Suggestion: add examples. ' * 8, chunks=4, first_token_latency=0.02)
+    stubs.install_clients(bedrock_runtime=bedrock)
+
+    stream = ModelInvoker().stream('model-1', 'prompt')
+    first = next(stream)
+
+    # message_start and the first delta only; the metrics follow once the stream ends
+    assert first and bedrock.chunks_read == 2
+    assert model_metrics() == []
+    assert first + ''.join(stream) == 'Key Suggestion: add examples. ' * 8
+    document, = model_metrics()
+    assert document['ModelTimeToFirstTokenMs'] >= 20 and document['ModelOutputTokens'] == 60
+
+
+def test_invoke_estimates_the_tokens_bedrock_does_not_report(model_metrics):
+    from models import ModelInvoker
+
+    class UncountedBedrock(stubs.StubBedrockRuntime):
+        def invoke_model(self, modelId, body, **kwargs):
+            return {'body': super().invoke_model(modelId, body, **kwargs)['body']}
+
+    stubs.install_clients(bedrock_runtime=UncountedBedrock(completion='x' * 400))
+
+    ModelInvoker(request_format='completion', streaming=False).invoke('model-1', 'p' * 80, max_tokens=50)
+
+    document, = model_metrics()
+    assert (document['ModelInputTokens'], document['ModelOutputTokens']) == (20, 50)
+
+
+def test_the_report_email_reads_the_model_stream(load_handler):
+    handler = load_handler(REPORT_FORMAT='template', RECOMMENDATION_CACHE='memory')
+    recommendations = 'Key Suggestion: add examples. Recommendations: link the setup guide. '
+    bedrock = CountingBedrock(completion=recommendations, chunks=4)
+    stubs.install_clients(bedrock_runtime=bedrock)
+    record = {'messageId': 'msg-1', 'query': 'How do I set it up?', 'message': 'See the guide.', 'userId': 'user-1',
+              'usefulness': 'NOT_USEFUL', 'usefulness_comment': '', 'submittedAt': '2024-02-02T14:54:33Z',
+              'applicationId': 'application-1', 'sourceAttribution': [], 'source_attribution_urls': []}
+
+    report = handler.generate_recommendation(record)
+
+    # the recommend stage returns once the first chunk arrived; the email reads the rest
+    assert bedrock.chunks_read == 2
+    text, html = handler.format_report(record, report)
+    assert text.rstrip().endswith(recommendations.strip()) and recommendations.strip() in html
+    assert bedrock.chunks_read == 7
+    # the whole report was cached once the stream ended
+    assert handler.generate_recommendation(record) == recommendations
+    assert bedrock.calls == {'invoke_model_with_response_stream': 1}
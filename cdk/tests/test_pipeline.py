@@ -0,0 +1,46 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+
+def test_stages_waiting_on_a_slow_stage_leave_the_workers_free():
+    from pipeline import run_stages
+
+    pool = ThreadPoolExecutor(max_workers=2)
+    started, other_ran = threading.Event(), threading.Event()
+
+    def slow():
+        # finishes once the other invocation's stage had a worker, or gives up
+        started.set()
+        return other_ran.wait(timeout=5)
+
+    def run_first():
+        return run_stages([('lookup', slow, []), ('persist', lambda ran: ran, ['lookup']),
+                           ('recommend', lambda ran: ran, ['lookup'])], pool=pool)
+
+    with ThreadPoolExecutor(max_workers=1) as invocations:
+        first = invocations.submit(run_first)
+        started.wait()
+        second = run_stages([('email', other_ran.set, [])], pool=pool)
+
+        results = first.result()
+
+    assert second['email'].error is None
+    assert {name: result.value for name, result in results.items()} == {'lookup': True, 'persist': True, 'recommend': True}
+
+
+def test_a_failed_stage_skips_its_dependents_only():
+    from pipeline import StageFailure, run_stages
+
+    def fail():
+        raise RuntimeError('S3 unavailable')
+
+    with pytest.raises(StageFailure) as failure:
+        run_stages([('persist', fail, []), ('rollups', lambda _: None, ['persist']),
+                    ('recommend', lambda: 'report', []), ('email', lambda report: report.upper(), ['recommend'])],
+                   pool=ThreadPoolExecutor(max_workers=1))
+
+    results = failure.value.stage_results
+    assert [result.name for result in failure.value.results] == ['persist']
+    assert results['rollups'].skipped and results['email'].value == 'REPORT'
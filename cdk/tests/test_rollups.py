@@ -0,0 +1,59 @@
+import gzip
+import json
+
+import boto3
+from moto import mock_aws
+
+
+def feedback_record(n, usefulness='NOT_USEFUL'):
+    return {'messageId': f'msg-{n}', 'applicationId': 'application-1', 'userId': f'user-{n % 3}',
+            'usefulness': usefulness, 'submittedAt': '2024-02-02T14:54:33Z',
+            'sourceAttribution': [{'title': 'Doc', 'url': f'https://example.com/doc/{n % 2}'}],
+            'source_attribution_urls': [f'https://example.com/doc/{n % 2}']}
+
+
+@mock_aws
+def test_rebuild_reads_object_and_sink_records():
+    from feedback_sink import sink_record, submitted_time
+    from rollups import compute_rollups, load_all_records_from_s3
+
+    s3 = boto3.client('s3', region_name='us-east-1')
+    s3.create_bucket(Bucket='feedback')
+    prefix = 'business_q_feedback/feedback/application_id=application-1/year=2024/month=02/day=02/hour=14/'
+    s3.put_object(Bucket='feedback', Key=prefix + 'msg-0.json', Body=json.dumps(feedback_record(0)))
+    lines = ''.join(json.dumps(sink_record(record, submitted_time(record))) + '\n'
+                    for record in (feedback_record(1), feedback_record(2, 'USEFUL')))
+    s3.put_object(Bucket='feedback', Key=prefix + 'feedback-20240202T150000Z-1.json.gz',
+                  Body=gzip.compress(lines.encode('utf-8')))
+
+    records = load_all_records_from_s3(s3, 'feedback', 'business_q_feedback', workers=2)
+
+    assert sorted(record['messageId'] for record in records) == ['msg-0', 'msg-1', 'msg-2']
+    assert sorted(records, key=lambda record: record['messageId']) == [feedback_record(0), feedback_record(1),
+                                                                       feedback_record(2, 'USEFUL')]
+    assert compute_rollups(records)[('day#application-1', '2024-02-02')] == {'total': 3, 'NOT_USEFUL': 2, 'USEFUL': 1}
+
+
+def test_day_rollup_keys_on_the_utc_submission_day():
+    from rollups import rollup_keys
+
+    for submitted_at, day in (('Feb 2, 2024, 2:54:33 PM', '2024-02-02'), ('2024-02-02T23:30:00-02:00', '2024-02-03'),
+                              ('2024-02-02T14:54:33.120Z', '2024-02-02'), ('yesterday', 'unknown')):
+        record = dict(feedback_record(0), submittedAt=submitted_at)
+        assert rollup_keys(record)[0] == ('day#application-1', day)
+
+
+def test_incremental_rollups_match_a_full_recomputation():
+    from rollups import SQLiteRollupStore, apply_record, compute_rollups, verify
+
+    formats = ('Feb {day}, 2024, 2:54:33 PM', '2024-02-0{day}T14:54:33Z', '2024-02-0{day}T09:00:00.000Z')
+    records = [dict(feedback_record(n, 'USEFUL' if n % 4 == 0 else 'NOT_USEFUL'),
+                    applicationId=f'application-{n % 2}', submittedAt=formats[n % 3].format(day=1 + n % 5))
+               for n in range(60)]
+    store = SQLiteRollupStore()
+    for record in records:
+        apply_record(store, record)
+
+    assert verify(store, records) == []
+    assert store.items() == compute_rollups(records)
+    assert set(store.query('day#application-0')) == {f'2024-02-0{day}' for day in range(1, 6)}
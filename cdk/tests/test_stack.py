@@ -0,0 +1,141 @@
+import json
+import os
+
+import pytest
+from aws_cdk import App
+from aws_cdk.assertions import Template
+
+from conftest import CDK_DIR
+
+SNAPSHOTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snapshots')
+
+
+def template(**context):
+    """The synthesized stack for cdk.context.json with context on top."""
+    from lambda_stack.QLambda_stack import QLambdaStack
+
+    with open(os.path.join(CDK_DIR, 'cdk.context.json')) as f:
+        defaults = json.load(f)
+    defaults.update(from_email='sender@example.com', to_email='recipient@example.com', application_id='application-1')
+    app = App(context=dict(defaults, **context))
+    return Template.from_stack(QLambdaStack(app, 'test'))
+
+
+@pytest.fixture(autouse=True)
+def cdk_dir(monkeypatch):
+    # the Lambda assets are relative to the cdk directory, as for cdk synth
+    monkeypatch.chdir(CDK_DIR)
+    monkeypatch.syspath_prepend(CDK_DIR)
+
+
+def assert_matches_snapshot(name, value):
+    """Compares value with tests/snapshots/<name>.json; UPDATE_SNAPSHOTS=1 rewrites the snapshot."""
+    path = os.path.join(SNAPSHOTS, f'{name}.json')
+    if os.environ.get('UPDATE_SNAPSHOTS') == '1':
+        with open(path, 'w') as f:
+            json.dump(value, f, indent=2, sort_keys=True)
+            f.write('\n')
+    with open(path) as f:
+        assert value == json.load(f)
+
+
+def test_projection_glue_tables_match_the_snapshot():
+    tables = template(glue_table_mode='projection').find_resources('AWS::Glue::Table')
+
+    assert_matches_snapshot('glue_tables', tables)
+    parameters = {logical_id: table['Properties']['TableInput']['Parameters'] for logical_id, table in tables.items()}
+    for table_parameters in parameters.values():
+        assert table_parameters['projection.enabled'] == 'true'
+        assert table_parameters['projection.application_id.values'] == 'application-1'
+        # s3://<bucket>/..., joined with the bucket reference
+        assert table_parameters['storage.location.template']['Fn::Join'][1][-1].endswith(
+            'application_id=${application_id}/year=${year}/month=${month}/day=${day}/'
+            + ('hour=${hour}/' if 'projection.hour.type' in table_parameters else ''))
+
+
+def test_crawler_mode_declares_no_glue_tables():
+    stack = template(glue_table_mode='crawler')
+
+    stack.resource_count_is('AWS::Glue::Table', 0)
+    stack.resource_count_is('AWS::Glue::Crawler', 1)
+
+
+def test_each_application_gets_its_rule_queue_and_limits():
+    from aws_cdk.assertions import Match
+
+    applications = [{'application_id': 'app-a', 'max_concurrency': 10, 'bedrock_requests_per_second': 1}, 'app-b']
+    stack = template(applications=applications, ingestion_mode='sqs', glue_table_mode='projection', reserved_concurrency=20)
+
+    for application_id in ('app-a', 'app-b'):
+        stack.has_resource_properties('AWS::Events::Rule', {'EventPattern': Match.object_like({
+            'detail': Match.object_like({'requestParameters': {'applicationId': [application_id]}})})})
+    # a queue per application and their shared DLQ, next to the deferred email queue and its DLQ
+    stack.resource_count_is('AWS::SQS::Queue', 2 + 1 + 2)
+    stack.has_resource_properties('AWS::Lambda::EventSourceMapping', {'ScalingConfig': {'MaximumConcurrency': 10}})
+    stack.has_resource_properties('AWS::Lambda::EventSourceMapping', {'ScalingConfig': {'MaximumConcurrency': 5}})
+    stack.has_resource_properties('AWS::Lambda::Function', {
+        'FunctionName': 'businessq_feedback_processor',
+        'ReservedConcurrentExecutions': 20,
+        'Environment': {'Variables': Match.object_like({
+            'APPLICATION_RATE_LIMITS': json.dumps({'app-a': {'bedrock-runtime': 1.0}})})}})
+    stack.has_resource_properties('AWS::IAM::Policy', {'PolicyDocument': {'Statement': Match.array_with([
+        Match.object_like({'Action': 'qbusiness:ListMessages', 'Resource': [Match.any_value(), Match.any_value()]})])}})
+    stack.has_resource_properties('AWS::Glue::Table', {'TableInput': Match.object_like({
+        'Parameters': Match.object_like({'projection.application_id.values': 'app-a,app-b'})})})
+
+
+def test_application_id_alone_configures_one_directly_invoked_application():
+    from aws_cdk.assertions import Match
+
+    stack = template(application_id='legacy-application')
+
+    stack.has_resource_properties('AWS::Events::Rule', {'EventPattern': Match.object_like({
+        'detail': Match.object_like({'requestParameters': {'applicationId': ['legacy-application']}})})})
+    stack.resource_count_is('AWS::Lambda::EventSourceMapping', 1)  # the deferred email queue only
+    consumer, = [resource['Properties'] for resource in stack.find_resources('AWS::Lambda::Function').values()
+                 if resource['Properties'].get('FunctionName') == 'businessq_feedback_processor']
+    assert 'ReservedConcurrentExecutions' not in consumer
+    assert 'APPLICATION_RATE_LIMITS' not in consumer['Environment']['Variables']
+
+
+def test_a_comma_separated_applications_string_lists_the_applications():
+    stack = template(applications='app-1, app-2,', ingestion_mode='sqs')
+
+    stack.resource_count_is('AWS::Lambda::EventSourceMapping', 2 + 1)
+    rules = [rule['Properties']['EventPattern']['detail']['requestParameters']['applicationId']
+             for rule in stack.find_resources('AWS::Events::Rule').values() if 'EventPattern' in rule['Properties']]
+    assert sorted(rules) == [['app-1'], ['app-2']]
+
+
+@pytest.mark.parametrize('context, message', [
+    ({'applications': [], 'application_id': ''}, 'Set applications'),
+    ({'applications': None, 'application_id': None}, 'pass -c application_id='),
+    ({'applications': ' , '}, 'Set applications'),
+    ({'applications': [{'application_id': 'app-a', 'max_concurrency': 2}], 'ingestion_mode': 'direct'}, 'needs ingestion_mode sqs'),
+])
+def test_invalid_application_settings_fail_the_synth(context, message):
+    with pytest.raises(ValueError, match=message):
+        template(**context)
+
+
+def bedrock_model_arns(stack):
+    """The foundation model ARNs the feedback role may invoke, as their resource ids."""
+    statements = [statement for policy in stack.find_resources('AWS::IAM::Policy').values()
+                  for statement in policy['Properties']['PolicyDocument']['Statement']
+                  if 'bedrock:InvokeModel' in statement['Action']]
+    # a single resource is not wrapped in a list
+    resources = [arn for statement in statements
+                 for arn in (statement['Resource'] if isinstance(statement['Resource'], list) else [statement['Resource']])]
+    return {arn['Fn::Join'][1][-1].rsplit('/', 1)[-1] for arn in resources}
+
+
+@pytest.mark.parametrize('context, embeds', [
+    ({}, False),
+    ({'clustering': 'memory'}, True),
+    ({'report_mode': 'digest', 'digest_group_by': 'cluster'}, True),
+    ({'report_mode': 'digest', 'digest_group_by': 'reason'}, False),
+])
+def test_the_embedding_model_is_granted_when_feedback_is_clustered(context, embeds):
+    models = bedrock_model_arns(template(embedding_modelid='embedding-model', **context))
+
+    assert ('embedding-model' in models) is embeds